@@ -0,0 +1,178 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+benchmark_pointandclick -- measures the point and click link positions.
+
+Run with: python -m benchmark_pointandclick [lines] [moves]
+
+Builds a synthetic score of the given number of lines (default 10000), with
+five linked notes on every line, and stores the links in the document with
+pointandclick.BoundLinks and, for comparison, with one QTextCursor per link,
+as was done before. For both it prints the memory used, the time to find the
+link at the cursor for the given number of cursor moves (default 20000) and
+the time to type a character at random places in the document (while typing
+the positions of the links need to be adjusted).
+
+For BoundLinks also the time of the full indices() call is printed, which is
+what the editor calls when the cursor moves.
+
+The memory is measured as the growth of the resident set size of the process,
+which is only available on Linux.
+
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication
+
+
+class CursorLinks(object):
+    """Stores links as QTextCursors, like BoundLinks did before."""
+    def __init__(self, doc, links):
+        self._cursors = cursors = []
+        self._destinations = destinations = []
+        for pos, dest in sorted(links.items()):
+            line, column = pos
+            b = doc.findBlockByNumber(line - 1)
+            if b.isValid():
+                c = QTextCursor(doc)
+                c.setPosition(b.position() + column)
+                cursors.append(c)
+                destinations.append(dest)
+
+    def find(self, pos):
+        cursors = self._cursors
+        lo, hi = 0, len(cursors)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pos < cursors[mid].position():
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo - 1
+
+
+def rss():
+    """Returns the resident set size of this process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError):
+        return None
+    import resource
+    return pages * resource.getpagesize()
+
+
+def score(lines):
+    """Returns the text and the links of a synthetic score."""
+    line = "  c'4( d' e') f'8 g' |"
+    columns = [i for i, c in enumerate(line) if c in "cdefg"]
+    links = {}
+    for num in range(1, lines + 1):
+        for col in columns:
+            links[(num, col)] = [('score.ly', num, col)]
+    return '\n'.join([line] * lines), links
+
+
+def build(cls, doc, links):
+    """Returns the instance and the memory it took in bytes (or None)."""
+    before = rss()
+    obj = cls(doc, links)
+    after = rss()
+    return obj, (after - before if before is not None else None)
+
+
+def time_moves(func, positions):
+    """Returns the microseconds per call of func with every position."""
+    start = time.time()
+    for pos in positions:
+        func(pos)
+    return (time.time() - start) / len(positions) * 1e6
+
+
+def time_typing(doc, positions):
+    """Returns the microseconds per character typed at the positions."""
+    cursor = QTextCursor(doc)
+    start = time.time()
+    for pos in positions:
+        cursor.setPosition(pos)
+        cursor.insertText("a")
+    return (time.time() - start) / len(positions) * 1e6
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    lines = args[0] if args else 10000
+    moves = args[1] if len(args) > 1 else 20000
+    app = QApplication(sys.argv[:1])
+
+    import document
+    import pointandclick
+
+    text, links = score(lines)
+    docs = []
+    for i in range(2):
+        doc = document.Document()
+        doc.setPlainText(text)
+        docs.append(doc)
+    bound, boundmem = build(pointandclick.BoundLinks, docs[0], links)
+    cursors, cursormem = build(CursorLinks, docs[1], links)
+
+    length = docs[0].characterCount() - 1
+    rng = random.Random(0)
+    positions = [rng.randrange(length) for i in range(moves)]
+    typed = positions[:max(1, moves // 10)]
+
+    # check that both find the same links
+    for pos in positions[:1000]:
+        assert bound.find(pos) == cursors.find(pos)
+
+    def indices(pos, cursor=QTextCursor(docs[0])):
+        cursor.setPosition(pos)
+        return bound.indices(cursor)
+
+    results = [
+        ("BoundLinks", boundmem, time_moves(bound.find, positions),
+            time_typing(docs[0], typed)),
+        ("QTextCursor", cursormem, time_moves(cursors.find, positions),
+            time_typing(docs[1], typed)),
+    ]
+    # the positions must have been adjusted the same way
+    assert list(bound.positions()) == [c.position() for c in cursors._cursors]
+
+    print("{0} links, {1} cursor moves, {2} characters typed".format(
+        len(links), moves, len(typed)))
+    print("{0:>12} {1:>12} {2:>12} {3:>12}".format(
+        "", "memory (MB)", "find (us)", "typing (us)"))
+    for name, mem, found, typing in results:
+        mem = "n/a" if mem is None else "{0:.1f}".format(mem / 1048576.0)
+        print("{0:>12} {1:>12} {2:>12.2f} {3:>12.2f}".format(name, mem, found, typing))
+    print("BoundLinks.indices(): {0:.2f} us per cursor move".format(
+        time_moves(indices, positions)))
+    del app
+
+
+if __name__ == '__main__':
+    main()
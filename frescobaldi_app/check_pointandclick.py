@@ -0,0 +1,116 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+check_pointandclick -- checks the link positions while links are added.
+
+Run with: python -m check_pointandclick [seeds]
+
+For every seed (default 30) a random text is bound with a quarter of its
+links, as when a document is bound while the links are still being read.
+Then the rest of the links is added in small batches, while random edits are
+made in between. In the end the positions of all links must equal those of
+QTextCursors created for them before the edits, and the destinations,
+cursor() and find() must agree with them.
+
+A small chunk size is used, so that the chunks are merged and split often.
+
+Exits with a non-zero status if a difference is found.
+
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+
+from PyQt5.QtGui import QTextCursor, QTextDocument
+from PyQt5.QtWidgets import QApplication
+
+
+def check(seed):
+    """Returns None if all is well, otherwise a description of the difference."""
+    import pointandclick
+    rng = random.Random(seed)
+    doc = QTextDocument()
+    doc.documentLayout() # contentsChange is only emitted with a layout
+    lines = ["".join(rng.choice("abc d") for i in range(rng.randint(0, 30)))
+             for j in range(300)]
+    doc.setPlainText("\n".join(lines))
+    keys = [(num + 1, col) for num, line in enumerate(lines)
+            for col in range(len(line)) if rng.random() < 0.3]
+    rng.shuffle(keys)
+    cursors = {}
+    for line, column in keys:
+        c = cursors[(line, column)] = QTextCursor(doc)
+        c.setPosition(doc.findBlockByNumber(line - 1).position() + column)
+
+    bound = pointandclick.BoundLinks(doc, dict((k, [k]) for k in keys[:len(keys)//4]))
+    bound.record(True)
+    rest = keys[len(keys)//4:]
+    cursor = QTextCursor(doc)
+    while rest:
+        for i in range(rng.randint(0, 3)):
+            length = doc.characterCount() - 1
+            pos = rng.randrange(length + 1)
+            cursor.setPosition(pos)
+            if rng.random() < 0.5 and pos < length:
+                cursor.setPosition(min(length, pos + rng.randint(1, 6)),
+                                   QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            else:
+                cursor.insertText(rng.choice(["x", "\n", "yy\nz", "  "]))
+        count = rng.randint(1, 40)
+        bound.add_links((k, [k]) for k in rest[:count])
+        del rest[:count]
+    bound.record(False)
+
+    keys.sort(key=lambda k: (cursors[k].position(), k))
+    positions = [cursors[k].position() for k in keys]
+    if list(bound.positions()) != positions:
+        return "positions differ"
+    if list(bound.destinations()) != [[k] for k in keys]:
+        return "destinations differ"
+    if bound.destinations()[10:50] != [[k] for k in keys[10:50]]:
+        return "slice of destinations differs"
+    for k in keys:
+        if bound.cursor(*k).position() != cursors[k].position():
+            return "cursor({0}, {1}) differs".format(*k)
+        if bound.position(bound.find(cursors[k].position())) != cursors[k].position():
+            return "find() differs"
+
+
+def main():
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    app = QApplication(sys.argv[:1])
+    import pointandclick
+    pointandclick.BoundLinks.chunksize = 8
+    failed = 0
+    for seed in range(seeds):
+        result = check(seed)
+        if result:
+            print("seed {0}: {1}".format(seed, result))
+            failed += 1
+    print("{0} seeds: {1} failed".format(seeds, failed))
+    del app
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
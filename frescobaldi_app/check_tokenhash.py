@@ -0,0 +1,130 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+check_tokenhash -- checks the token hash kept for autocompile.
+
+Run with: python -m check_tokenhash [seeds] [edits]
+
+For every seed (default 20) a random LilyPond text is loaded in a document,
+and the given number of random edits (default 100) is made. After every edit
+the token hash of the document must equal that of a new document with the
+same text. The first line, which is not edited, sets the mode, as a text
+starting with < would otherwise be highlighted as HTML.
+
+Also the pieces of the text are joined in different ways, with spaces, line
+breaks or line comments in between, which must all give the same hash.
+
+A small chunk size is used, so that the chunks are split often.
+
+Exits with a non-zero status if a difference is found.
+
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication
+
+
+HEADER = "% -*- mode: lilypond; -*-\n"
+
+PIECES = [
+    "{", "}", "c'4", "d8.", "e", "<c e g>2", "\\relative", "\\new Staff",
+    "r4", "|", '"a b"', "%{ block\ncomment %}", "\\markup { text }", "~",
+]
+
+SEPARATORS = [" ", "\n", "\n\n", "  % comment\n", "\t"]
+
+
+def random_text(rng, count, separators=SEPARATORS):
+    """Returns a text of count random pieces, joined with random separators."""
+    return join(rng, [rng.choice(PIECES) for i in range(count)], separators)
+
+
+def join(rng, pieces, separators=SEPARATORS):
+    """Joins the pieces with random separators."""
+    result = []
+    for piece in pieces:
+        result.append(piece)
+        result.append(rng.choice(separators))
+    return "".join(result)
+
+
+def hash_of(text):
+    """Returns the token hash of a new document with the text."""
+    import document
+    import tokenhash
+    doc = document.Document()
+    doc.setPlainText(text)
+    return tokenhash.token_hash(doc)
+
+
+def check(seed, edits):
+    """Returns None if all is well, otherwise a description of the difference."""
+    import document
+    import tokenhash
+    rng = random.Random(seed)
+    pieces = [rng.choice(PIECES) for i in range(200)]
+    h = hash_of(HEADER + join(rng, pieces, [" "]))
+    for i in range(5):
+        if hash_of(HEADER + join(rng, pieces)) != h:
+            return "the line breaks or comments changed the hash"
+
+    doc = document.Document()
+    doc.setPlainText(HEADER + join(rng, pieces))
+    tokenhash.token_hash(doc)
+    cursor = QTextCursor(doc)
+    for num in range(edits):
+        length = doc.characterCount() - 1
+        pos = rng.randint(len(HEADER), length)
+        cursor.setPosition(pos)
+        if rng.random() < 0.5 and pos < length:
+            cursor.setPosition(min(length, pos + rng.randint(1, 40)),
+                               QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        else:
+            cursor.insertText(random_text(rng, rng.randint(1, 5)))
+        if tokenhash.token_hash(doc) != hash_of(doc.toPlainText()):
+            return "difference after edit {0}".format(num)
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    seeds = args[0] if args else 20
+    edits = args[1] if len(args) > 1 else 100
+    app = QApplication(sys.argv[:1])
+    import tokenhash
+    tokenhash.TokenHash.chunksize = 4
+    failed = 0
+    for seed in range(seeds):
+        result = check(seed, edits)
+        if result:
+            print("seed {0}: {1}".format(seed, result))
+            failed += 1
+    print("{0} seeds, {1} edits: {2} failed".format(seeds, edits, failed))
+    del app
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
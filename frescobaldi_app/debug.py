@@ -56,6 +56,14 @@ def modules():
     """Print the list of loaded modules."""
     print('\n'.join(v.__name__ for k, v in sorted(sys.modules.items()) if v is not None))
 
+def cached_documents():
+    """Print the estimated memory use of the documents cached by fileinfo."""
+    import fileinfo
+    info = fileinfo.cache_info()
+    for filename, size in info['files']:
+        print('{0:>10}  {1}'.format(size, filename))
+    print('total: {0} of {1} bytes'.format(info['size'], info['budget']))
+
 
 # avoid builtins._ being overwritten
 sys.displayhook = app.displayhook
@@ -110,6 +110,7 @@ class DocumentInfo(plugin.DocumentPlugin):
         """Called when the document is changed."""
         self._lydocinfo = None
         self._music = None
+        self._includedMusic = None
     
     def lydocinfo(self):
         """Return the lydocinfo instance for our document."""
@@ -128,6 +129,19 @@ class DocumentInfo(plugin.DocumentPlugin):
         self._music.include_path = self.includepath()
         return self._music
     
+    def includedMusic(self):
+        """Return a music.Document instance for another document including ours.
+        
+        Unlike the one returned by music(), the including document may set
+        the include_node and include_path attributes of this instance.
+        
+        """
+        if self._includedMusic is None:
+            import music
+            doc = lydocument.Document(self.document())
+            self._includedMusic = music.Document(doc)
+        return self._includedMusic
+    
     def mode(self, guess=True):
         """Returns the type of document ('lilypond, 'html', etc.).
         
@@ -27,7 +27,9 @@ import re
 from PyQt5.QtCore import QSettings
 
 import app
+import cursortools
 import plugin
+import signals
 
 
 default_outline_patterns = [
@@ -91,23 +93,244 @@ def create_outline_re():
     return re.compile(rx, re.MULTILINE | re.UNICODE)
 
 
+class OutlineItem(object):
+    """An outline item: a match object found in a text block.
+    
+    The match positions are relative to the block, start() returns the
+    position in the document.
+    
+    """
+    __slots__ = ('block', 'match')
+    
+    def __init__(self, block, match):
+        self.block = block
+        self.match = match
+    
+    def start(self):
+        """Return the position of the item in the document."""
+        return self.block.position() + self.match.start()
+    
+    def group(self, *args):
+        return self.match.group(*args)
+    
+    def groupdict(self, default=None):
+        return self.match.groupdict(default)
+    
+    def equals(self, other):
+        """Return True if other has the same match text at the same block offset."""
+        return (self.match.start() == other.match.start()
+                and self.match.groupdict() == other.match.groupdict()
+                and self.match.group() == other.match.group())
+
+
+class BlockIndex(object):
+    """Keeps a tuple of items for every block of a document, in chunks of lines.
+    
+    A segment tree over the chunks keeps the number of lines and items per
+    chunk, so the chunk containing a line and the number of items before it
+    are found in a few steps, and replacing lines only changes one chunk
+    (unless the change spans multiple chunks).
+    
+    """
+    chunksize = 64
+    
+    def __init__(self, blocks):
+        size = self.chunksize
+        self._chunks = [blocks[i:i+size] for i in range(0, len(blocks), size)] or [[]]
+        self._build()
+    
+    def __len__(self):
+        return self._tree[1][0]
+    
+    def _build(self):
+        """Build the segment tree over the chunks."""
+        size = 1
+        while size < len(self._chunks):
+            size *= 2
+        self._size = size
+        self._tree = tree = [(0, 0)] * (2 * size)
+        for i, c in enumerate(self._chunks):
+            tree[size + i] = (len(c), sum(map(len, c)))
+        for i in range(size - 1, 0, -1):
+            tree[i] = (tree[2*i][0] + tree[2*i+1][0], tree[2*i][1] + tree[2*i+1][1])
+    
+    def _update(self, index):
+        """Update the tree after the chunk at index changed."""
+        tree = self._tree
+        i = self._size + index
+        c = self._chunks[index]
+        tree[i] = (len(c), sum(map(len, c)))
+        i //= 2
+        while i:
+            tree[i] = (tree[2*i][0] + tree[2*i+1][0], tree[2*i][1] + tree[2*i+1][1])
+            i //= 2
+    
+    def _find_line(self, line):
+        """Return (chunk index, offset) for the line.
+        
+        The line after the last line gives the last chunk.
+        
+        """
+        tree = self._tree
+        i = 1
+        while i < self._size:
+            if line < tree[2*i][0] or tree[2*i+1][0] == 0:
+                i = 2 * i
+            else:
+                line -= tree[2*i][0]
+                i = 2 * i + 1
+        return i - self._size, line
+    
+    def _prefix(self, index):
+        """Return (lines, items) before the chunk at index."""
+        tree = self._tree
+        lines = items = 0
+        i = self._size + index
+        while i > 1:
+            if i & 1:
+                lines += tree[i - 1][0]
+                items += tree[i - 1][1]
+            i //= 2
+        return lines, items
+    
+    def items_before(self, line):
+        """Return the number of items in the lines before line."""
+        index, offset = self._find_line(line)
+        return self._prefix(index)[1] + sum(map(len, self._chunks[index][:offset]))
+    
+    def get(self, start, end):
+        """Return the list of the item tuples of the lines from start to end."""
+        index, offset = self._find_line(start)
+        result = []
+        count = end - start
+        while len(result) < count:
+            c = self._chunks[index]
+            result.extend(c[offset:offset+count-len(result)])
+            index += 1
+            offset = 0
+        return result
+    
+    def replace(self, start, end, blocks):
+        """Replace the item tuples of the lines from start to end with blocks."""
+        index, offset = self._find_line(start)
+        chunk = self._chunks[index]
+        if offset + end - start <= len(chunk):
+            chunk[offset:offset+end-start] = blocks
+            if len(chunk) <= 2 * self.chunksize and (chunk or len(self._chunks) == 1):
+                self._update(index)
+                return
+            last = index
+        else:
+            # the change spans multiple chunks
+            last = index
+            stop = offset + end - start
+            while stop > len(self._chunks[last]):
+                stop -= len(self._chunks[last])
+                last += 1
+            lines = []
+            for c in self._chunks[index:last+1]:
+                lines.extend(c)
+            lines[offset:offset+end-start] = blocks
+            chunk = lines
+        size = self.chunksize
+        self._chunks[index:last+1] = [chunk[i:i+size]
+                                      for i in range(0, len(chunk), size)]
+        if not self._chunks:
+            self._chunks.append([])
+        self._build()
+
+
 class DocumentStructure(plugin.DocumentPlugin):
+    """Keeps the outline items of a Document, per text block.
+    
+    After outline() has been called once, the items are kept up to date
+    on every change: only the blocks touched by a change are searched again,
+    and outlineChanged(index, removed, added) is emitted when items in the
+    outline list have been removed or added.
+    
+    The items are searched for in the text of every block, so a pattern
+    does not match across the end of a line.
+    
+    """
+    outlineChanged = signals.Signal() # index, removed, added
+    
     def __init__(self, document):
         self._outline = None
+        self._blocks = None
     
     def invalidate(self):
-        """Called when the document changes or the settings are changed."""
+        """Called when the settings are changed."""
         self._outline = None
+        self._blocks = None
         app.settingsChanged.disconnect(self.invalidate)
-        self.document().contentsChanged.disconnect(self.invalidate)
+        self.document().contentsChange.disconnect(self.slotContentsChange)
     
     def outline(self):
-        """Return the document outline as a series of match objects."""
+        """Return the document outline as a list of OutlineItem objects."""
         if self._outline is None:
-            self._outline = list(outline_re().finditer(self.document().toPlainText()))
-            self.document().contentsChanged.connect(self.invalidate)
+            self._build()
+            self.document().contentsChange.connect(self.slotContentsChange)
             app.settingsChanged.connect(self.invalidate, -999)
         return self._outline
-
+    
+    def _build(self):
+        """Search all blocks."""
+        blocks = [self._search(b) for b in cursortools.all_blocks(self.document())]
+        self._blocks = BlockIndex(blocks)
+        self._outline = [i for items in blocks for i in items]
+    
+    def _search(self, block):
+        """Return a tuple of the OutlineItems in the block."""
+        return tuple(OutlineItem(block, m)
+                     for m in outline_re().finditer(block.text()))
+    
+    def slotContentsChange(self, position, removed, added):
+        """Search the changed blocks again and update the outline."""
+        doc = self.document()
+        first = doc.findBlock(position)
+        last = doc.findBlock(position + added)
+        if not last.isValid():
+            last = doc.lastBlock()
+        if not first.isValid():
+            first = last
+        start, end = first.blockNumber(), last.blockNumber() + 1
+        old_end = end - doc.blockCount() + len(self._blocks)
+        if old_end < start or old_end > len(self._blocks):
+            # should not happen, but be safe
+            old = self._outline
+            self._build()
+            self.outlineChanged(0, len(old), len(self._outline))
+            return
+        
+        old = [i for items in self._blocks.get(start, old_end) for i in items]
+        blocks = []
+        block = first
+        for n in range(start, end):
+            blocks.append(self._search(block))
+            block = block.next()
+        new = [i for items in blocks for i in items]
+        
+        # keep the items that did not change, they just get their new block
+        count = min(len(old), len(new))
+        head = 0
+        while head < count and old[head].equals(new[head]):
+            head += 1
+        tail = 0
+        while tail < count - head and old[-1-tail].equals(new[-1-tail]):
+            tail += 1
+        for o, n in zip(old[:head] + old[len(old)-tail:], new[:head] + new[len(new)-tail:]):
+            o.block, o.match = n.block, n.match
+        if head or tail:
+            replace = dict(zip(map(id, new[:head] + new[len(new)-tail:]),
+                               old[:head] + old[len(old)-tail:]))
+            blocks = [tuple(replace.get(id(i), i) for i in items) for items in blocks]
+        self._blocks.replace(start, old_end, blocks)
+        
+        removed = len(old) - head - tail
+        added = len(new) - head - tail
+        if removed or added:
+            index = self._blocks.items_before(start) + head
+            self._outline[index:index+removed] = new[head:head+added]
+            self.outlineChanged(index, removed, added)
 
 
@@ -33,6 +33,7 @@ import actioncollection
 import actioncollectionmanager
 import jobmanager
 import jobattributes
+import jobqueue
 import plugin
 import icons
 import signals
@@ -58,6 +59,7 @@ class Engraver(plugin.MainWindowPlugin):
         ac.engrave_publish.triggered.connect(self.engravePublish)
         ac.engrave_debug.triggered.connect(self.engraveLayoutControl)
         ac.engrave_custom.triggered.connect(self.engraveCustom)
+        ac.engrave_session.triggered.connect(self.engraveSession)
         ac.engrave_abort.triggered.connect(self.engraveAbort)
         ac.engrave_autocompile.toggled.connect(self.engraveAutoCompileToggled)
         ac.engrave_open_lilypond_datadir.triggered.connect(self.openLilyPondDatadir)
@@ -65,6 +67,7 @@ class Engraver(plugin.MainWindowPlugin):
         mainwindow.currentDocumentChanged.connect(self.updateActions)
         app.jobStarted.connect(self.updateActions)
         app.jobFinished.connect(self.updateActions)
+        jobqueue.queue().changed.connect(self.updateActions)
         app.jobFinished.connect(self.checkLilyPondInstalled)
         app.jobFinished.connect(self.openDefaultView)
         app.sessionChanged.connect(self.slotSessionChanged)
@@ -90,9 +93,13 @@ class Engraver(plugin.MainWindowPlugin):
                         pass
         return doc
                 
-    def runningJob(self):
-        """Returns a Job for the sticky or current document if that is running."""
-        doc = self.document()
+    def runningJob(self, doc=None):
+        """Returns a Job for the document if that is running.
+        
+        If no document is given, the sticky or current document is used.
+        
+        """
+        doc = doc or self.document()
         job = jobmanager.job(doc)
         if job and job.is_running() and not jobattributes.get(job).hidden:
             return job
@@ -105,7 +112,8 @@ class Engraver(plugin.MainWindowPlugin):
         ac.engrave_preview.setEnabled(not visible)
         ac.engrave_publish.setEnabled(not visible)
         ac.engrave_debug.setEnabled(not visible)
-        ac.engrave_abort.setEnabled(running)
+        ac.engrave_abort.setEnabled(running
+            or bool(jobmanager.waiting_job(self.document())))
         ac.engrave_runner.setIcon(icons.get('process-stop' if visible else 'lilypond-run'))
         ac.engrave_runner.setToolTip(_("Abort engraving job") if visible else
                     _("Engrave (preview; press Shift for custom)"))
@@ -167,6 +175,24 @@ class Engraver(plugin.MainWindowPlugin):
             self.saveDocumentIfDesired()
             self.runJob(dlg.getJob(doc), doc)
     
+    def engraveSession(self):
+        """Starts engrave jobs in publish mode for all open documents.
+        
+        Only LilyPond documents that create output are engraved, and documents
+        that are already being engraved are skipped. The jobs are queued and
+        run concurrently, as far as the preferences allow.
+        
+        """
+        import documentinfo
+        self.saveDocumentIfDesired()
+        for doc in app.documents:
+            if self.runningJob(doc):
+                continue
+            dinfo = documentinfo.docinfo(doc)
+            if (dinfo.mode() == "lilypond" and dinfo.complete()
+                and documentinfo.music(doc).has_output()):
+                self.engrave('publish', doc, False)
+    
     def engrave(self, mode='preview', document=None, may_save=True):
         """Starts an engraving job.
         
@@ -192,11 +218,16 @@ class Engraver(plugin.MainWindowPlugin):
         doc = document or self.document()
         if may_save:
             self.saveDocumentIfDesired()
-        from . import command
-        self.runJob(command.defaultJob(doc, args), doc)
+        from . import command, partial
+        job = None
+        if mode == 'preview' and partial.enabled():
+            job = partial.job(doc, args)
+        self.runJob(job or command.defaultJob(doc, args), doc)
     
     def engraveAbort(self):
-        job = jobmanager.job(self.document())
+        mgr = jobmanager.manager(self.document())
+        mgr.cancel_waiting_job()
+        job = mgr.job()
         if job and job.is_running():
             job.abort()
     
@@ -241,7 +272,8 @@ class Engraver(plugin.MainWindowPlugin):
     def runJob(self, job, document):
         """Runs the engraving job on behalf of document."""
         jobattributes.get(job).mainwindow = self.mainwindow()
-        # cancel running job, that would be an autocompile job
+        # cancel running job, that would be an autocompile job;
+        # the new job replaces a job still waiting in the queue
         rjob = jobmanager.job(document)
         if rjob and rjob.is_running():
             rjob.abort()
@@ -376,6 +408,7 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_publish = QAction(parent)
         self.engrave_debug = QAction(parent)
         self.engrave_custom = QAction(parent)
+        self.engrave_session = QAction(parent)
         self.engrave_abort = QAction(parent)
         self.engrave_autocompile = QAction(parent)
         self.engrave_autocompile.setCheckable(True)
@@ -392,6 +425,7 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_publish.setIcon(icons.get('lilypond-run'))
         self.engrave_debug.setIcon(icons.get('lilypond-run'))
         self.engrave_custom.setIcon(icons.get('lilypond-run'))
+        self.engrave_session.setIcon(icons.get('lilypond-run'))
         self.engrave_abort.setIcon(icons.get('process-stop'))
         
 
@@ -402,6 +436,7 @@ class Actions(actioncollection.ActionCollection):
         self.engrave_publish.setText(_("Engrave (&publish)"))
         self.engrave_debug.setText(_("Engrave (&layout control)"))
         self.engrave_custom.setText(_("Engrave (&custom)..."))
+        self.engrave_session.setText(_("Engrave All &Documents (publish)"))
         self.engrave_abort.setText(_("Abort Engraving &Job"))
         self.engrave_autocompile.setText(_("Automatic E&ngrave"))
         self.engrave_open_lilypond_datadir.setText(_("Open LilyPond &Data Directory"))
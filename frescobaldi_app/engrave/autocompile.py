@@ -42,10 +42,12 @@ import resultfiles
 import jobattributes
 import jobmanager
 import plugin
+import tokenhash
 import ly.lex
 
 from . import engraver
 from . import command
+from . import partial
 
 
 class AutoCompiler(plugin.MainWindowPlugin):
@@ -110,7 +112,9 @@ class AutoCompiler(plugin.MainWindowPlugin):
                 if may_compile:
                     mgr.slotJobStarted()
         if may_compile:
-            job = command.defaultJob(doc, ['-dpoint-and-click'])
+            args = ['-dpoint-and-click']
+            job = partial.enabled() and partial.job(doc, args)
+            job = job or command.defaultJob(doc, args)
             jobattributes.get(job).hidden = True
             eng.runJob(job, doc)
 
@@ -138,7 +142,7 @@ class AutoCompileManager(plugin.DocumentPlugin):
             else:
                 ext = '.pdf'
             self._dirty = not resultfiles.results(document).files(ext)
-        self._hash = None if self._dirty else documentinfo.docinfo(document).token_hash()
+        self._hash = None if self._dirty else tokenhash.token_hash(document)
     
     def may_compile(self):
         """Return True if we could need to compile the document."""
@@ -149,10 +153,10 @@ class AutoCompileManager(plugin.DocumentPlugin):
                 and (path.endswith('.ly') or path == '')
                 and dinfo.complete()
                 and documentinfo.music(self.document()).has_output()):
-                h = dinfo.token_hash()
+                h = tokenhash.token_hash(self.document())
                 if h != self._hash:
                     self._hash = h
-                    if h != hash(tuple()):
+                    if h:
                         return True
             self._dirty = False
     
@@ -181,6 +185,6 @@ class AutoCompileManager(plugin.DocumentPlugin):
         """Called when an engraving job is started on this document."""
         if self._dirty:
             self._dirty = False
-            self._hash = documentinfo.docinfo(self.document()).token_hash()
+            self._hash = tokenhash.token_hash(self.document())
 
 
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+This script measures how much faster LilyPond engraves files when it is kept
+running with server.scm, compared to starting LilyPond for every file.
+
+Usage: benchmark_server.py [-n RUNS] [-l LILYPOND] file.ly [file.ly ...]
+
+Every file is engraved RUNS times (default 5) both ways, and the average
+times are printed. The output files are written in the directories of the
+files.
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def script():
+    """Return the filename of server.scm."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.scm')
+
+
+def cold(lilypond, filename):
+    """Engrave filename starting LilyPond, return the time in seconds."""
+    start = time.time()
+    subprocess.call([lilypond, os.path.basename(filename)],
+                    cwd=os.path.dirname(filename),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.time() - start
+
+
+class Server(object):
+    """A LilyPond process running server.scm."""
+    def __init__(self, lilypond):
+        start = time.time()
+        path = script().replace('\\', '/').replace('"', '\\"')
+        self.process = subprocess.Popen(
+            [lilypond, '-e', '(load "{0}")'.format(path)],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if self.wait() != 'ready':
+            sys.exit("LilyPond could not be started with server.scm")
+        self.startup = time.time() - start
+
+    def wait(self):
+        """Read standard error until a message of server.scm, return it."""
+        for line in self.process.stderr:
+            if line.startswith(b'frescobaldi-server: '):
+                return line.split()[1].decode()
+
+    def engrave(self, filename):
+        """Engrave filename, return the time in seconds."""
+        start = time.time()
+        self.process.stdin.write(os.fsencode(filename) + b'\n')
+        self.process.stdin.flush()
+        if self.wait() not in ('done', 'failed'):
+            sys.exit("The LilyPond server stopped unexpectedly")
+        return time.time() - start
+
+    def stop(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare engraving with and without a LilyPond server.")
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help="number of runs per file (default: 5)")
+    parser.add_argument('-l', '--lilypond', default='lilypond',
+                        help="LilyPond command (default: lilypond)")
+    parser.add_argument('files', nargs='+', help="LilyPond files to engrave")
+    args = parser.parse_args()
+    files = [os.path.abspath(f) for f in args.files]
+
+    server = Server(args.lilypond)
+    print("Server startup: {0:.2f}s".format(server.startup))
+    total_cold = total_warm = 0.0
+    for filename in files:
+        c = sum(cold(args.lilypond, filename) for i in range(args.runs)) / args.runs
+        w = sum(server.engrave(filename) for i in range(args.runs)) / args.runs
+        total_cold += c
+        total_warm += w
+        print("{0}: cold {1:.2f}s, server {2:.2f}s, speedup {3:.1f}x".format(
+            os.path.basename(filename), c, w, c / w if w else 0))
+    server.stop()
+    print("Total: cold {0:.2f}s, server {1:.2f}s, speedup {2:.1f}x".format(
+        total_cold, total_warm, total_cold / total_warm if total_warm else 0))
+
+
+if __name__ == '__main__':
+    main()
+
+
@@ -30,6 +30,8 @@ import job
 import documentinfo
 import lilypondinfo
 
+from . import server
+
 
 def info(document):
     """Returns a LilyPondInfo instance that should be used by default to engrave the document."""
@@ -50,9 +52,19 @@ def defaultJob(document, args=None):
     
     """
     filename, includepath = documentinfo.info(document).jobinfo(True)
+    return fileJob(document, filename, includepath, args)
+
+
+def fileJob(document, filename, includepath, args=None):
+    """Return a job running LilyPond on filename on behalf of the document.
     
+    includepath is the list of directories to search for included files,
+    args is handled as in defaultJob(). The output is written in the directory
+    of filename.
+    
+    """
     i = info(document)
-    j = job.Job()
+    j = server.ServerJob() if server.enabled() else job.Job()
     
     command = [i.abscommand() or i.command]
     s = QSettings()
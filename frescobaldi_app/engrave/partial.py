@@ -0,0 +1,297 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Engraves only the \\bookpart blocks that changed since the last run.
+
+If a document consists of toplevel \\bookpart blocks (and definitions), LilyPond
+can be run on a copy of the document in which the unchanged \\bookpart blocks
+are left out. In the music viewer, the pages of the engraved \\bookparts then
+replace the pages of the same \\bookparts from the former runs.
+
+The \\bookpart a page belongs to is found using the point and click links on
+the page, so this is only done in preview mode. A full run is done when
+something outside the \\bookpart blocks changed, when \\bookparts were added or
+removed, or when the pages could not be attributed to the \\bookparts.
+
+Every partial run is done in its own directory, so the PDFs of earlier runs
+that still provide pages are kept; the directories of runs that do not provide
+pages anymore are removed.
+
+Page numbers printed on the replaced pages are not updated, so a full run is
+still needed to get a final result.
+
+"""
+
+
+import bisect
+import itertools
+import os
+import re
+import shutil
+import weakref
+
+from PyQt5.QtCore import QSettings
+
+import app
+import documentinfo
+import plugin
+import scratchdir
+import util
+
+from . import command
+
+
+def enabled():
+    """Return True if the user enabled partial engraving."""
+    return QSettings().value("lilypond_settings/partial_engraving", False, bool)
+
+
+def job(document, args=None):
+    """Return a Job that engraves only the changed \\bookparts.
+
+    Returns None if a full run is needed.
+
+    """
+    return PartialEngraving.instance(document).job(args)
+
+
+def pages(document):
+    """Return the spliced pages for the document's last results, if any.
+
+    Returns a three-tuple (filename, pages, sources), where filename is the PDF
+    of the last full run and pages a list of (filename, page number) tuples, or
+    None if the last run was a full run. The sources dictionary maps the
+    LilyPond files of the partial runs to the file of the full run; the point
+    and click links of the pages of a partial run refer to the former.
+
+    """
+    return PartialEngraving.instance(document).pages()
+
+
+def bookparts(document):
+    """Return a list of (start, end) positions of the toplevel \\bookparts.
+
+    Returns None if there are not at least two toplevel \\bookparts, or if
+    there are other toplevel items that create output.
+
+    """
+    import ly.music.items as items
+    ranges = []
+    for node in documentinfo.music(document):
+        if isinstance(node, items.BookPart):
+            ranges.append((node.position, node.end_position()))
+        elif isinstance(node, (items.Book, items.Score, items.Music, items.Markup)):
+            return
+    if len(ranges) > 1:
+        return ranges
+
+
+class Snapshot(object):
+    """The toplevel \\bookparts of a document and the text around them."""
+    def __init__(self, document):
+        self.text = text = document.toPlainText()
+        self.ranges = ranges = bookparts(document) or []
+        outside = []
+        pos = 0
+        for start, end in ranges:
+            outside.append(text[pos:start])
+            pos = end
+        outside.append(text[pos:])
+        self.definitions = hash(tuple(outside))
+        self.hashes = [hash(text[start:end]) for start, end in ranges]
+        # the first and last line of every \bookpart (starting with 1)
+        self.lines = [(document.findBlock(start).blockNumber() + 1,
+                       document.findBlock(end).blockNumber() + 1)
+                      for start, end in ranges]
+
+    def wrapper(self, parts):
+        """Return the text with only the specified \\bookparts.
+
+        The other \\bookparts are replaced with whitespace, so the lines and
+        columns of the remaining text do not change.
+
+        """
+        text = self.text
+        pieces = []
+        pos = 0
+        for i, (start, end) in enumerate(self.ranges):
+            if i not in parts:
+                pieces.append(text[pos:start])
+                pieces.append(re.sub(r'[^\n]', ' ', text[start:end]))
+                pos = end
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+
+def page_parts(filename, source, lines):
+    """Return a list with the index of the \\bookpart of every page of a PDF.
+
+    source is the LilyPond file the PDF was created from, and lines the list of
+    (first, last) line numbers of the \\bookparts in source. A page without a
+    link to a \\bookpart gets the index of the page before it, or -1.
+
+    Returns None if the pages are not in the order of the \\bookparts.
+
+    """
+    import popplerqt5
+    import qpopplerview
+    import textedit
+    from musicview import documents
+    doc = documents.load(filename)
+    if not doc:
+        return
+    starts = [first for first, last in lines]
+    result = []
+    part = -1
+    for num in range(doc.numPages()):
+        with qpopplerview.lock(doc):
+            links = doc.page(num).links()
+        for link in links:
+            if isinstance(link, popplerqt5.Poppler.LinkBrowse):
+                t = textedit.link(link.url())
+                if t and util.equal_paths(t.filename, source):
+                    i = bisect.bisect_right(starts, t.line) - 1
+                    if i >= 0 and t.line <= lines[i][1]:
+                        if i < part:
+                            return
+                        part = i
+                        break
+        result.append(part)
+    return result
+
+
+class PartialEngraving(plugin.DocumentPlugin):
+    """Keeps the state of the last runs needed for partial engraving."""
+    def __init__(self, document):
+        self._full = None       # the PDF of the last full run
+        self._source = None     # the file the last full run was done on
+        self._snapshot = None   # Snapshot of the engraved contents
+        self._pages = None      # list of (filename, page number, part)
+        self._spliced = False   # whether pages from partial runs are used
+        self._sources = {}      # the file a partial run was done on, per PDF
+        self._runs = itertools.count()
+        self._jobs = weakref.WeakKeyDictionary()
+        app.jobStarted.connect(self.slotJobStarted)
+        app.jobFinished.connect(self.slotJobFinished, -10) # before the viewers
+
+    def pages(self):
+        """Return (filename, pages, sources) if partial runs replaced pages, else None."""
+        if self._spliced:
+            source = util.normpath(self._source)
+            sources = dict((util.normpath(self._sources[f]), source)
+                           for f, num, part in self._pages if f in self._sources)
+            return self._full, [(f, num) for f, num, part in self._pages], sources
+
+    def reset(self):
+        """Forget the last runs, so the next run will be a full run."""
+        self._full = self._source = self._snapshot = self._pages = None
+        self._spliced = False
+        self.cleanup()
+
+    def cleanup(self):
+        """Remove the directories of the partial runs that are not used anymore."""
+        directory = scratchdir.scratchdir(self.document()).partialDirectory()
+        if not directory or not os.path.isdir(directory):
+            return
+        used = set(os.path.dirname(f) for f, num, part in self._pages or ())
+        used.update(os.path.dirname(filename)
+            for snapshot, changed, filename in self._jobs.values()
+            if changed is not None)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if path not in used:
+                shutil.rmtree(path, ignore_errors=True)
+        self._sources = dict((pdf, source) for pdf, source in self._sources.items()
+                             if os.path.dirname(pdf) in used)
+
+    def job(self, args=None):
+        """Return a Job engraving only the changed \\bookparts, or None."""
+        document = self.document()
+        last = self._snapshot
+        if last is None:
+            return
+        snapshot = Snapshot(document)
+        if (not snapshot.ranges
+            or len(snapshot.ranges) != len(last.ranges)
+            or snapshot.definitions != last.definitions):
+            return
+        changed = set(i for i, (new, old)
+            in enumerate(zip(snapshot.hashes, last.hashes)) if new != old)
+        if not changed:
+            return
+        if self._pages is None:
+            parts = page_parts(self._full, self._source, last.lines)
+            if not parts:
+                self.reset()
+                return
+            self._pages = [(self._full, num, part) for num, part in enumerate(parts)]
+        filename = scratchdir.scratchdir(document).partialPath(next(self._runs))
+        with open(filename, 'wb') as f:
+            text = util.platform_newlines(snapshot.wrapper(changed))
+            f.write(util.encode(text, document.encoding()))
+        includepath = documentinfo.info(document).includepath()
+        if document.url().toLocalFile():
+            includepath.insert(0, os.path.dirname(document.url().toLocalFile()))
+        j = command.fileJob(document, filename, includepath, args)
+        self._jobs[j] = (snapshot, changed, filename)
+        return j
+
+    def slotJobStarted(self, document, job):
+        """Called when a job starts, takes a Snapshot of full preview runs."""
+        if (document is self.document() and job not in self._jobs
+                and enabled() and '-dpoint-and-click' in job.command):
+            source = documentinfo.info(document).jobinfo()[0]
+            self._jobs[job] = (Snapshot(document), None, source)
+
+    def slotJobFinished(self, document, job, success):
+        """Called when a job finishes, updates the pages."""
+        if document is not self.document():
+            return
+        try:
+            snapshot, changed, source = self._jobs.pop(job)
+        except KeyError:
+            if success:
+                self.reset()
+            return
+        if changed is None:
+            # a full run
+            self.reset()
+            if success and snapshot.ranges:
+                import resultfiles
+                pdfs = resultfiles.results(document).files_lastjob('.pdf')
+                if len(pdfs) == 1:
+                    self._full = pdfs[0]
+                    self._source = source
+                    self._snapshot = snapshot
+        elif success:
+            pdf = os.path.splitext(source)[0] + '.pdf'
+            parts = page_parts(pdf, source, snapshot.lines) if os.path.exists(pdf) else None
+            if not parts or not changed.issubset(parts):
+                self.reset()
+                return
+            new = [(pdf, num, part) for num, part in enumerate(parts) if part in changed]
+            old = [p for p in self._pages if p[2] not in changed]
+            # merge the pages in the order of the \bookparts, stable
+            self._pages = sorted(old + new, key=lambda p: p[2])
+            self._sources[pdf] = source
+            self._snapshot = snapshot
+            self._spliced = True
+            self.cleanup()
+
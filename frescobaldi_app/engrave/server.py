@@ -0,0 +1,291 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Keeps LilyPond processes running, to engrave without LilyPond's startup time.
+
+Starting LilyPond costs some time (starting Guile, loading the Scheme files
+and setting up the fonts) before any file is read. A Server is a LilyPond
+process started with the normal commandline options of a job, that loads
+server.scm and then engraves the files whose names it reads from standard
+input, one after another.
+
+A ServerJob looks for an idle Server started with the same commandline
+options and environment, or starts a new one. If the Server stops
+unexpectedly, or it can't be used with the LilyPond version, the job starts
+LilyPond normally. Servers are stopped after some idle time, and restarted
+after a number of runs to free the memory LilyPond may keep.
+
+"""
+
+
+import os
+import re
+import time
+
+from PyQt5.QtCore import (
+    QCoreApplication, QProcess, QProcessEnvironment, QSettings, QTimer)
+
+import app
+import job
+
+
+# the milliseconds an idle server keeps running
+idle_time = 300000
+
+# the number of files a server engraves before it is restarted
+max_runs = 100
+
+# the lines server.scm writes to standard error
+_message_re = re.compile(br'\n?frescobaldi-server: (ready|done|failed)\n')
+_messages = [b'\nfrescobaldi-server: ' + m + b'\n' for m in (b'ready', b'done', b'failed')]
+
+
+_servers = {}       # key -> list of Server instances
+_stopping = set()   # retired servers that are still running
+_unsupported = set()    # keys of servers that stopped before being ready
+
+
+def enabled():
+    """Return True if the user wants to engrave using a LilyPond server."""
+    return QSettings().value("lilypond_settings/use_server", False, bool)
+
+
+def script():
+    """Return the filename of the Scheme file started by the server."""
+    return os.path.join(os.path.dirname(__file__), 'server.scm')
+
+
+def server(command, environment):
+    """Return an idle Server for the command and environment, or None.
+
+    command is the LilyPond command of a job without the filename. A new
+    Server is started if there is no idle Server. None is returned if a
+    Server with this command stopped before, without getting ready.
+
+    """
+    key = (tuple(command), tuple(sorted(environment.items())))
+    if key in _unsupported:
+        return
+    servers = _servers.setdefault(key, [])
+    for s in servers:
+        if s.is_idle():
+            return s
+    s = Server(key)
+    servers.append(s)
+    return s
+
+
+def _incomplete(data):
+    """Return the length of a possibly incomplete server message ending data."""
+    i = data.rfind(b'\n')
+    tail = data[i:] if i >= 0 else b'\n' + data
+    if any(m.startswith(tail) for m in _messages):
+        return len(data) - max(i, 0)
+    return 0
+
+
+def stop_all():
+    """Stop all running servers."""
+    for servers in list(_servers.values()):
+        for s in list(servers):
+            s.stop()
+
+
+app.aboutToQuit.connect(stop_all)
+
+
+class Server(object):
+    """A running LilyPond process engraving files for ServerJobs."""
+    def __init__(self, key):
+        self._key = key
+        self._job = None
+        self._ready = False
+        self._runs = 0
+        self._stderr = b''
+        self._timer = QTimer(singleShot=True, timeout=self.stop)
+        command, environment = key
+        p = self._process = QProcess(QCoreApplication.instance())
+        p.finished.connect(self._finished)
+        p.error.connect(self._error)
+        p.readyReadStandardError.connect(self._readstderr)
+        p.readyReadStandardOutput.connect(self._readstdout)
+        if environment:
+            se = QProcessEnvironment.systemEnvironment()
+            for k, v in environment:
+                se.remove(k) if v is None else se.insert(k, v)
+            p.setProcessEnvironment(se)
+        path = script().replace('\\', '/').replace('"', '\\"')
+        p.start(command[0], list(command[1:]) + ['-e', '(load "{0}")'.format(path)])
+
+    def is_idle(self):
+        """Return True if the server is running and not engraving a file."""
+        return self._process is not None and self._job is None
+
+    def run(self, job):
+        """Engrave the last item of the job's command; the job is notified.
+
+        The job's server_output(), server_done() and server_stopped() methods
+        are called.
+
+        """
+        self._timer.stop()
+        self._job = job
+        self._runs += 1
+        filename = os.path.abspath(os.path.join(job.directory, job.command[-1]))
+        self._process.write(os.fsencode(filename) + b'\n')
+
+    def stop(self):
+        """Stop the LilyPond process."""
+        self._timer.stop()
+        self._retire()
+        if self._process:
+            if self._job:
+                self._process.kill()
+            else:
+                self._process.closeWriteChannel()   # server.scm exits
+
+    def _readstderr(self):
+        """(internal) Reads standard error, looks for the messages of server.scm."""
+        data = self._stderr + bytes(self._process.readAllStandardError())
+        pos = 0
+        for m in _message_re.finditer(data):
+            self._output(data[pos:m.start()], job.STDERR)
+            pos = m.end()
+            if m.group(1) == b'ready':
+                self._ready = True
+            else:
+                self._done(m.group(1) == b'done')
+        # keep a message that could be incomplete for the next time
+        end = len(data) - _incomplete(data[pos:])
+        self._output(data[pos:end], job.STDERR)
+        self._stderr = data[end:]
+
+    def _readstdout(self):
+        """(internal) Reads standard output."""
+        self._output(bytes(self._process.readAllStandardOutput()), job.STDOUT)
+
+    def _output(self, data, type):
+        """(internal) Gives output to the current job, if any."""
+        if data and self._job:
+            self._job.server_output(data, type)
+
+    def _done(self, success):
+        """(internal) Called when a file has been engraved."""
+        j, self._job = self._job, None
+        if self._runs >= max_runs:
+            self.stop()
+        else:
+            self._timer.start(idle_time)
+        if j:
+            j.server_done(success)
+
+    def _retire(self):
+        """(internal) Makes sure no new jobs are given to this server."""
+        servers = _servers.get(self._key, [])
+        if self in servers:
+            servers.remove(self)
+            _stopping.add(self)
+
+    def _finished(self):
+        """(internal) Called when the LilyPond process has stopped."""
+        if not self._process:
+            return
+        self._timer.stop()
+        self._retire()
+        _stopping.discard(self)
+        # a server runs many jobs, its CPU time is not attributed to any
+        job.skip_cpu_time()
+        self._process.deleteLater()
+        self._process = None
+        if not self._ready:
+            _unsupported.add(self._key)
+        j, self._job = self._job, None
+        if j:
+            j.server_stopped()
+
+    def _error(self, error):
+        """(internal) Called when an error occurs."""
+        if self._process and self._process.state() == QProcess.NotRunning:
+            self._finished()
+
+
+class ServerJob(job.Job):
+    """A Job that engraves using a LilyPond server if possible.
+
+    Set the command up as for a normal LilyPond Job, with the filename last.
+
+    """
+    def __init__(self):
+        super(ServerJob, self).__init__()
+        self._server = None
+
+    def start(self):
+        """Starts engraving in a server, or starts LilyPond normally."""
+        s = server(self.command[:-1], self.environment)
+        if not s:
+            return super(ServerJob, self).start()
+        self._reset()
+        self._server = s
+        self.start_message()
+        s.run(self)
+
+    def is_running(self):
+        """Returns True if this job is running."""
+        return bool(self._server) or super(ServerJob, self).is_running()
+
+    def abort(self):
+        """Abort the job, a server is stopped."""
+        if self._server:
+            self._aborted = True
+            self.abort_message()
+            self._server.stop()
+        else:
+            super(ServerJob, self).abort()
+
+    def server_output(self, data, type):
+        """Called by the server with output (bytes) of type STDERR or STDOUT."""
+        decoder = self.decoder_stderr if type == job.STDERR else self.decoder_stdout
+        self.message(decoder(data, self.decode_errors)[0], type)
+
+    def server_done(self, success):
+        """Called by the server when the file has been engraved."""
+        self._server = None
+        self._elapsed = time.time() - self._starttime
+        self.finish_message(0 if success else 1, QProcess.NormalExit)
+        self.success = success
+        self.done(success)
+
+    def server_stopped(self):
+        """Called by the server when LilyPond stopped while engraving.
+
+        If the job was not aborted, LilyPond is started normally.
+
+        """
+        self._server = None
+        if self._aborted:
+            self._elapsed = time.time() - self._starttime
+            self.success = False
+            self.done(False)
+        else:
+            self.message(_("The LilyPond server stopped unexpectedly, "
+                           "starting LilyPond normally."), job.NEUTRAL)
+            super(ServerJob, self).start()
+
+
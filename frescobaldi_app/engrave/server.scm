@@ -0,0 +1,65 @@
+;;; This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+;;;
+;;; Copyright (c) 2008 - 2014 by Wilbert Berendsen
+;;;
+;;; This program is free software; you can redistribute it and/or
+;;; modify it under the terms of the GNU General Public License
+;;; as published by the Free Software Foundation; either version 2
+;;; of the License, or (at your option) any later version.
+;;;
+;;; See http://www.gnu.org/licenses/ for more information.
+
+;;; Keeps LilyPond running and engraves the files named on standard input.
+;;;
+;;; Loaded with lilypond -e '(load "server.scm")'. Reads one absolute
+;;; filename per line, engraves it in its directory and writes a line
+;;; "frescobaldi-server: done" or "frescobaldi-server: failed" to standard
+;;; error after LilyPond's messages. Exits at the end of standard input.
+;;;
+;;; After every file, the program options are restored and the session is
+;;; terminated, as LilyPond does between the files named on its command line.
+
+(use-modules (ice-9 rdelim) (lily))
+
+(define (frescobaldi-server-message text)
+  (let ((port (current-error-port)))
+    (display "\nfrescobaldi-server: " port)
+    (display text port)
+    (newline port)
+    (force-output port)))
+
+(define (frescobaldi-server-call name)
+  ;; calls a procedure of LilyPond if this version has it
+  (if (defined? name)
+      ((eval name (current-module)))))
+
+(define (frescobaldi-server-engrave filename)
+  ;; engraves the file and resets LilyPond like lilypond-all does
+  ;; after every file, so no settings leak into the next one
+  (let* ((all-settings (ly:all-options))
+         (success
+          (catch #t
+            (lambda ()
+              (chdir (dirname filename))
+              (ly:parse-file (basename filename))
+              #t)
+            (lambda (key . args) #f))))
+    (frescobaldi-server-call 'ly:check-expected-warnings)
+    (frescobaldi-server-call 'session-terminate)
+    (for-each (lambda (s)
+                (ly:set-option (car s) (cdr s)))
+              all-settings)
+    success))
+
+(frescobaldi-server-message "ready")
+(let loop ((line (read-line)))
+  (if (not (eof-object? line))
+      (begin
+        (frescobaldi-server-message
+         (if (frescobaldi-server-engrave line) "done" "failed"))
+        (frescobaldi-server-call 'ly:clear-anonymous-modules)
+        (gc)
+        (if (not (ly:get-option 'debug-gc))
+            (frescobaldi-server-call 'ly:reset-all-fonts))
+        (loop (read-line)))))
+(exit 0)
@@ -19,12 +19,17 @@
 
 """
 Caches information about files, and checks the mtime upon request.
+
+The WatchedFileCache uses a QFileSystemWatcher instead of checking the mtime.
 """
 
 
+import collections
 import os
 import weakref
 
+import signals
+
 
 class FileCache(object):
     """Caches information about files, and checks the mtime upon request.
@@ -108,3 +113,107 @@ class WeakFileCache(FileCache):
             pass
 
 
+class WatchedFileCache(FileCache):
+    """Caches information about files like FileCache, using a file watcher.
+    
+    Instead of checking the mtime of a file on every request, the file is
+    watched with a QFileSystemWatcher and the cached value is discarded as soon
+    as the file changes. The changed signal is then emitted with the filename.
+    
+    If a budget (in bytes) and a sizeof function are given, the least recently
+    used values are discarded when the total of the sizes sizeof() estimates
+    for the values exceeds the budget. Call resize() when a cached value has
+    grown.
+    
+    """
+    changed = signals.Signal() # filename
+    
+    def __init__(self, budget=0, sizeof=None):
+        self._cache = collections.OrderedDict()
+        self._watcher = None
+        self._budget = budget
+        self._sizeof = sizeof
+        self._sizes = {}
+        self._size = 0
+    
+    def watcher(self):
+        """Return the QFileSystemWatcher, creating it if needed."""
+        if self._watcher is None:
+            from PyQt5.QtCore import QFileSystemWatcher
+            self._watcher = QFileSystemWatcher()
+            self._watcher.fileChanged.connect(self._fileChanged)
+        return self._watcher
+    
+    def __getitem__(self, filename):
+        value = self._cache[filename][1]
+        self._cache.move_to_end(filename)
+        return value
+    
+    def __setitem__(self, filename, value):
+        if filename not in self._cache:
+            if not os.path.isfile(filename):
+                return
+            self.watcher().addPath(filename)
+        self._cache[filename] = (None, value)
+        self._cache.move_to_end(filename)
+        self.resize(filename)
+    
+    def __delitem__(self, filename):
+        del self._cache[filename]
+        self._size -= self._sizes.pop(filename, 0)
+        self.watcher().removePath(filename)
+    
+    def __len__(self):
+        return len(self._cache)
+    
+    def filenames(self):
+        """Yields filenames that are still valid in the cache."""
+        return iter(list(self._cache))
+    
+    def clear(self):
+        if self._cache:
+            self.watcher().removePaths(list(self._cache))
+        self._cache.clear()
+        self._sizes.clear()
+        self._size = 0
+    
+    def budget(self):
+        """Return the budget in bytes (0 means unlimited)."""
+        return self._budget
+    
+    def setBudget(self, budget):
+        """Set the budget in bytes (0 means unlimited)."""
+        self._budget = budget
+        self._evict()
+    
+    def size(self, filename=None):
+        """Return the estimated size of all cached values, or of one file."""
+        if filename is None:
+            return self._size
+        return self._sizes.get(filename, 0)
+    
+    def resize(self, filename):
+        """Estimates the size of the value for the filename again.
+        
+        If the total size exceeds the budget, the least recently used values
+        are discarded. The value for filename itself is always kept.
+        
+        """
+        if self._sizeof and filename in self._cache:
+            size = self._sizeof(self._cache[filename][1])
+            self._size += size - self._sizes.get(filename, 0)
+            self._sizes[filename] = size
+            self._evict()
+    
+    def _evict(self):
+        """Discard the least recently used values while over budget."""
+        while self._budget and self._size > self._budget and len(self._cache) > 1:
+            del self[next(iter(self._cache))]
+    
+    def _fileChanged(self, filename):
+        """Called by the watcher when a file changes."""
+        if filename in self._cache:
+            del self[filename]
+            self.changed(filename)
+
+
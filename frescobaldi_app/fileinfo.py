@@ -27,22 +27,19 @@ import re
 import os
 import atexit
 
+from PyQt5.QtCore import QUrl
+
 import ly.document
 import lydocinfo
 import ly.lex
+import app
 import filecache
 import util
 import variables
 
 
-_document_cache = filecache.FileCache()
-_suffix_chars_re = re.compile(r'[^-\w]', re.UNICODE)
-
-
-### XXX otherwise I get a segfault on shutdown when very large music trees
-### are made (and every node references the document).
-### (The segfault is preceded by a "corrupted double-linked list" message.)
-atexit.register(_document_cache.clear)
+# the maximum estimated memory use of the cached documents, in bytes
+cache_budget = 128 * 1024 * 1024
 
 
 class _CachedDocument(object):
@@ -52,6 +49,43 @@ class _CachedDocument(object):
     variables = None
     docinfo = None
     music = None
+    length = 0
+    
+    # estimated memory use per character of text
+    document_size = 24
+    docinfo_size = 4
+    music_size = 64
+    
+    def memory(self):
+        """Return an estimate of the memory used by the items, in bytes."""
+        size = self.document_size
+        if self.docinfo is not None:
+            size += self.docinfo_size
+        if self.music is not None:
+            size += self.music_size
+        return self.length * size
+
+
+_document_cache = filecache.WatchedFileCache(cache_budget, _CachedDocument.memory)
+_suffix_chars_re = re.compile(r'[^-\w]', re.UNICODE)
+
+
+### XXX otherwise I get a segfault on shutdown when very large music trees
+### are made (and every node references the document).
+### (The segfault is preceded by a "corrupted double-linked list" message.)
+atexit.register(_document_cache.clear)
+
+
+def _opened(filename):
+    """Return the loaded Document for the filename if it is not modified.
+    
+    The tokens, DocInfo and music tree of an open document are kept by the
+    documentinfo module, so there is no need to read and cache the file again.
+    
+    """
+    doc = app.findDocument(QUrl.fromLocalFile(filename))
+    if doc and not doc.isModified():
+        return doc
 
 
 def _cached(filename):
@@ -62,33 +96,71 @@ def _cached(filename):
     except KeyError:
         with open(filename, 'rb') as f:
             text = util.decode(f.read())
-        c = _document_cache[filename] = _CachedDocument()
+        c = _CachedDocument()
+        c.length = len(text)
         c.variables = v = variables.variables(text)
         c.document = ly.document.Document(text, v.get("mode"))
         c.filename = c.document.filename = filename
+        _document_cache[filename] = c
     return c
 
 
 def document(filename):
     """Return a (cached) ly.document.Document for the filename."""
+    doc = _opened(filename)
+    if doc:
+        import lydocument
+        return lydocument.Document(doc)
     return _cached(filename).document
 
 
 def docinfo(filename):
     """Return a (cached) LyDocInfo instance for the specified file."""
+    doc = _opened(filename)
+    if doc:
+        import documentinfo
+        return documentinfo.docinfo(doc)
     c = _cached(filename)
     if c.docinfo is None:
         c.docinfo = lydocinfo.DocInfo(c.document, c.variables)
+        _document_cache.resize(c.filename)
     return c.docinfo
 
 
 def music(filename):
-    """Return a (cached) music.Document instance for the specified file."""
+    """Return a (cached) music.Document instance for the specified file.
+    
+    An including document may set the include_node and include_path
+    attributes of the returned instance (see music.Document), also when the
+    file is open.
+    
+    """
+    doc = _opened(filename)
+    if doc:
+        import documentinfo
+        return documentinfo.info(doc).includedMusic()
     c = _cached(filename)
     if c.music is None:
         import music
         c.music = music.Document(c.document)
+        _document_cache.resize(c.filename)
     return c.music
+
+
+def cache_info():
+    """Return information about the cached documents, for debugging purposes.
+    
+    Returns a dictionary with the budget and the estimated total size in bytes
+    (size), and a list of (filename, size) tuples (files), least recently used
+    first.
+    
+    """
+    return {
+        'budget': _document_cache.budget(),
+        'size': _document_cache.size(),
+        'files': [(filename, _document_cache.size(filename))
+                  for filename in _document_cache.filenames()],
+    }
     
 
 def textmode(text, guess=True):
@@ -115,32 +187,13 @@ def includefiles(dinfo, include_path=()):
     If the document has no local filename, only the include_path is 
     searched for files.
     
+    The results are cached by the includegraph module, which discards them when
+    one of the files or searched directories changes on disk.
+    
     """
-    filename = dinfo.document.filename
-    basedir = os.path.dirname(filename) if filename else None
-    files = set()
-    
-    def tryarg(directory, arg):
-        path = os.path.realpath(os.path.join(directory, arg))
-        if path not in files and os.path.isfile(path):
-            files.add(path)
-            args = docinfo(path).include_args()
-            find(args, os.path.dirname(path))
-            return True
-            
-    def find(incl_args, directory):
-        for arg in incl_args:
-            # new, recursive, relative include
-            if not (directory and tryarg(directory, arg)):
-                # old include (relative to master file)
-                if not (basedir and tryarg(basedir, arg)):
-                    # if path is given, also search there:
-                    for p in include_path:
-                        if tryarg(p, arg):
-                            break
-    
-    find(dinfo.include_args(), basedir)
-    return files
+    import includegraph
+    return includegraph.graph().includefiles(
+        dinfo.document.filename, dinfo.include_args(), include_path)
 
 
 def basenames(dinfo, includefiles=(), filename=None, replace_suffix=True):
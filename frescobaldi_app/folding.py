@@ -26,6 +26,7 @@ The sidebar/ manages the visibility of the folding area.
 
 
 import cursortools
+import highlighter
 import tokeniter
 import ly.lex
 import widgets.folding
@@ -35,6 +36,10 @@ line_painter = widgets.folding.LinePainter()
 
 
 class Folder(widgets.folding.Folder):
+    def __init__(self, doc):
+        super(Folder, self).__init__(doc)
+        highlighter.highlighter(doc).tokensChanged.connect(self.block_changed)
+    
     def fold_events(self, block):
         """Provides folding information by looking at indent/dedent tokens."""
         for t in tokeniter.tokens(block):
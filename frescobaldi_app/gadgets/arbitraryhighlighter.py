@@ -25,7 +25,7 @@ using QTextEdit.ExtraSelections.
 import weakref
 import operator
 
-from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtCore import QObject, QPoint, QTimer
 from PyQt5.QtGui import QTextCharFormat, QTextFormat
 from PyQt5.QtWidgets import QTextEdit
 
@@ -35,12 +35,22 @@ class ArbitraryHighlighter(QObject):
     
     Stores and highlights lists of QTextCursors on a per-format basis.
     
+    The cursors of every format are kept sorted on position, and only the
+    selections that are in the visible part of the text edit are handed to
+    Qt. They are updated when the text edit is scrolled or resized.
+    
     """
     def __init__(self, edit):
         """Initializes ourselves with a Q(Plain)TextEdit as parent."""
         QObject.__init__(self, edit)
         self._selections = {}
         self._formats = {} # store the QTextFormats
+        self._visible = None # the (start, end) range last handed to Qt
+        self._updateTimer = QTimer(singleShot=True, timeout=self.updateVisible)
+        scrollbar = edit.verticalScrollBar()
+        scrollbar.valueChanged.connect(self._scheduleUpdate)
+        scrollbar.rangeChanged.connect(self._scheduleUpdate)
+        edit.textChanged.connect(self._scheduleUpdate)
     
     def highlight(self, format, cursors, priority=0, msec=0):
         """Highlights the selection of an arbitrary list of QTextCursors.
@@ -59,22 +69,15 @@ class ArbitraryHighlighter(QObject):
         else:
             fmt = self.textFormat(format)
             key = format
-        selections = []
-        for cursor in cursors:
-            es = QTextEdit.ExtraSelection()
-            es.cursor = cursor
-            es.format = fmt
-            selections.append(es)
+        group = Group(priority, fmt, cursors)
         if msec:
             def clear(selfref=weakref.ref(self)):
                 self = selfref()
                 if self:
                     self.clear(format)
-            timer = QTimer(timeout=clear, singleShot=True)
-            timer.start(msec)
-            self._selections[key] = (priority, selections, timer)
-        else:
-            self._selections[key] = (priority, selections)
+            group.timer = QTimer(timeout=clear, singleShot=True)
+            group.timer.start(msec)
+        self._selections[key] = group
         self.update()
 
     def clear(self, format):
@@ -98,21 +101,85 @@ class ArbitraryHighlighter(QObject):
         """Implement this to return a QTextCharFormat for the given name."""
         raise NotImplementedError
 
+    def visibleRange(self):
+        """Return the (start, end) positions of the visible part of the text edit.
+        
+        Returns None if there is no text edit.
+        
+        """
+        textedit = self.parent()
+        if textedit:
+            rect = textedit.viewport().rect()
+            start = textedit.cursorForPosition(QPoint(0, 0)).block().position()
+            block = textedit.cursorForPosition(rect.bottomRight()).block()
+            return start, block.position() + block.length()
+
     def update(self):
         """(Internal) Called whenever the arbitrary highlighting changes."""
         textedit = self.parent()
         if textedit:
-            selections = sorted(self._selections.values(), key=operator.itemgetter(0))
-            ess = sum(map(operator.itemgetter(1), selections), [])
+            self._visible = start, end = self.visibleRange()
+            ess = []
+            for group in sorted(self._selections.values(), key=operator.attrgetter('priority')):
+                ess.extend(group.selections(start, end))
             textedit.setExtraSelections(ess)
 
+    def updateVisible(self):
+        """(Internal) Called when the visible part of the text edit may have changed."""
+        if self.parent() and self.visibleRange() != self._visible:
+            self.update()
+
+    def _scheduleUpdate(self):
+        """(Internal) Calls updateVisible() when back in the event loop."""
+        if self._selections:
+            self._updateTimer.start(0)
+
     def reload(self):
         """Reloads the named formats in the highlighting (e.g. in case of settings change)."""
-        for key in self._selections:
+        for key, group in self._selections.items():
             if isinstance(key, str):
-                fmt = self.textFormat(key)
-                for es in self._selections[key][1]:
-                    es.format = fmt
+                group.format = self.textFormat(key)
         self.update()
 
 
+class Group(object):
+    """The highlighted cursors of one format, sorted on position."""
+    timer = None
+    
+    def __init__(self, priority, format, cursors):
+        self.priority = priority
+        self.format = format
+        self.cursors = sorted(cursors, key=lambda c: c.selectionStart())
+        ends = [c.selectionEnd() for c in self.cursors]
+        # if the ends are sorted as well, we can also bisect on them
+        self.monotonic = all(map(operator.le, ends, ends[1:]))
+    
+    def _bisect(self, position, attr):
+        """Return the index of the first cursor with attr() > position."""
+        cursors = self.cursors
+        lo, hi = 0, len(cursors)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if position < getattr(cursors[mid], attr)():
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+    
+    def selections(self, start, end):
+        """Return a list of ExtraSelections for the cursors between start and end."""
+        last = self._bisect(end, 'selectionStart')
+        if self.monotonic:
+            first = self._bisect(start - 1, 'selectionEnd')
+            cursors = self.cursors[first:last]
+        else:
+            cursors = [c for c in self.cursors[:last] if c.selectionEnd() >= start]
+        selections = []
+        for cursor in cursors:
+            es = QTextEdit.ExtraSelection()
+            es.cursor = cursor
+            es.format = self.format
+            selections.append(es)
+        return selections
+
+
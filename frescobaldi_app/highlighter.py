@@ -20,13 +20,22 @@
 """
 The Highlighter class provides syntax highlighting and more information
 about a document's contents.
+
+Large documents are lexed in a background thread (see the Lexer class); the
+tokens and states are then applied to the visible blocks first and to the
+rest of the document in small batches.
+
+Together with the tokens, a fingerprint of the tokens is stored for every
+block (see fingerprint()).
 """
 
 
+import threading
 
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import (
-    QColor, QSyntaxHighlighter, QTextBlockUserData, QTextCharFormat,
-    QTextCursor, QTextDocument)
+    QColor, QSyntaxHighlighter, QTextBlock, QTextBlockUserData,
+    QTextCharFormat, QTextCursor, QTextDocument)
 
 
 import ly.lex
@@ -39,11 +48,22 @@ import metainfo
 import plugin
 import variables
 import documentinfo
+import tokenhash
 
 
 metainfo.define('highlighting', True)
 
 
+# documents with at least this number of lines are lexed in the background
+background_lines = 5000
+
+# the number of blocks to highlight in one go from the background results
+batch_size = 200
+
+# keep references to running Lexers
+_lexers = set()
+
+
 def mapping(data):
     """Return a dictionary mapping token classes from ly.lex to QTextCharFormats.
     
@@ -62,6 +82,21 @@ def highlighter(document):
     return Highlighter.instance(document)
 
 
+def fingerprint(tokens):
+    """Return a two-tuple of hashes for the tokens of a block.
+    
+    The first hash changes when any token changes (also when only its type
+    changes). The second item only covers the tokens that are not whitespace
+    or comments: it is a (hash, count) tuple as returned by
+    tokenhash.tokens_hash(), or None if there are no such tokens.
+    
+    """
+    significant = [t for t in tokens
+                   if not isinstance(t, (ly.lex.Space, ly.lex.Comment))]
+    return (hash((tokens, tuple(map(type, tokens)))),
+            tokenhash.tokens_hash(significant) if significant else None)
+
+
 def highlight_mapping():
     """Return the global Mapping instance that maps token class to QTextCharFormat."""
     global _highlight_mapping
@@ -94,14 +129,28 @@ class Highlighter(plugin.Plugin, QSyntaxHighlighter):
     The Highlighter automatically re-reads the highlighting settings if they
     are changed.
     
+    The tokensChanged(block) signal is emitted when the tokens of a block
+    that was highlighted before change, also when the text of the block did
+    not change but a change in a block before it altered its lexer state.
+    Note that the signal is emitted during the highlighting, i.e. possibly
+    before other listeners to the document's contentsChange signal are called.
+    
     """
+    tokensChanged = pyqtSignal(QTextBlock)
+    
     def __init__(self, document):
         QSyntaxHighlighter.__init__(self, document)
         self._fridge = ly.lex.Fridge()
+        self._lock = threading.Lock()
         app.settingsChanged.connect(self.rehighlight)
         self._initialState = None
         self._highlighting = True
         self._mode = None
+        self._lexer = None      # the running background Lexer, if any
+        self._next = None       # the first block not yet highlighted from it
+        self._batch = ()        # block numbers being highlighted from it
+        self._waiting = []      # (block, func) tuples for when_ready()
+        self._timer = QTimer(singleShot=True, timeout=self._applyResults)
         self.initializeDocument()
     
     def initializeDocument(self):
@@ -136,18 +185,42 @@ class Highlighter(plugin.Plugin, QSyntaxHighlighter):
         """Called by Qt when the highlighting of the current line needs updating."""
         # find the state of the previous line
         prev = self.previousBlockState()
-        state = self._fridge.thaw(prev)
-        blank = not state and (not text or text.isspace())
-        if not state:
-            state = self.initialState()
-
-        # collect and save the tokens
-        tokens = tuple(state.tokens(text))
-        cursortools.data(self.currentBlock()).tokens = tokens
-        
-        # if blank thus far, keep the highlighter coming back
-        # because the parsing state is not yet known; else save the state
-        self.setCurrentBlockState(prev - 1 if blank else self._fridge.freeze(state))
+        block = self.currentBlock()
+        if (self._lexer is None and prev == -1 and block.userState() == -1
+            and self.document().blockCount() >= background_lines):
+            # a large document is highlighted for the first time
+            self._startLexer()
+        if self._lexer is not None:
+            result = self._lexerResult(block, text, prev)
+            if result is False:
+                # the state is not yet known, this block will be done later
+                data = block.userData()
+                if data:
+                    try:
+                        del data.tokens
+                    except AttributeError:
+                        pass
+                self.setCurrentBlockState(-1)
+                return
+        else:
+            result = None
+        if result:
+            tokens, state = result
+            self._setTokens(block, tokens)
+            self.setCurrentBlockState(state)
+        else:
+            state = self._fridge.thaw(prev)
+            blank = not state and (not text or text.isspace())
+            if not state:
+                state = self.initialState()
+
+            # collect and save the tokens
+            tokens = tuple(state.tokens(text))
+            self._setTokens(block, tokens)
+            
+            # if blank thus far, keep the highlighter coming back
+            # because the parsing state is not yet known; else save the state
+            self.setCurrentBlockState(prev - 1 if blank else self._freeze(state))
         
         # apply highlighting if desired
         if self._highlighting:
@@ -157,6 +230,188 @@ class Highlighter(plugin.Plugin, QSyntaxHighlighter):
                 f = mapping[token]
                 if f:
                     setFormat(f)
+    
+    def _setTokens(self, block, tokens):
+        """Store the tokens and their fingerprint in the block's user data."""
+        data = cursortools.data(block)
+        data.tokens = tokens
+        old = getattr(data, 'fingerprint', None)
+        data.fingerprint = new = fingerprint(tokens)
+        if old is not None and old[0] != new[0]:
+            self.tokensChanged.emit(block)
+    
+    def _freeze(self, state):
+        """Freeze the state; the Fridge is shared with a background Lexer."""
+        with self._lock:
+            return self._fridge.freeze(state)
+    
+    def _lexerResult(self, block, text, prev):
+        """Return the (tokens, state) from the Lexer for the block, if usable.
+        
+        Returns None if the block should be lexed right now, and False if
+        the block should be left alone until the Lexer results are applied.
+        
+        """
+        lexer = self._lexer
+        num = block.blockNumber()
+        doc = self.document()
+        if doc.revision() == lexer.revision and doc.blockCount() == len(lexer.texts):
+            # nothing changed since the snapshot, trust the lexer's states
+            index, trusted = num, True
+        else:
+            shifted = num - doc.blockCount() + len(lexer.texts)
+            index, trusted = lexer.find(text, num, shifted), False
+        if index is not None:
+            result = lexer.result(index)
+            if result and (result[0] == prev or (trusted and prev == -1)):
+                return result[1:]
+        if prev == -1 and num > 0:
+            return False    # state unknown
+        if index is None or num in self._batch or block.userState() != -1:
+            return None
+        return False
+    
+    def _startLexer(self):
+        """Start lexing the document in the background."""
+        if self._lexer:
+            self._lexer.stop()
+        self._lexer = lexer = Lexer(self)
+        self._next = self.document().firstBlock()
+        lexer.progress.connect(self._scheduleResults)
+        lexer.finished.connect(self._scheduleResults)
+        _lexers.add(lexer)
+        lexer.finished.connect(lambda: _lexers.discard(lexer))
+        lexer.start()
+    
+    def _scheduleResults(self):
+        """Called when the Lexer has new results."""
+        if not self._timer.isActive():
+            self._timer.start(0)
+    
+    def _applyResults(self):
+        """Highlight a batch of blocks with the results of the Lexer."""
+        lexer = self._lexer
+        if lexer is None:
+            return
+        count = batch_size
+        for block in self._visibleBlocks():
+            if block.userState() == -1 and lexer.result(block.blockNumber()):
+                self._highlightBlocks([block])
+                count -= 1
+        blocks = []
+        block = self._next
+        while block.isValid() and len(blocks) < count:
+            if block.userState() == -1:
+                if not (lexer.isFinished() or lexer.result(block.blockNumber())):
+                    break
+                blocks.append(block)
+            block = block.next()
+        self._highlightBlocks(blocks)
+        if not block.isValid():
+            # edits could have made us skip blocks, look for them
+            for block in cursortools.all_blocks(self.document()):
+                if block.userState() == -1:
+                    break
+            else:
+                lexer.stop()
+                self._lexer = None
+                self._next = None
+                self._callWaiting()
+                return
+        self._next = block
+        if len(blocks) == count or lexer.isFinished():
+            self._timer.start(0)
+        self._callWaiting()
+    
+    def _highlightBlocks(self, blocks):
+        """Highlight the blocks now, using the Lexer results if possible."""
+        self._batch = set(block.blockNumber() for block in blocks)
+        try:
+            for block in blocks:
+                if block.userState() == -1:
+                    self.rehighlightBlock(block)
+        finally:
+            self._batch = ()
+    
+    def _visibleBlocks(self):
+        """Yield the blocks that are visible in the current views of the document."""
+        doc = self.document()
+        for window in app.windows:
+            view = window.currentView()
+            if view and view.document() is doc:
+                height = view.viewport().height()
+                offset = view.contentOffset()
+                block = view.firstVisibleBlock()
+                while block.isValid():
+                    if view.blockBoundingGeometry(block).translated(offset).top() > height:
+                        break
+                    yield block
+                    block = block.next()
+    
+    def _callWaiting(self):
+        """Call the functions given to when_ready() for blocks that are done."""
+        waiting, self._waiting = self._waiting, []
+        for block, func in waiting:
+            if self._lexer is None or block.userState() != -1:
+                func()
+            else:
+                self._waiting.append((block, func))
+    
+    def isLexing(self):
+        """Return True if the document is being lexed in the background."""
+        return self._lexer is not None
+    
+    def wait(self, block):
+        """Make sure the tokens and state of the block are known.
+        
+        If the document is lexed in the background, waits for the results up
+        to the block and highlights it (and, if needed, the blocks before it).
+        Otherwise, the whole document is rehighlighted if the block has not
+        been highlighted yet.
+        
+        """
+        if block.userState() != -1:
+            return
+        if self._lexer is None:
+            QSyntaxHighlighter.rehighlight(self)
+            # this may have started the lexer
+            if self._lexer is None or block.userState() != -1:
+                return
+        self._lexer.wait_for(block.blockNumber())
+        self._highlightBlocks([block])
+        if block.userState() == -1:
+            # highlight all blocks up to the block
+            num = block.blockNumber()
+            b = self._next
+            if not b.isValid() or b.blockNumber() > num:
+                b = self.document().firstBlock()
+            blocks = []
+            while b.isValid() and b.blockNumber() <= num:
+                if b.userState() == -1:
+                    blocks.append(b)
+                b = b.next()
+            self._highlightBlocks(blocks)
+            self._scheduleResults()
+    
+    def when_ready(self, block, func):
+        """Call func() (without arguments) as soon as the block has been lexed.
+        
+        If that already is the case, func() is called immediately.
+        
+        """
+        if self._lexer is None or block.userState() != -1:
+            func()
+        else:
+            self._waiting.append((block, func))
+    
+    def rehighlight(self):
+        """Reimplemented to lex large documents in the background."""
+        doc = self.document()
+        if doc and doc.blockCount() >= background_lines:
+            for block in cursortools.all_blocks(doc):
+                block.setUserState(-1)
+            self._startLexer()
+        QSyntaxHighlighter.rehighlight(self)
         
     def setHighlighting(self, enable):
         """Enable or disable highlighting."""
@@ -191,6 +446,74 @@ class Highlighter(plugin.Plugin, QSyntaxHighlighter):
         return self._fridge.thaw(self._initialState)
 
 
+class Lexer(QThread):
+    """Lexes a snapshot of the text of a document in a background thread.
+    
+    The tokens and frozen states are computed the same way as
+    Highlighter.highlightBlock() does it, and use the same Fridge.
+    
+    """
+    progress = pyqtSignal()
+    
+    def __init__(self, highlighter):
+        super(Lexer, self).__init__()
+        doc = highlighter.document()
+        self.revision = doc.revision()
+        self.texts = [block.text() for block in cursortools.all_blocks(doc)]
+        self._fridge = highlighter._fridge
+        self._freeze = highlighter._freeze
+        self._initial = self._freeze(highlighter.initialState())
+        self._results = []
+        self._condition = threading.Condition()
+        self._stop = False
+    
+    def stop(self):
+        """Stop lexing, e.g. when the results are not needed anymore."""
+        self._stop = True
+    
+    def run(self):
+        prev = -1
+        state = None
+        for num, text in enumerate(self.texts):
+            if self._stop:
+                break
+            blank = state is None and (not text or text.isspace())
+            if state is None:
+                state = self._fridge.thaw(self._initial)
+            tokens = tuple(state.tokens(text))
+            if blank:
+                end = prev - 1
+                state = None
+            else:
+                end = self._freeze(state)
+            with self._condition:
+                self._results.append((prev, tokens, end))
+                self._condition.notify_all()
+            prev = end
+            if num % batch_size == batch_size - 1:
+                self.progress.emit()
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+    
+    def result(self, index):
+        """Return the (start state, tokens, end state) for the line, if already lexed."""
+        if index < len(self._results):
+            return self._results[index]
+    
+    def find(self, text, *indices):
+        """Return the first of the indices whose snapshot line has the text, or None."""
+        for index in indices:
+            if 0 <= index < len(self.texts) and self.texts[index] == text:
+                return index
+    
+    def wait_for(self, index):
+        """Wait until the line at index has been lexed (or lexing stopped)."""
+        with self._condition:
+            while index >= len(self._results) and not self._stop:
+                self._condition.wait()
+
+
 def html_copy(cursor, scheme='editor', number_lines=False):
     """Return a new QTextDocument with highlighting set as HTML textcharformats.
     
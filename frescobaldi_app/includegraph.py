@@ -0,0 +1,224 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Keeps a cached graph of the files included by LilyPond documents.
+
+The include arguments of every file are read only once, and the results of
+looking for a file in a directory are cached as well. A QFileSystemWatcher
+watches the files that were read and the directories that were searched; when
+something changes on disk, only the parts of the graph depending on it are
+discarded.
+
+Use graph() to get the global IncludeGraph instance.
+
+"""
+
+
+import itertools
+import os
+
+from PyQt5.QtCore import QFileSystemWatcher
+
+import fileinfo
+
+
+_graph = None
+
+
+def graph():
+    """Return the global IncludeGraph instance."""
+    global _graph
+    if _graph is None:
+        _graph = IncludeGraph()
+    return _graph
+
+
+class IncludeGraph(object):
+    """A cached graph of files including other files.
+
+    The nodes are real filenames. Which file an include argument refers to
+    also depends on the directory of the master document and the include path,
+    together called the context, so the edges of a file are stored per context.
+
+    """
+    def __init__(self):
+        self._paths = {}        # (directory, arg) -> real filename or None
+        self._lookups = {}      # directory -> keys in _paths looked up in it
+        self._args = {}         # filename -> tuple of include args
+        self._edges = {}        # filename -> {context: list of filenames}
+        self._users = {}        # directory -> filenames whose edges looked there
+        self._reachable = {}    # key -> (frozenset of filenames, directories)
+        self._keys = {}         # filename or directory -> keys depending on it
+        self._current = {}      # (filename, context) -> latest key
+        self._watcher = QFileSystemWatcher()
+        self._watcher.fileChanged.connect(self.slotFileChanged)
+        self._watcher.directoryChanged.connect(self.slotDirectoryChanged)
+
+    def includefiles(self, filename, args, include_path=()):
+        """Return a frozenset of the files (recursively) included by a document.
+
+        filename is the name of the document (may be None), args the list of
+        include arguments it contains. Included files are searched relative to
+        the including file, relative to the document, and in the include_path.
+
+        The result is cached until one of the files or searched directories
+        changes on disk.
+
+        """
+        basedir = os.path.dirname(filename) if filename else None
+        context = (basedir, tuple(include_path))
+        key = (filename, tuple(args), context)
+        try:
+            return self._reachable[key][0]
+        except KeyError:
+            pass
+        # forget the former result for this document
+        old = self._current.get(key[::2])
+        if old:
+            self._forget(old)
+        dirs = set()
+        todo = self._resolve(key[1], basedir, context, dirs)
+        files = set()
+        while todo:
+            name = todo.pop()
+            if name not in files:
+                files.add(name)
+                todo.extend(self._children(name, context))
+        files = frozenset(files)
+        self._reachable[key] = (files, dirs)
+        self._current[key[::2]] = key
+        for name in itertools.chain(files, dirs):
+            self._keys.setdefault(name, set()).add(key)
+        return files
+
+    def masters(self, filename):
+        """Return the set of documents whose include files contain filename.
+
+        Only documents of which the included files were asked for (and are
+        still valid) are known.
+
+        """
+        return set(key[0] for key in self._keys.get(filename, ()) if key[0])
+
+    def include_args(self, filename):
+        """Return the include arguments of the file (cached)."""
+        try:
+            return self._args[filename]
+        except KeyError:
+            args = self._args[filename] = tuple(fileinfo.docinfo(filename).include_args())
+            self._watcher.addPath(filename)
+            return args
+
+    def clear(self):
+        """Forget everything."""
+        paths = self._watcher.files() + self._watcher.directories()
+        if paths:
+            self._watcher.removePaths(paths)
+        self._paths.clear()
+        self._lookups.clear()
+        self._args.clear()
+        self._edges.clear()
+        self._users.clear()
+        self._reachable.clear()
+        self._keys.clear()
+        self._current.clear()
+
+    def slotFileChanged(self, filename):
+        """Called when a file that was read changes on disk."""
+        self._watcher.removePath(filename)
+        self._args.pop(filename, None)
+        self._edges.pop(filename, None)
+        self._discard(filename)
+
+    def slotDirectoryChanged(self, directory):
+        """Called when a directory that was searched changes on disk."""
+        self._watcher.removePath(directory)
+        for key in self._lookups.pop(directory, ()):
+            del self._paths[key]
+        for filename in self._users.pop(directory, ()):
+            self._edges.pop(filename, None)
+            self._discard(filename)
+        self._discard(directory)
+
+    def _discard(self, name):
+        """Forget the include sets that depend on the file or directory."""
+        for key in list(self._keys.get(name, ())):
+            self._forget(key)
+
+    def _forget(self, key):
+        """Forget the include set with the specified key."""
+        files, dirs = self._reachable.pop(key)
+        if self._current.get(key[::2]) == key:
+            del self._current[key[::2]]
+        for name in itertools.chain(files, dirs):
+            keys = self._keys[name]
+            keys.discard(key)
+            if not keys:
+                del self._keys[name]
+
+    def _children(self, filename, context):
+        """Return the list of files directly included by the file."""
+        try:
+            return self._edges[filename][context]
+        except KeyError:
+            dirs = set()
+            children = self._resolve(self.include_args(filename),
+                os.path.dirname(filename), context, dirs)
+            self._edges.setdefault(filename, {})[context] = children
+            for directory in dirs:
+                self._users.setdefault(directory, set()).add(filename)
+            return children
+
+    def _resolve(self, args, directory, context, dirs):
+        """Return the list of files the include args refer to.
+
+        The directories that were searched are added to the dirs set.
+
+        """
+        basedir, include_path = context
+        files = []
+        for arg in args:
+            for d in itertools.chain((directory, basedir), include_path):
+                if d:
+                    path = self._lookup(d, arg, dirs)
+                    if path:
+                        files.append(path)
+                        break
+        return files
+
+    def _lookup(self, directory, arg, dirs):
+        """Return the real filename if arg names a file in directory, else None."""
+        key = (directory, arg)
+        path = os.path.normpath(os.path.join(directory, arg))
+        parent = os.path.dirname(path)
+        dirs.add(parent)
+        try:
+            return self._paths[key]
+        except KeyError:
+            pass
+        if parent not in self._lookups:
+            self._lookups[parent] = set()
+            if os.path.isdir(parent):
+                self._watcher.addPath(parent)
+        self._lookups[parent].add(key)
+        result = self._paths[key] = os.path.realpath(path) if os.path.isfile(path) else None
+        return result
+
+
@@ -31,6 +31,11 @@ from PyQt5.QtCore import QCoreApplication, QProcess, QProcessEnvironment
 
 import signals
 
+try:
+    import resource
+except ImportError:
+    resource = None     # not available on MS Windows
+
 
 # message status:
 STDOUT  = 1
@@ -49,6 +54,34 @@ STATUS = NEUTRAL | SUCCESS | FAILURE
 ALL = OUTPUT | STATUS
 
 
+def _children_cpu_time():
+    """Return the CPU time used by all ended child processes so far.
+    
+    Returns None if this can't be determined on this platform.
+    
+    """
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+
+# the CPU time used by the child processes when the last job ended
+_last_cpu_time = _children_cpu_time()
+
+
+def skip_cpu_time():
+    """Don't count the CPU time used by the child processes ended until now.
+    
+    Call this when a child process ended that is not a Job, so that its CPU
+    time is not attributed to the next Job that ends.
+    
+    """
+    global _last_cpu_time
+    cputime = _children_cpu_time()
+    if cputime is not None:
+        _last_cpu_time = cputime
+
+
 class Job(object):
     """Manages a process.
     
@@ -94,6 +127,7 @@ class Job(object):
         self._history = []
         self._starttime = 0.0
         self._elapsed = 0.0
+        self._cputime = None
         self.decoder_stdout = self.create_decoder(STDOUT)
         self.decoder_stderr = self.create_decoder(STDERR)
         self.decode_errors = 'strict'  # codecs error handling
@@ -133,12 +167,7 @@ class Job(object):
     
     def start(self):
         """Starts the process."""
-        self.success = None
-        self.error = None
-        self._aborted = False
-        self._history = []
-        self._elapsed = 0.0
-        self._starttime = time.time()
+        self._reset()
         if self._process is None:
             self.set_process(QProcess())
         self.start_message()
@@ -148,6 +177,16 @@ class Job(object):
             self._update_process_environment()
         self._process.start(self.command[0], self.command[1:])
     
+    def _reset(self):
+        """(internal) Resets the state and the start time, called by start()."""
+        self.success = None
+        self.error = None
+        self._aborted = False
+        self._history = []
+        self._elapsed = 0.0
+        self._cputime = None
+        self._starttime = time.time()
+    
     def start_time(self):
         """Return the time this job was started.
         
@@ -163,6 +202,19 @@ class Job(object):
         elif self._starttime:
             return time.time() - self._starttime
         return 0.0
+    
+    def cpu_time(self):
+        """Return how many seconds of CPU time the process used.
+        
+        This is only known after the process has finished, and is determined
+        by looking how much the CPU time of all ended child processes of
+        Frescobaldi increased since the last job ended, so it can include
+        the time of other child processes that ended in the meantime.
+        
+        Returns None if the CPU time is not known.
+        
+        """
+        return self._cputime
 
     def abort(self):
         """Abort the process."""
@@ -233,6 +285,7 @@ class Job(object):
     
     def _finished(self, exitCode, exitStatus):
         """(internal) Called when the process has finished."""
+        self._stop_timer()
         self.finish_message(exitCode, exitStatus)
         success = exitCode == 0 and exitStatus == QProcess.NormalExit
         self._bye(success)
@@ -243,9 +296,19 @@ class Job(object):
         if self._process.state() == QProcess.NotRunning:
             self._bye(False)
     
+    def _stop_timer(self):
+        """(internal) Records the elapsed and CPU time when the process ended."""
+        global _last_cpu_time
+        if not self._elapsed:
+            self._elapsed = time.time() - self._starttime
+            cputime = _children_cpu_time()
+            if cputime is not None:
+                self._cputime = cputime - _last_cpu_time
+                _last_cpu_time = cputime
+    
     def _bye(self, success):
         """(internal) Ends and emits the done() signal."""
-        self._elapsed = time.time() - self._starttime
+        self._stop_timer()
         if not success:
             self.error = self._process.error()
         self.success = success
@@ -309,6 +372,10 @@ class Job(object):
         else:
             time = self.elapsed2str(self.elapsed_time())
             self.message(_("Completed successfully in {time}.").format(time=time), SUCCESS)
+        cputime = self.cpu_time()
+        if cputime is not None:
+            self.message(_("CPU time used: {time}.").format(
+                time=self.elapsed2str(cputime)), NEUTRAL)
 
     @staticmethod
     def elapsed2str(seconds):
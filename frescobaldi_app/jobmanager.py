@@ -21,12 +21,16 @@
 A JobManager exists for every Document, and ensures no two jobs are running
 at the same time.
 
+The jobs are started via the global job queue (see jobqueue.py), which limits
+the number of jobs running at the same time for all documents together.
+
 It also sends the app-wide signals jobStarted() and jobFinished().
 
 """
 
 
 import app
+import jobqueue
 import plugin
 import signals
 
@@ -45,6 +49,10 @@ def is_running(document):
     return False
 
 
+def waiting_job(document):
+    return JobManager.instance(document).waiting_job()
+
+
 class JobManager(plugin.DocumentPlugin):
     
     started = signals.Signal()  # Job
@@ -52,22 +60,47 @@ class JobManager(plugin.DocumentPlugin):
     
     def __init__(self, document):
         self._job = None
+        self._waiting = None
+        document.closed.connect(self.cancel_waiting_job)
         
     def start_job(self, job):
-        """Starts a Job on our behalf."""
+        """Starts a Job on our behalf.
+        
+        The job is added to the global job queue and started as soon as there
+        is room for it. A job that is still waiting for this document is
+        replaced.
+        
+        """
         if not self.is_running():
-            self._job = job
-            job.done.connect(self._finished)
-            job.start()
-            self.started(job)
-            app.jobStarted(self.document(), job)
+            self.cancel_waiting_job()
+            self._waiting = job
+            jobqueue.queue().add(self.document(), job, self._start)
+    
+    def _start(self, job):
+        """Called by the job queue to really start the job."""
+        self._waiting = None
+        self._job = job
+        job.done.connect(self._finished)
+        job.start()
+        self.started(job)
+        app.jobStarted(self.document(), job)
         
     def _finished(self, success):
-        self.finished(job, success)
+        self.finished(self._job, success)
         app.jobFinished(self.document(), self._job, success)
     
+    def cancel_waiting_job(self):
+        """Removes the job waiting to be started from the queue, if any."""
+        if self._waiting:
+            jobqueue.queue().remove(self._waiting)
+            self._waiting = None
+    
+    def waiting_job(self):
+        """Returns the job waiting in the queue to be started, if any."""
+        return self._waiting
+    
     def job(self):
-        """Returns the last job if any."""
+        """Returns the last started job if any."""
         return self._job
 
     def is_running(self):
@@ -0,0 +1,135 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+A global queue limiting the number of Jobs that run at the same time.
+
+The JobManager of every Document adds its jobs to the queue, which starts them
+as soon as fewer jobs are running than the configured maximum (by default the
+number of processors).
+
+Waiting jobs for the current document of the main window they were started
+from go first, and hidden (autocompile) jobs go after all other jobs.
+
+"""
+
+
+import itertools
+import os
+
+from PyQt5.QtCore import QSettings
+
+import app
+import jobattributes
+import signals
+
+
+_queue = None
+
+
+def queue():
+    """Return the global JobQueue instance."""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
+
+
+def default_max_jobs():
+    """Return the default maximum number of jobs, the number of processors."""
+    return os.cpu_count() or 1
+
+
+def max_jobs():
+    """Return the maximum number of jobs that may run at the same time."""
+    return max(1, QSettings().value("lilypond_settings/max_jobs",
+                                    default_max_jobs(), int))
+
+
+class JobQueue(object):
+    """Starts Jobs, keeping at most max_jobs() running at the same time."""
+    
+    changed = signals.Signal()  # emitted when jobs were added, started or removed
+    
+    def __init__(self):
+        self._waiting = []      # list of (number, document, job, start)
+        self._running = []
+        self._count = itertools.count()
+        app.settingsChanged.connect(self.startJobs)
+    
+    def add(self, document, job, start):
+        """Add a job to the queue on behalf of the document.
+        
+        start() is called with the job as argument when it is time to start it.
+        
+        """
+        self._waiting.append((next(self._count), document, job, start))
+        self.startJobs()
+        self.changed()
+    
+    def remove(self, job):
+        """Remove a waiting job from the queue.
+        
+        Returns True if the job was waiting, False otherwise.
+        
+        """
+        for i, item in enumerate(self._waiting):
+            if item[2] is job:
+                del self._waiting[i]
+                self.changed()
+                return True
+        return False
+    
+    def waiting(self):
+        """Return the list of waiting jobs, in the order they will be started."""
+        self._waiting.sort(key=self._priority)
+        return [item[2] for item in self._waiting]
+    
+    def running(self):
+        """Return the list of running jobs that were started by the queue."""
+        return list(self._running)
+    
+    def startJobs(self):
+        """Start waiting jobs as long as fewer than max_jobs() are running."""
+        limit = max_jobs()
+        if self._waiting and len(self._running) < limit:
+            self._waiting.sort(key=self._priority)
+            while self._waiting and len(self._running) < limit:
+                number, document, job, start = self._waiting.pop(0)
+                self._running.append(job)
+                # called after the other slots, so a finished job is reported
+                # before the next one starts
+                job.done.connect(self.slotJobDone, 100)
+                start(job)
+            self.changed()
+    
+    def slotJobDone(self):
+        """Called when a job has finished, starts waiting jobs."""
+        self._running = [job for job in self._running if job.is_running()]
+        self.startJobs()
+    
+    def _priority(self, item):
+        """Return the sort key for a waiting job."""
+        number, document, job, start = item
+        attrs = jobattributes.get(job)
+        mainwindow = attrs.mainwindow
+        current = bool(mainwindow and mainwindow.currentDocument() is document)
+        return bool(attrs.hidden), not current, number
+
+
@@ -0,0 +1,110 @@
+# Python midifile package -- parse, load and play MIDI files.
+# Copyright (c) 2011 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+midifile.benchmark -- measures loading a large synthetic MIDI file.
+
+Run with: python -m midifile.benchmark [events] [tempo_changes]
+
+Creates a type 1 MIDI file with the given number of note events (default
+100000) and tempo changes (default 2000) in memory, and prints how long
+loading it as a Song takes.
+
+"""
+
+from __future__ import print_function
+
+import struct
+import sys
+import time
+
+from . import song
+
+
+def var_len(value):
+    """Returns the variable-length encoding of value as bytes."""
+    result = [value & 0x7F]
+    value >>= 7
+    while value:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    return bytes(bytearray(reversed(result)))
+
+
+def track(events):
+    """Returns an MTrk chunk with the (delta, bytes) events and End of Track."""
+    data = b''.join(var_len(delta) + ev for delta, ev in events)
+    data += b'\x00\xFF\x2F\x00'
+    return b'MTrk' + struct.pack('>i', len(data)) + data
+
+
+def synthetic_midi(events=100000, tempo_changes=2000, tracks=4, division=384):
+    """Returns the bytes of a type 1 MIDI file.
+
+    The first track has a time signature and the tempo changes (one every
+    beat, like a written ritardando), the other tracks have the note events
+    (alternating note on and note off events) spread out over the same time.
+
+    """
+    beat = division
+    tempo_track = [(0, b'\xFF\x58\x04\x04\x02\x18\x08')]
+    for i in range(tempo_changes):
+        tempo = 500000 + (i % 100) * 5000
+        tempo_track.append((beat if i else 0,
+            b'\xFF\x51\x03' + struct.pack('>i', tempo)[1:]))
+    chunks = [track(tempo_track)]
+    per_track = events // tracks
+    # spread the notes over the same length as the tempo changes
+    step = max(1, 2 * tempo_changes * beat // per_track)
+    for n in range(tracks):
+        evs = []
+        for i in range(per_track // 2):
+            note = 48 + (i + n * 7) % 36
+            evs.append((0, bytes(bytearray((0x90 | n, note, 80)))))
+            evs.append((step, bytes(bytearray((0x80 | n, note, 0)))))
+        chunks.append(track(evs))
+    header = b'MThd' + struct.pack('>ihhh', 6, 1, len(chunks), division)
+    return header + b''.join(chunks)
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    data = synthetic_midi(*args)
+    start = time.time()
+    fmt, div, tracks = song.parser.parse_midi_data(data)
+    s = song.Song(div, tracks)
+    elapsed = time.time() - start
+    print("Loaded {0} bytes, {1} tracks, {2} tempo changes, "
+          "{3} event times in {4:.3f}s".format(len(data), s.ntracks,
+          len(s.tempo_map.times), len(s.music), elapsed))
+    times = sorted(set(s.events.time))
+    start = time.time()
+    for t in times:
+        s.tempo_map.msec(t)
+    single = time.time() - start
+    start = time.time()
+    s.tempo_map.msecs(times)
+    batch = time.time() - start
+    print("Converted {0} times one by one in {1:.3f}s, "
+          "in one batch in {2:.3f}s".format(len(times), single, batch))
+
+
+if __name__ == '__main__':
+    main()
+
+
@@ -0,0 +1,452 @@
+# Python midifile package -- parse, load and play MIDI files.
+# Copyright (c) 2011 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+midifile.check -- compares the midifile package with its former code.
+
+Run with: python -m midifile.check [seeds]
+
+For every seed (default 50) random MIDI data are created, and the results
+are compared with those of the way they were computed before:
+
+- the real times of the TempoMap, computed by walking through the tempo
+  changes for every MIDI time;
+- the beats, music and length of a Song, loaded from a file with all event
+  types in several tracks by parsing the tracks into lists of event tuples;
+- the messages packed by Song, and those of the Player's events, converted
+  from the events one by one by a PortMidiOutput;
+- the Player's events, and the positions found by seek(), seek_measure()
+  and Song.beat(), by searching through all events or beats (MIDI events on
+  the same msec are combined, which the former code did not do);
+- the events a Player sends to its output while playing a short random song
+  with its timer thread, which must be all events of the song, in order, with
+  delays within the lookahead time.
+
+Exits with a non-zero status if a difference is found.
+
+"""
+
+from __future__ import print_function
+
+import array
+import collections
+import random
+import struct
+import sys
+import threading
+
+from . import benchmark
+from . import event
+from . import output
+from . import parser
+from . import player
+from . import song
+
+
+def old_real_time(times, division, midi_time):
+    """Returns the real time like TempoMap.real_time() did before.
+
+    times is the list of (midi_time, tempo) tuples of the tempo changes.
+
+    """
+    real_time = 0
+    for i in range(1, len(times)):
+        if times[i][0] >= midi_time:
+            real_time += (midi_time - times[i-1][0]) * times[i-1][1]
+            break
+        real_time += (times[i][0] - times[i-1][0]) * times[i-1][1]
+    else:
+        real_time += (midi_time - times[-1][0]) * times[-1][1]
+    return real_time // division
+
+
+def old_parse_midi_events(s, factory=None):
+    """Yields (delta, event) tuples like parser.parse_midi_events() did before."""
+    if factory is None:
+        factory = event.EventFactory()
+    if parser.PY2:
+        s = bytearray(s)
+    running_status = None
+    pos = 0
+    while pos < len(s):
+        delta, pos = parser.read_var_len(s, pos)
+        status = s[pos]
+        if status & 0x80:
+            running_status = status
+            pos += 1
+        elif not running_status:
+            raise ValueError("invalid running status")
+        else:
+            status = running_status
+        ev_type = status >> 4
+        channel = status & 0x0F
+        if ev_type <= 0x0A:
+            ev = factory.note_event(ev_type, channel, s[pos], s[pos+1])
+            pos += 2
+        elif ev_type >= 0x0F:
+            running_status = None
+            if status == 0xFF:
+                meta_type = s[pos]
+                size, pos = parser.read_var_len(s, pos+1)
+                ev = factory.meta_event(meta_type, bytes(s[pos:pos+size]))
+            else:
+                size, pos = parser.read_var_len(s, pos)
+                ev = factory.sysex_event(status, bytes(s[pos:pos+size]))
+            pos += size
+        elif ev_type == 0x0E:
+            ev = factory.pitchbend_event(channel, s[pos] + s[pos+1] * 128)
+            pos += 2
+        elif ev_type == 0xD:
+            ev = factory.channelaftertouch_event(channel, s[pos])
+            pos += 1
+        elif ev_type == 0xB:
+            ev = factory.controller_event(channel, s[pos], s[pos+1])
+            pos += 2
+        else:
+            ev = factory.programchange_event(channel, s[pos])
+            pos += 1
+        yield delta, ev
+
+
+def old_beats(d, division):
+    """Yields the beats of the events dictionary like song.beats() did before."""
+    times = sorted(d)
+    time_sigs = [(midi_time, song.get_time_signature(e))
+                 for midi_time in times
+                 for e in song.iter_events_dict(d[midi_time])
+                 if song.is_time_signature(e)]
+    if not time_sigs or time_sigs[0][0] != 0:
+        time_sigs.insert(0, (0, (4, 4, 24, 8)))
+    time = 0
+    sigs_index = 0
+    while time <= times[-1]:
+        if sigs_index < len(time_sigs) and time >= time_sigs[sigs_index][0]:
+            time, (num, den, clocks, n32s) = time_sigs[sigs_index]
+            step = (4 * division) // (2 ** den)
+            beat = 1
+            sigs_index += 1
+        yield time, beat, num, den
+        time += step
+        beat = beat % num + 1
+
+
+def old_song(division, tracks):
+    """Returns the beats, music and length like Song computed them before."""
+    d = collections.defaultdict(dict)
+    for n, track in enumerate(tracks):
+        for time, evs in parser.time_events_grouped(
+                old_parse_midi_events(bytes(track))):
+            d[time][n] = evs
+    times = []
+    for midi_time in sorted(d):
+        for e in song.iter_events_dict(d[midi_time]):
+            if song.is_tempo(e):
+                times.append((midi_time, song.get_tempo(e)))
+                break
+    if not times or times[0][0] != 0:
+        times.insert(0, (0, 500000))
+    msec = lambda t: old_real_time(times, division, t) // 1000
+    beats = []
+    measnum = 0
+    for midi_time, beat, num, den in old_beats(d, division):
+        if beat == 1:
+            measnum += 1
+        beats.append((msec(midi_time), measnum, beat, num, den))
+    music = [(msec(midi_time), evs) for midi_time, evs in sorted(d.items())]
+    return beats, music, msec(max(d))
+
+
+def old_event_list(song, time=None, beat=None):
+    """Returns (time, messages, time_flag, beat) tuples for the Player's events.
+
+    This is done like make_event_list() did before, with a dictionary of all
+    times, but the messages on the same msec are combined.
+
+    """
+    d = collections.defaultdict(lambda: [array.array('I'), None, None])
+    slots = song.slots
+    for i, (t, evs) in enumerate(song.music):
+        d[t][0].extend(song.messages[slots[i]:slots[i+1]])
+    if time:
+        for t in range(0, song.length+1, time):
+            d[t][1] = True
+    if beat:
+        for b in song.beats:
+            d[b[0]][2] = b[1:]
+    return [(t,) + tuple(d[t]) for t in sorted(d)]
+
+
+def old_seek(events, time):
+    """Returns the position and offset like Player.seek() found them before."""
+    pos = 0
+    offset = 0
+    if time:
+        end = len(events)
+        while pos < end:
+            mid = (pos + end) // 2
+            if time > events[mid][0]:
+                pos = mid + 1
+            else:
+                end = mid
+        if pos < len(events):
+            offset = events[pos][0] - time
+    return pos, offset
+
+
+def old_seek_measure(events, measnum, beat=1):
+    """Returns the position like Player.seek_measure() found it before, or None."""
+    position = None
+    for i, (t, e) in enumerate(events):
+        if e.beat:
+            if e.beat[0] == measnum:
+                position = i
+                if e.beat[1] >= beat:
+                    break
+            if e.beat[0] > measnum:
+                break
+    return position
+
+
+def old_beat(beats, time):
+    """Returns the beat like Song.beat() found it before."""
+    if not beats:
+        return (0, 0, 0, 4, 2)
+    pos = 0
+    if time:
+        end = len(beats)
+        while pos < end:
+            mid = (pos + end) // 2
+            if time > beats[mid][0]:
+                pos = mid + 1
+            else:
+                end = mid
+    return beats[min(pos, len(beats) - 1)]
+
+
+def tempo_event(tempo):
+    """Returns the bytes of a Set Tempo meta event."""
+    return b'\xFF\x51\x03' + struct.pack('>i', tempo)[1:]
+
+
+def random_events(rng, division):
+    """Returns a list of (delta, bytes) tuples with random events of all types.
+
+    Channel events often use running status.
+
+    """
+    events = []
+    running_status = None
+    for i in range(rng.randint(0, 300)):
+        delta = rng.choice([0, 0, rng.randint(1, division), rng.randint(1, 10000)])
+        kind = rng.random()
+        if kind >= 0.12:
+            status = rng.choice([0x80, 0x90, 0xA0, 0xB0, 0xC0, 0xD0, 0xE0])
+            status |= rng.randrange(16)
+            size = 1 if status >> 4 in (0xC, 0xD) else 2
+            ev = bytes(bytearray(rng.randrange(128) for j in range(size)))
+            if status != running_status or rng.random() < 0.3:
+                ev = bytes(bytearray((status,))) + ev
+            running_status = status
+        else:
+            running_status = None
+            if kind < 0.05:
+                ev = tempo_event(rng.randint(100000, 2000000))
+            elif kind < 0.08:
+                ev = b'\xFF\x58\x04' + bytes(bytearray(
+                    (rng.randint(1, 7), rng.randint(0, 4), 24, 8)))
+            elif kind < 0.1:
+                text = b'x' * rng.randint(0, 200)
+                ev = b'\xFF\x01' + benchmark.var_len(len(text)) + text
+            else:
+                data = bytes(bytearray(rng.randrange(128)
+                    for j in range(rng.randint(0, 200)))) + b'\xF7'
+                ev = b'\xF0' + benchmark.var_len(len(data)) + data
+        events.append((delta, ev))
+    return events
+
+
+class RecordingOutput(output.Output):
+    """An Output that records the (delay, event) tuples it is given."""
+    def __init__(self):
+        self.events = []
+        self.batches = []
+
+    def reset(self):
+        pass
+
+    def send_events(self, events):
+        self.send_timed_events([(0, e) for e in events])
+
+    def send_timed_events(self, events):
+        self.events.extend(e for delay, e in events)
+        self.batches.append([delay for delay, e in events])
+
+
+class RecordingPlayer(player.Player):
+    """A Player that sets its finished attribute at the end of the song."""
+    def __init__(self):
+        player.Player.__init__(self)
+        self.finished = threading.Event()
+
+    def finish_event(self):
+        self.finished.set()
+
+
+def check_tempo_map(rng):
+    """Returns None if all is well, otherwise a description of the difference."""
+    division = rng.choice([96, 192, 384, 480])
+    events, times = [], []
+    time = rng.choice([0, rng.randint(1, 1000)])
+    for i in range(rng.randint(0, 50)):
+        tempo = rng.randint(100000, 2000000)
+        events.append((time - (times[-1][0] if times else 0), tempo_event(tempo)))
+        if not times or times[-1][0] != time:
+            times.append((time, tempo))  # the first tempo change at a time counts
+        time += rng.choice([0, rng.randint(1, 4 * division)])
+    if not times or times[0][0] != 0:
+        times.insert(0, (0, 500000))
+    tempo_map = song.TempoMap(parser.parse_midi_track(
+        benchmark.track(events)[8:]), division)
+    midi_times = sorted([t for t, tempo in times] +
+        [rng.randint(0, time + 4 * division) for i in range(200)])
+    for t in midi_times:
+        if tempo_map.real_time(t) != old_real_time(times, division, t):
+            return "real_time({0}) differs".format(t)
+    if tempo_map.msecs(midi_times) != [
+            old_real_time(times, division, t) // 1000 for t in midi_times]:
+        return "msecs() differs"
+
+
+def random_midi(rng):
+    """Returns the bytes of a type 1 MIDI file with random events."""
+    division = rng.choice([96, 192, 384, 480])
+    chunks = [benchmark.track(random_events(rng, division))
+              for i in range(rng.randint(1, 5))]
+    return (b'MThd' + struct.pack('>ihhh', 6, 1, len(chunks), division)
+            + b''.join(chunks))
+
+
+def check_song(rng):
+    """Returns None if all is well, otherwise a description of the difference."""
+    fmt, div, tracks = parser.parse_midi_data(random_midi(rng))
+    s = song.Song(div, tracks)
+    beats, music, length = old_song(div, tracks)
+    if s.beats != beats:
+        return "beats differ"
+    if s.music != music:
+        return "music differs"
+    if s.length != length:
+        return "length differs"
+
+
+def check_messages(rng):
+    """Returns None if all is well, otherwise a description of the difference."""
+    fmt, div, tracks = parser.parse_midi_data(random_midi(rng))
+    s = song.Song(div, tracks)
+    out = output.PortMidiOutput()
+    for i, (time, evs) in enumerate(s.music):
+        if s.messages[s.slots[i]:s.slots[i+1]] != out.pack_midi(evs):
+            return "the messages at {0} msec differ".format(time)
+    for time, e in player.make_event_list(s, 1000, True):
+        if e.midi and e.messages != out.pack_midi(e.midi):
+            return "the messages of the event at {0} msec differ".format(time)
+
+
+def check_seek(rng):
+    """Returns None if all is well, otherwise a description of the difference."""
+    fmt, div, tracks = parser.parse_midi_data(random_midi(rng))
+    s = song.Song(div, tracks)
+    time, beat = rng.choice([None, 250, 1000]), rng.random() < 0.8
+    p = player.Player()
+    p.set_song(s, time, beat)
+    events = p._events
+    if [(t, e.messages or array.array('I'), e.time, e.beat)
+            for t, e in events] != old_event_list(s, time, beat):
+        return "the events differ"
+    times = [rng.randint(0, s.length + 10) for i in range(200)]
+    for t in times + [0, s.length]:
+        p.seek(t)
+        if (p._position, p._offset) != old_seek(events, t):
+            return "seek({0}) differs".format(t)
+        if s.beat(t) != old_beat(s.beats, t):
+            return "beat({0}) differs".format(t)
+    measures = s.beats[-1][1] if s.beats else 0
+    for i in range(50):
+        measnum, b = rng.randint(0, measures + 1), rng.randint(1, 8)
+        position = old_seek_measure(events, measnum, b)
+        found = p.seek_measure(measnum, b)
+        if found != (position is not None) or (
+                found and p._position != position):
+            return "seek_measure({0}, {1}) differs".format(measnum, b)
+
+
+def check_playback(rng):
+    """Returns None if all is well, otherwise a description of the difference."""
+    # with a tick of 1 usec the song takes about 100 msec, with some gaps
+    # longer than the lookahead time
+    events = [(0, tempo_event(1000))]
+    for i in range(100):
+        delta = rng.choice([rng.randint(0, 1000)] * 9 + [rng.randint(0, 20000)])
+        events.append((delta, bytes(bytearray(
+            (rng.choice([0x80, 0x90, 0xB0, 0xE0]) | rng.randrange(16),
+             rng.randrange(128), rng.randrange(128))))))
+    s = song.Song(1000, [benchmark.track(events)[8:]])
+    p = RecordingPlayer()
+    out = RecordingOutput()
+    p.set_output(out)
+    p.set_song(s)
+    p.set_tempo_factor(rng.choice([0.5, 1.0, 2.0]))
+    p.start()
+    if not p.finished.wait(10):
+        p.stop()
+        return "the song did not finish"
+    expected = [e for time, evs in s.music
+                for track in sorted(evs) for e in evs[track]]
+    if out.events != expected:
+        return "the events differ"
+    for delays in out.batches:
+        if delays != sorted(delays) or delays[-1] > p.lookahead + 1e-6:
+            return "wrong delays in a batch: {0}".format(delays)
+    if not p.jitter().count:
+        return "no jitter statistics"
+
+
+CHECKS = [
+    ("tempo map", check_tempo_map),
+    ("song", check_song),
+    ("messages", check_messages),
+    ("seek", check_seek),
+    ("playback", check_playback),
+]
+
+
+def main():
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    failed = 0
+    for name, check in CHECKS:
+        for seed in range(seeds):
+            result = check(random.Random(seed))
+            if result:
+                print("{0}, seed {1}: {2}".format(name, seed, result))
+                failed += 1
+    print("{0} checks, {1} seeds: {2} failed".format(len(CHECKS), seeds, failed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ Writes MIDI events to a MIDI output.
 """
 
 
+import array
 import contextlib
 
 from . import event
@@ -34,13 +35,33 @@ class Output(object):
     
     """
     
-    def midi_event(self, midi):
-        """Handles a list or dict of MIDI events from a Song (midisong.py)."""
+    def midi_event(self, midi, messages=None):
+        """Handles a list or dict of MIDI events from a Song (midisong.py).
+        
+        If given, messages is an array with the same events packed like in
+        Song.messages; the default implementation does not use it.
+        
+        """
         if isinstance(midi, dict):
             # dict mapping track to events?
             midi = sum(map(midi.get, sorted(midi)), [])
         self.send_events(midi)
     
+    def timed_midi_events(self, batch):
+        """Handles a list of (delay, midi, messages) tuples from a Player.
+        
+        Each midi is a list or dict of MIDI events and messages an array or
+        None, as given to midi_event(), and delay the time in msec from now
+        the events should sound.
+        
+        """
+        events = []
+        for delay, midi, messages in batch:
+            if isinstance(midi, dict):
+                midi = sum(map(midi.get, sorted(midi)), [])
+            events.extend((delay, e) for e in midi)
+        self.send_timed_events(events)
+    
     def reset(self):
         """Restores the MIDI output to an initial state.
         
@@ -96,6 +117,15 @@ class Output(object):
         """
         pass
     
+    def send_timed_events(self, events):
+        """Writes the list of (delay, event) tuples to the output port.
+        
+        The default implementation ignores the delays and sends the events
+        right away using send_events().
+        
+        """
+        self.send_events([e for delay, e in events])
+    
     @contextlib.contextmanager
     def sender(self):
         """Returns a context manager to call for each event to send.
@@ -118,18 +148,72 @@ class PortMidiOutput(Output):
     """
     output = None
     
+    def midi_event(self, midi, messages=None):
+        """Writes the packed messages if given, else converts the midi."""
+        if messages is None:
+            messages = self.pack_midi(midi)
+        self.write_messages(messages, array.array('I', [0]) * len(messages))
+    
+    def timed_midi_events(self, batch):
+        """Writes the packed messages of the batch with their timestamps."""
+        messages = array.array('I')
+        timestamps = array.array('I')
+        for delay, midi, packed in batch:
+            if packed is None:
+                packed = self.pack_midi(midi)
+            messages.extend(packed)
+            timestamps.extend(array.array('I', [self.timestamp(delay)]) * len(packed))
+        self.write_messages(messages, timestamps)
+    
     def send_events(self, events):
         """Writes the list of events to the PortMIDI output port."""
-        l = []
+        messages = self.pack_events(events)
+        self.write_messages(messages, array.array('I', [0]) * len(messages))
+    
+    def send_timed_events(self, events):
+        """Writes the list of (delay, event) tuples to the PortMIDI output port.
+        
+        The events get the timestamps returned by timestamp().
+        
+        """
+        messages = array.array('I')
+        timestamps = array.array('I')
+        for delay, e in events:
+            m = self.convert_event(e)
+            if m:
+                messages.append(pack(m))
+                timestamps.append(self.timestamp(delay))
+        self.write_messages(messages, timestamps)
+    
+    def timestamp(self, delay):
+        """Returns the PortMIDI timestamp for an event delay msec from now.
+        
+        The default implementation returns 0, sending the event immediately.
+        Timestamps are only used when the PortMIDI output is opened with a
+        latency other than 0.
+        
+        """
+        return 0
+    
+    def write_messages(self, messages, timestamps):
+        """Writes the arrays of packed messages and timestamps in chunks."""
+        for i in range(0, len(messages), 1024):
+            self.output.write_messages(messages[i:i+1024], timestamps[i:i+1024])
+    
+    def pack_midi(self, midi):
+        """Returns an array with the packed messages of a list or dict of events."""
+        if isinstance(midi, dict):
+            midi = sum(map(midi.get, sorted(midi)), [])
+        return self.pack_events(midi)
+    
+    def pack_events(self, events):
+        """Returns an array with the packed messages of the list of events."""
+        messages = array.array('I')
         for e in events:
             m = self.convert_event(e)
             if m:
-                l.append([m, 0])
-        while len(l) > 1024:
-            self.output.write(l[:1024])
-            l = l[1024:]
-        if l:
-            self.output.write(l)
+                messages.append(pack(m))
+        return messages
     
     def convert_event(self, e):
         """Returns a list of integers representing a MIDI message from event."""
@@ -156,4 +240,15 @@ class PortMidiOutput(Output):
         return [0xE0 + e.channel, e.value & 0x7F, e.value >> 7]
 
 
+def pack(message):
+    """Returns a MIDI message (a list of integers) packed in one integer.
+    
+    The first byte is in the lowest 8 bits, like PortMIDI packs messages.
+    
+    """
+    result = 0
+    for i, byte in enumerate(message):
+        result |= (byte & 0xFF) << (8 * i)
+    return result
+
 
@@ -22,6 +22,10 @@ midifile.parser -- parses MIDI file data.
 This is a simple module that can parse data from a MIDI file and
 its tracks.
 
+The tracks are parsed into Events instances, that store the events compactly
+in parallel arrays. Events of several tracks can be merged into one Events
+instance, sorted on time.
+
 A basic event factory returns the MIDI events as simple named tuples,
 but you can subclass the event factory for more sophisticated behaviour.
 
@@ -31,6 +35,7 @@ Runs with Python 2.6, 2.7 and 3.
 
 from __future__ import print_function
 
+import array
 import sys
 import struct
 
@@ -47,12 +52,15 @@ unpack_int = struct.Struct(b'>i').unpack
 def get_chunks(s):
     """Splits a MIDI file bytes string into chunks.
     
-    Yields (b'Name', b'data') tuples.
+    Yields (b'Name', b'data') tuples. With Python 3, the data are memoryviews
+    of s, so the chunks are not copied.
     
     """
+    if not PY2:
+        s = memoryview(s)
     pos = 0
     while pos < len(s):
-        name = s[pos:pos+4]
+        name = bytes(s[pos:pos+4])
         size, = unpack_int(s[pos+4:pos+8])
         yield name, s[pos+8:pos+8+size]
         pos += size + 8
@@ -62,7 +70,7 @@ def parse_midi_data(s):
     """Parses MIDI file data from the bytes string s.
     
     Returns a three tuple (format_type, time_division, tracks).
-    Every track is an unparsed bytes string.
+    Every track is an unparsed bytes string (a memoryview with Python 3).
     
     May raise ValueError or IndexError in case of invalid MIDI data.
     
@@ -92,29 +100,103 @@ def read_var_len(s, pos):
             return value, pos
 
 
-def parse_midi_events(s, factory=None):
-    """Parses the bytes string s (typically a track) for MIDI events.
+class Events(object):
+    """MIDI events, stored in parallel arrays.
     
-    If factory is given, it should be an EventFactory instance that
-    returns objects describing the event.
+    The following instance attributes are arrays with an item per event:
     
-    Yields two-tuples (delta, event).
+    time: the MIDI time of the event (not the delta time)
+    status: the status byte (0xFF for meta events, 0xF0 or 0xF7 for sysex)
+    data1, data2: the data bytes (0 if not used); data1 is the type of a
+            meta event
+    track: the number of the track the event was in
     
-    Raises ValueError or IndexError on invalid MIDI data.
+    The data of meta and sysex events is in the data attribute, a dictionary
+    mapping the index of the event to a bytes string.
     
     """
-    if factory is None:
-        factory = event.EventFactory()
+    # the names of the array attributes
+    columns = ('time', 'status', 'data1', 'data2', 'track')
+    
+    def __init__(self):
+        self.time = array.array('L')
+        self.status = array.array('B')
+        self.data1 = array.array('B')
+        self.data2 = array.array('B')
+        self.track = array.array('H')
+        self.data = {}
+    
+    def __len__(self):
+        return len(self.time)
+    
+    def event(self, index, factory):
+        """Returns an object for the event at index, created by factory.
         
-    running_status = None
+        The factory should be an EventFactory instance.
+        
+        """
+        status = self.status[index]
+        ev_type = status >> 4
+        channel = status & 0x0F
+        if ev_type <= 0x0A:
+            return factory.note_event(ev_type, channel,
+                self.data1[index], self.data2[index])
+        elif ev_type >= 0x0F:
+            if status == 0xFF:
+                return factory.meta_event(self.data1[index], self.data[index])
+            return factory.sysex_event(status, self.data[index])
+        elif ev_type == 0x0E:
+            return factory.pitchbend_event(channel,
+                self.data1[index] + self.data2[index] * 128)
+        elif ev_type == 0xD:
+            return factory.channelaftertouch_event(channel, self.data1[index])
+        elif ev_type == 0xB:
+            return factory.controller_event(channel,
+                self.data1[index], self.data2[index])
+        else: # ev_type == 0xC
+            return factory.programchange_event(channel, self.data1[index])
+    
+    def meta_events(self, meta_type):
+        """Yields (index, data) for the meta events of the specified type."""
+        for index in sorted(self.data):
+            if self.status[index] == 0xFF and self.data1[index] == meta_type:
+                yield index, self.data[index]
+
+
+def parse_midi_track(s, track=0, events=None):
+    """Parses the bytes string s (typically a track) for MIDI events.
+    
+    The events are appended to the Events instance, which is created if not
+    given, and returned. The track number is stored with every event.
+    
+    Raises ValueError or IndexError on invalid MIDI data; the events before
+    the error have then been appended to events.
+    
+    """
+    if events is None:
+        events = Events()
     
     if PY2:
         s = bytearray(s)
     
+    append_time = events.time.append
+    append_status = events.status.append
+    append_data1 = events.data1.append
+    append_data2 = events.data2.append
+    append_track = events.track.append
+    data = events.data
+    
+    running_status = None
+    time = 0
     pos = 0
     while pos < len(s):
         
-        delta, pos = read_var_len(s, pos)
+        delta = s[pos]
+        if delta & 0x80:
+            delta, pos = read_var_len(s, pos)
+        else:
+            pos += 1
+        time += delta
         
         status = s[pos]
         if status & 0x80:
@@ -126,51 +208,96 @@ def parse_midi_events(s, factory=None):
             status = running_status
         
         ev_type = status >> 4
-        channel = status & 0x0F
         
-        if ev_type <= 0x0A:
-            # note on, off or aftertouch
-            note = s[pos]
-            value = s[pos+1]
-            pos += 2
-            ev = factory.note_event(ev_type, channel, note, value)
-        elif ev_type >= 0x0F:
+        if ev_type >= 0x0F:
             running_status = None
             if status == 0xFF:
                 # meta event
-                meta_type = s[pos]
-                meta_size, pos = read_var_len(s, pos+1)
-                meta_data = s[pos:pos+meta_size]
-                pos += meta_size
-                ev = factory.meta_event(meta_type, meta_data)
+                data1 = s[pos]
+                size, pos = read_var_len(s, pos+1)
             else:
                 # some sort of sysex
-                sysex_size, pos = read_var_len(s, pos)
-                sysex_data = s[pos:pos+sysex_size]
-                pos += sysex_size
-                ev = factory.sysex_event(status, sysex_data)
-        elif ev_type == 0x0E:
-            # Pitch Bend
-            value = s[pos] + s[pos+1] * 128
-            pos += 2
-            ev = factory.pitchbend_event(channel, value)
-        elif ev_type == 0xD:
-            # Channel AfterTouch
-            value = s[pos]
+                data1 = 0
+                size, pos = read_var_len(s, pos)
+            data[len(events.time)] = bytes(s[pos:pos+size])
+            pos += size
+            data2 = 0
+        elif ev_type == 0xC or ev_type == 0xD:
+            # Program Change or Channel AfterTouch
+            data1 = s[pos]
+            data2 = 0
             pos += 1
-            ev = factory.channelaftertouch_event(channel, value)
-        elif ev_type == 0xB:
-            # Controller
-            number = s[pos]
-            value = s[pos+1]
+        else:
+            # note on, off, aftertouch, controller or pitch bend
+            data1 = s[pos]
+            data2 = s[pos+1]
             pos += 2
-            ev = factory.controller_event(channel, number, value)
-        else: # ev_type == 0xC
-            # Program Change
-            number = s[pos]
-            pos += 1
-            ev = factory.programchange_event(channel, number)
-        yield delta, ev
+        append_time(time)
+        append_status(status)
+        append_data1(data1)
+        append_data2(data2)
+        append_track(track)
+    return events
+
+
+def merge_events(tracks):
+    """Returns one Events instance with the events of all Events in tracks.
+    
+    The events are sorted on time, events at the same time on track number,
+    and the order of the events in each track is kept.
+    
+    """
+    result = Events()
+    offset = 0
+    for events in tracks:
+        for name in Events.columns:
+            getattr(result, name).extend(getattr(events, name))
+        for index, data in events.data.items():
+            result.data[offset + index] = data
+        offset += len(events)
+    if len(tracks) > 1:
+        # Python's sort is stable and merges the sorted runs it finds, so this
+        # is a k-way merge of the tracks, done in C
+        order = sorted(range(len(result)), key=result.time.__getitem__)
+        for name in Events.columns:
+            column = getattr(result, name)
+            setattr(result, name,
+                array.array(column.typecode, map(column.__getitem__, order)))
+        if result.data:
+            position = sorted(range(len(order)), key=order.__getitem__)
+            result.data = dict((position[index], data)
+                               for index, data in result.data.items())
+    return result
+
+
+def parse_midi_events(s, factory=None):
+    """Parses the bytes string s (typically a track) for MIDI events.
+    
+    If factory is given, it should be an EventFactory instance that
+    returns objects describing the event.
+    
+    Yields two-tuples (delta, event).
+    
+    Raises ValueError or IndexError on invalid MIDI data.
+    
+    """
+    if factory is None:
+        factory = event.EventFactory()
+    
+    events = Events()
+    try:
+        parse_midi_track(s, 0, events)
+    except (ValueError, IndexError) as e:
+        error = e
+    else:
+        error = None
+    
+    time = 0
+    for index, t in enumerate(events.time):
+        yield t - time, events.event(index, factory)
+        time = t
+    if error:
+        raise error
 
 
 def time_events(track, time=0):
@@ -21,23 +21,43 @@ A MIDI Player.
 """
 
 
-import collections
+import array
+import bisect
+import heapq
+import math
 import time
 import threading
+import weakref
 
 from . import song
 
 
+try:
+    _clock = time.perf_counter_ns
+except AttributeError:
+    # Python < 3.7
+    _clock = lambda: int(time.time() * 1000000000)
+
+
 class Player(object):
     """The base class for a MIDI player.
     
     Use set_output() to set a MIDI output instance (see output.py).
     You can override: timer_midi_time(), timer_start() and timer_stop()
-    to use another timing source than the Python threading.Timer instances.
+    to use another timing source than the Engine thread.
+    
+    When the timer fires, the events due within the next lookahead msec are
+    handled as well, and their MIDI events are sent to the output together,
+    each with the delay after which it should sound.
     
     """
+    
+    # msec to look ahead for events that are sent together
+    lookahead = 5
+    
     def __init__(self):
         self._song = None
+        self._timeline = Timeline()
         self._events = []
         self._position = 0
         self._offset = 0
@@ -46,6 +66,10 @@ class Player(object):
         self._tempo_factor = 1.0
         self._output = None
         self._last_exception = None
+        self._timer = None
+        self._batch = None
+        self._batch_delay = 0
+        self._jitter = Jitter()
     
     def set_output(self, output):
         """Sets an Output instance that handles the MIDI events.
@@ -80,7 +104,8 @@ class Player(object):
         if playing:
             self.timer_stop_playing()
         self._song = song
-        self._events = make_event_list(song, time, beat)
+        self._timeline = timeline(song, time, beat)
+        self._events = self._timeline.events
         self._position = 0
         self._offset = 0
         if playing:
@@ -95,6 +120,7 @@ class Player(object):
         if self._playing:
             self.stop()
         self._song = None
+        self._timeline = Timeline()
         self._events = []
         self._position = 0
         self._offset = 0
@@ -136,22 +162,13 @@ class Player(object):
         """Returns the tempo factor (by default: 1.0)."""
         return self._tempo_factor
     
+    def jitter(self):
+        """Returns the Jitter statistics of the timer since playing started."""
+        return self._jitter
+    
     def seek(self, time):
         """Goes to the specified time (in msec)."""
-        pos = 0
-        offset = 0
-        if time:
-            # bisect our way in the events list.
-            end = len(self._events)
-            while pos < end:
-                mid = (pos + end) // 2
-                if time > self._events[mid][0]:
-                    pos = mid + 1
-                else:
-                    end = mid
-            if pos < len(self._events):
-                offset = self._events[pos][0] - time
-        self.set_position(pos, offset)
+        self.set_position(*self._timeline.position(time))
     
     def seek_measure(self, measnum, beat=1):
         """Goes to the specified measure and beat (beat defaults to 1).
@@ -159,20 +176,11 @@ class Player(object):
         Returns whether the measure position could be found (True or False).        
         
         """
-        result = False
-        for i, (t, e) in enumerate(self._events):
-            if e.beat:
-                if e.beat[0] == measnum:
-                    position = i
-                    result = True
-                    if e.beat[1] >= beat:
-                        break
-                if e.beat[0] > measnum:
-                    break
-        if result:
-            self.set_position(position)
-            return True
-        return False
+        position = self._timeline.measure_position(measnum, beat)
+        if position is None:
+            return False
+        self.set_position(position)
+        return True
         
     def set_position(self, position, offset=0):
         """(Private) Goes to the specified position in the internal events list.
@@ -214,7 +222,7 @@ class Player(object):
     def handle_event(self, time, event):
         """(Private) Called for every event."""
         if event.midi:
-            self.midi_event(event.midi)
+            self.midi_event(event.midi, event.messages)
         if event.time:
             self.time_event(time)
         if event.beat:
@@ -222,15 +230,28 @@ class Player(object):
         if event.user is not None:
             self.user_event(event.user)
     
-    def midi_event(self, midi):
+    def midi_event(self, midi, messages=None):
         """(Private) Plays the specified MIDI events.
         
         The format depends on the way MIDI events are stored in the Song.
+        If not None, messages is an array with the events packed (see
+        Song.messages).
         
         """
-        if self._output:
+        if self._batch is not None:
+            self._batch.append((self._batch_delay, midi, messages))
+        elif self._output:
+            try:
+                self._output.midi_event(midi, messages)
+            except BaseException as e:
+                self.exception_event(e)
+    
+    def send_batch(self):
+        """(Private) Sends the MIDI events collected by timer_timeout()."""
+        batch, self._batch = self._batch, None
+        if batch and self._output:
             try:
-                self._output.midi_event(midi)
+                self._output.timed_midi_events(batch)
             except BaseException as e:
                 self.exception_event(e)
     
@@ -281,11 +302,11 @@ class Player(object):
     def timer_midi_time(self):
         """Should return a continuing time value in msec, used while playing.
         
-        The default implementation returns the time in msec from the Python
-        time module.
+        The default implementation returns the time in msec (as a float) from
+        the monotonic performance counter of the Python time module.
         
         """
-        return int(time.time() * 1000)
+        return _clock() / 1000000
     
     def timer_schedule(self, delay, sync=True):
         """Schedules the upcoming event.
@@ -303,15 +324,14 @@ class Player(object):
     
     def timer_start(self, msec):
         """Starts the timer to fire once, the specified msec from now."""
-        self._timer = None
-        self._timer = threading.Timer(msec / 1000.0, self.timer_timeout)
-        self._timer.start()
+        if not self._timer:
+            self._timer = Engine(self.timer_timeout)
+        self._timer.start(msec)
 
     def timer_stop(self):
         """Stops the timer."""
         if self._timer:
-            self._timer.cancel()
-            self._timer = None
+            self._timer.stop()
 
     def timer_offset(self):
         """Returns the time before the next event.
@@ -325,6 +345,7 @@ class Player(object):
         """Starts playing by starting the timer for the first upcoming event."""
         reset = self.current_time() == 0
         self._playing = True
+        self._jitter.reset()
         self.start_event()
         if reset and self._output:
             try:
@@ -336,11 +357,23 @@ class Player(object):
     def timer_timeout(self):
         """Called when the timer times out.
         
-        Handles an event and schedules the next.
+        Handles an event and the events due within the lookahead time after
+        it, sends their MIDI events together and schedules the next event.
         If the end of a song is reached, calls finish_event()
         
         """
+        self._jitter.add(self.timer_midi_time() - self._sync_time)
+        self._batch = []
+        self._batch_delay = 0
         offset = self.next_event()
+        while offset:
+            msec = offset / self._tempo_factor
+            if self._batch_delay + msec > self.lookahead:
+                break
+            self._batch_delay += msec
+            self._sync_time += msec
+            offset = self.next_event()
+        self.send_batch()
         if offset:
             self.timer_schedule(offset)
         else:
@@ -355,6 +388,98 @@ class Player(object):
         self.stop_event()
 
 
+class Engine(object):
+    """A timer thread that calls a function once, some msec after start().
+    
+    One thread is used for all the events of a Player. It waits until just
+    before the time is reached and then spins the last part, to fire as
+    precisely as possible.
+    
+    """
+    
+    # msec before the time the thread stops sleeping
+    spin = 1.0
+    
+    def __init__(self, function):
+        self._function = function
+        self._condition = threading.Condition()
+        self._deadline = None   # nanoseconds
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def start(self, msec):
+        """Calls the function once, msec from now; replaces a former call."""
+        with self._condition:
+            self._deadline = _clock() + int(msec * 1000000)
+            self._condition.notify()
+    
+    def stop(self):
+        """Cancels the call."""
+        with self._condition:
+            self._deadline = None
+            self._condition.notify()
+    
+    def _run(self):
+        """(Private) The thread loop."""
+        spin = int(self.spin * 1000000)
+        while True:
+            with self._condition:
+                while self._deadline is None:
+                    self._condition.wait()
+                remaining = self._deadline - _clock()
+                if remaining > spin:
+                    self._condition.wait((remaining - spin) / 1000000000)
+                    continue
+                deadline = self._deadline
+                self._deadline = None
+            while _clock() < deadline:
+                pass
+            self._function()
+
+
+class Jitter(object):
+    """Statistics of how late (in msec) a Player's timer fired.
+    
+    Attributes: count, mean, min and max; stdev() returns the standard
+    deviation. A negative value means the timer fired early.
+    
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Forgets the collected statistics."""
+        self.count = 0
+        self.mean = 0.0
+        self.min = 0.0
+        self.max = 0.0
+        self._m2 = 0.0
+    
+    def add(self, msec):
+        """Adds a measured lateness in msec."""
+        self.count += 1
+        if self.count == 1:
+            self.min = self.max = msec
+        else:
+            self.min = min(self.min, msec)
+            self.max = max(self.max, msec)
+        delta = msec - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (msec - self.mean)
+    
+    def stdev(self):
+        """Returns the standard deviation in msec."""
+        if self.count > 1:
+            return math.sqrt(self._m2 / (self.count - 1))
+        return 0.0
+    
+    def __repr__(self):
+        return ("<Jitter count={0} mean={1:.3f} stdev={2:.3f} min={3:.3f} "
+                "max={4:.3f} (msec)>".format(self.count, self.mean,
+                self.stdev(), self.min, self.max))
+
+
 class Event(object):
     """Any event (MIDI, Time and/or Beat).
     
@@ -363,12 +488,14 @@ class Event(object):
     time: if True, time_event() is called with the current music time.
     beat: None or (measnum, beat, num, den), then beat_event() is called.
     midi: If not None, midi_event() is called with the midi.
+    messages: None or an array with the packed messages of the midi.
     user: Any object, if not None, user_event() is called with the object.
     
     """
-    __slots__ = ['midi', 'time', 'beat', 'user']
+    __slots__ = ['midi', 'messages', 'time', 'beat', 'user']
     def __init__(self):
         self.midi = None
+        self.messages = None
         self.time = None
         self.beat = None
         self.user = None
@@ -396,19 +523,122 @@ def make_event_list(song, time=None, beat=None):
     MIDI events are always created.
     
     """
-    d = collections.defaultdict(Event)
+    return timeline(song, time, beat).events
+
+
+def timeline(song, time=None, beat=None):
+    """Returns the Timeline of the events in Song.
+    
+    The arguments are the same as for make_event_list(). A Timeline is only
+    created once for the same song and arguments.
+    
+    """
+    timelines = _timelines.setdefault(song, {})
+    try:
+        return timelines[(time, beat)]
+    except KeyError:
+        t = timelines[(time, beat)] = Timeline(song, time, beat)
+        return t
+
+
+_timelines = weakref.WeakKeyDictionary()    # Song -> {(time, beat): Timeline}
+
+
+class Timeline(object):
+    """The events of a Song as a Player plays them, indexed for seeking.
     
-    for t, evs in song.music:
-        d[t].midi = evs
+    The following instance attributes are set on init:
     
-    if time:
-        for t in range(0, song.length+1, time):
-            d[t].time = True
+    events: a list of two-tuples(time, Event), sorted on time
+    times: an array with the time of every event
+    beats: an array with the index in events of every Event with a beat
+    measures: a dict mapping every measure number to the (start, end) range in
+            beats of the Events with a beat in that measure
     
-    if beat:
-        for i in song.beats:
-            d[i[0]].beat = i[1:]
+    The song's music, time and beat events are merged in one pass, as they
+    are already sorted. MIDI events that fall on the same msec are combined.
     
-    return [(t, d[t]) for t in sorted(d)]
+    """
+    def __init__(self, song=None, time=None, beat=None):
+        sources = []
+        if song:
+            sources.append((t, 0, i) for i, (t, evs) in enumerate(song.music))
+            if time:
+                sources.append((t, 1, None) for t in range(0, song.length+1, time))
+            if beat:
+                sources.append((b[0], 2, b[1:]) for b in song.beats)
+        self.events = events = []
+        self.times = times = array.array('L')
+        self.beats = beats = array.array('L')
+        self.measures = measures = {}
+        e = None
+        for t, kind, value in heapq.merge(*sources):
+            if not events or t != events[-1][0]:
+                e = Event()
+                events.append((t, e))
+                times.append(t)
+            if kind == 0:
+                self._set_midi(e, song, value)
+            elif kind == 1:
+                e.time = True
+            else:
+                if e.beat:
+                    # a later beat on the same msec replaces the former
+                    start, end = measures.pop(e.beat[0])
+                    if end - 1 > start:
+                        measures[e.beat[0]] = (start, end - 1)
+                    beats.pop()
+                e.beat = value
+                n = len(beats)
+                start, end = measures.get(value[0], (n, n))
+                measures[value[0]] = (start, end + 1)
+                beats.append(len(events) - 1)
+    
+    @staticmethod
+    def _set_midi(e, song, index):
+        """(Private) Sets the midi and messages of song.music[index] to e."""
+        slots = song.slots
+        evs = song.music[index][1]
+        if e.midi:
+            # rounding put two MIDI times on one msec, combine them
+            midi = dict(e.midi)
+            for track, l in evs.items():
+                midi[track] = midi.get(track, []) + l
+            e.midi = midi
+            e.messages = e.messages + song.messages[slots[index]:slots[index+1]]
+        else:
+            e.midi = evs
+            e.messages = song.messages[slots[index]:slots[index+1]]
+    
+    def position(self, time):
+        """Returns (position, offset) in events for the time in msec.
+        
+        The position is the first event at or after the time, and the offset
+        the time from the time until that event.
+        
+        """
+        if not time:
+            return 0, 0
+        pos = bisect.bisect_left(self.times, time)
+        if pos < len(self.times):
+            return pos, self.times[pos] - time
+        return pos, 0
+    
+    def measure_position(self, measnum, beat=1):
+        """Returns the position in events of the measure and beat, or None.
+        
+        If the measure has less beats, the position of the last beat is
+        returned.
+        
+        """
+        try:
+            start, end = self.measures[measnum]
+        except KeyError:
+            return
+        for i in range(start, end):
+            position = self.beats[i]
+            if self.events[position][1].beat[1] >= beat:
+                break
+        return position
 
 
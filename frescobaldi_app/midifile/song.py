@@ -21,6 +21,8 @@ midifile.song -- structures MIDI file data as a song.
 """
 
 
+import array
+import bisect
 import collections
 
 from . import event
@@ -68,6 +70,27 @@ def events_dict_together(tracks):
     return d
 
 
+def meta_events(d, meta_type):
+    """Yields (midi_time, event) for the meta events of meta_type in d.
+    
+    d is a parser.Events instance or an events dictionary as returned by
+    events_dict() or events_dict_together(). The events are yielded in the
+    order of their time.
+    
+    """
+    if isinstance(d, parser.Events):
+        factory = event.EventFactory()
+        for index, data in d.meta_events(meta_type):
+            yield d.time[index], d.event(index, factory)
+    else:
+        events = events_iter(d)
+        if events:
+            for midi_time in sorted(d):
+                for e in events(d[midi_time]):
+                    if isinstance(e, event.MetaEvent) and e.type == meta_type:
+                        yield midi_time, e
+
+
 def is_tempo(e):
     """Returns True if the event is a Set Tempo Meta-event."""
     return isinstance(e, event.MetaEvent) and e.type == 0x51
@@ -116,42 +139,68 @@ def iter_events_dict(evs):
 
 
 class TempoMap(object):
-    """Converts midi time to real time in microseconds."""
+    """Converts midi time to real time in microseconds.
+    
+    For every tempo change the real time it happens is computed beforehand,
+    so converting a MIDI time only needs a bisect lookup.
+    
+    """
     def __init__(self, d, division):
-        """Initialize our tempo map based on events d and division."""
-        # are the events one list (single-track) or a dict (per-track)?
+        """Initialize our tempo map based on events d and division.
+        
+        d is a parser.Events instance or an events dictionary.
+        
+        """
         self.division = smpte_division(division)
         self.times = times = []
-        events = events_iter(d)
-        if events:
-            for midi_time, evs in sorted(d.items()):
-                for e in events(evs):
-                    if is_tempo(e):
-                        times.append((midi_time, get_tempo(e)))
-                        break
+        for midi_time, e in meta_events(d, 0x51):
+            # use the first tempo change at a time
+            if not times or times[-1][0] != midi_time:
+                times.append((midi_time, get_tempo(e)))
         if not times or times[0][0] != 0:
             times.insert(0, (0, 500000))
-        
+        # the MIDI time, tempo and the real time (multiplied with the
+        # division) of every tempo change
+        self._midi_times = [midi_time for midi_time, tempo in times]
+        self._tempos = [tempo for midi_time, tempo in times]
+        self._real_times = real_times = [0]
+        for (t1, tempo), (t2, next_tempo) in zip(times, times[1:]):
+            real_times.append(real_times[-1] + (t2 - t1) * tempo)
+    
     def real_time(self, midi_time):
         """Returns the real time in microseconds for the given MIDI time."""
-        real_time = 0
-        times = self.times
-        for i in range(1, len(times)):
-            if times[i][0] >= midi_time:
-                real_time += (midi_time - times[i-1][0]) * times[i-1][1]
-                break
-            real_time += (times[i][0] - times[i-1][0]) * times[i-1][1]
-        else:
-            real_time += (midi_time - times[-1][0]) * times[-1][1]
-        return real_time // self.division
+        i = max(0, bisect.bisect_right(self._midi_times, midi_time) - 1)
+        return (self._real_times[i] +
+            (midi_time - self._midi_times[i]) * self._tempos[i]) // self.division
     
     def msec(self, midi_time):
         """Returns the real time in milliseconds."""
         return self.real_time(midi_time) // 1000
+    
+    def msecs(self, midi_times):
+        """Returns a list with the real time in milliseconds for every MIDI time.
+        
+        The MIDI times must be sorted. Instead of a lookup for every time, the
+        times and the tempo changes are walked through together.
+        
+        """
+        starts, tempos, real_times = self._midi_times, self._tempos, self._real_times
+        division = self.division * 1000
+        result = []
+        i, last = 0, len(starts) - 1
+        start, tempo, real_time = starts[0], tempos[0], real_times[0]
+        for midi_time in midi_times:
+            if i < last and midi_time >= starts[i+1]:
+                i = bisect.bisect_right(starts, midi_time, i + 1) - 1
+                start, tempo, real_time = starts[i], tempos[i], real_times[i]
+            result.append((real_time + (midi_time - start) * tempo) // division)
+        return result
 
 
 def beats(d, division):
-    """Yields tuples for every beat in the events dictionary d.
+    """Yields tuples for every beat in d.
+    
+    d is a parser.Events instance or an events dictionary.
     
     Each tuple is:
         (midi_time, beat_num, beat_total, denominator)
@@ -160,15 +209,16 @@ def beats(d, division):
     in the MIDI.
     
     """
-    events = events_iter(d)
-    if not events:
-        return
-    time_sigs = []
-    times = sorted(d)
-    for midi_time in times:
-        for e in events(d[midi_time]):
-            if is_time_signature(e):
-                time_sigs.append((midi_time, get_time_signature(e)))
+    if isinstance(d, parser.Events):
+        if not len(d):
+            return
+        end = d.time[-1]
+    else:
+        if not events_iter(d):
+            return
+        end = max(d)
+    time_sigs = [(midi_time, get_time_signature(e))
+                 for midi_time, e in meta_events(d, 0x58)]
     if not time_sigs or time_sigs[0][0] != 0:
         # default time signature at start
         time_sigs.insert(0, (0, (4, 4, 24, 8)))
@@ -176,7 +226,7 @@ def beats(d, division):
     # now yield a tuple for every beat
     time = 0
     sigs_index = 0
-    while time <= times[-1]:
+    while time <= end:
         
         if sigs_index < len(time_sigs) and time >= time_sigs[sigs_index][0]:
             # new time signature
@@ -197,46 +247,77 @@ class Song(object):
     
     division: the division set in the MIDI header
     ntracks: the number of tracks
-    events: a dict mapping MIDI times to a dict with per-track lists of events.
+    events: a parser.Events instance with the events of all tracks, sorted
+            on time.
     tempo_map: TempoMap instance that computes real time from MIDI time.
     length: the length in milliseconds of the song (same as the time of the last
             event).
     
     beats: a list of tuples(msec, measnum, beat, num, den) for every beat
     music: a list of tuples(msec, d) where d is a dict mapping tracknr to events
+    messages: an array with the channel messages of all the music, every
+            message packed in an integer like PortMIDI uses them
+    slots: an array with the offset in messages of every item in music, and
+            the length of messages
     
     """
     def __init__(self, division, tracks):
         """Initialize the Song with the given division and track chunks."""
         self.division = division
         self.ntracks = len(tracks)
-        self.events = events_dict(tracks)
-        self.tempo_map = t = TempoMap(self.events, division)
-        self.length = t.msec(max(self.events))
+        self.events = events = parser.merge_events(
+            [parser.parse_midi_track(track, n) for n, track in enumerate(tracks)])
+        self.tempo_map = t = TempoMap(events, division)
+        self.length = t.msec(events.time[-1]) if len(events) else 0
 
         self.beats = b = []
         measnum = 0
-        for midi_time, beat, num, den in beats(self.events, division):
+        beat_list = list(beats(self.events, division))
+        beat_msecs = t.msecs(midi_time for midi_time, beat, num, den in beat_list)
+        for msec, (midi_time, beat, num, den) in zip(beat_msecs, beat_list):
             if beat == 1:
                 measnum += 1
-            b.append((t.msec(midi_time), measnum, beat, num, den))
-        self.music = [(t.msec(midi_time), evs)
-                      for midi_time, evs in sorted(self.events.items())]
+            b.append((msec, measnum, beat, num, den))
+        self._beat_times = array.array('L', beat_msecs)
+        # group the events per time and per track. The event tuples are
+        # immutable, so equal channel events can share the same object.
+        # Also pack the messages an Output sends, so it needs not convert them.
+        times, groups = [], []
+        self.messages = messages = array.array('I')
+        self.slots = slots = array.array('L')
+        factory = event.EventFactory()
+        cache = {}
+        last_time = last_track = None
+        for index, (midi_time, track, status, data1, data2) in enumerate(zip(
+                events.time, events.track, events.status, events.data1, events.data2)):
+            if midi_time != last_time:
+                times.append(midi_time)
+                groups.append({})
+                slots.append(len(messages))
+                last_time, last_track = midi_time, None
+            if track != last_track:
+                evs = groups[-1][track] = []
+                last_track = track
+            if status >= 0xF0:
+                evs.append(events.event(index, factory))
+            else:
+                key = data2 << 16 | data1 << 8 | status
+                try:
+                    evs.append(cache[key])
+                except KeyError:
+                    e = cache[key] = events.event(index, factory)
+                    evs.append(e)
+                if status & 0xF0 != 0xD0:
+                    # Channel AfterTouch is not sent
+                    messages.append(key)
+        slots.append(len(messages))
+        self.music = list(zip(t.msecs(times), groups))
 
     def beat(self, time):
         """Returns (time, measnum, beat, num, den) for the beat at time."""
         if not self.beats:
             return (0, 0, 0, 4, 2)
-        pos = 0
-        if time:
-            # bisect our way in the beats list.
-            end = len(self.beats)
-            while pos < end:
-                mid = (pos + end) // 2
-                if time > self.beats[mid][0]:
-                    pos = mid + 1
-                else:
-                    end = mid
+        pos = bisect.bisect_left(self._beat_times, time) if time else 0
         return self.beats[min(pos, len(self.beats) - 1)]
 
 
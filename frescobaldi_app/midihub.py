@@ -116,13 +116,18 @@ def default_input():
                     return name
     return names[0] if names else ""
 
-def output_by_name(name):
-    """Returns a portmidi.Output instance for name."""
+def output_by_name(name, latency=0):
+    """Returns a portmidi.Output instance for name.
+    
+    If latency (in msec) is not 0, the timestamps of the written events are
+    used.
+    
+    """
     for n in range(get_count()):
         i = portmidi.get_device_info(n)
         output_name = _decode_name(i.name)
         if i.isoutput and output_name.startswith(name) and not i.isopen:
-            return portmidi.Output(n)
+            return portmidi.Output(n, latency)
 
 def input_by_name(name):
     """Returns a portmidi.Input instance for name."""
@@ -0,0 +1,209 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2011 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+miditool.check -- checks the controller state the MIDI tool player sends.
+
+Run with: python -m miditool.check [seeds]
+
+For every seed (default 50) a song is created with random controller and
+program changes on a few channels: bank selects, (N)RPN parameter selections,
+data entry, Reset All Controllers and other controllers, between notes.
+The player seeks to random positions, near and far, forward and backward,
+with its output writing to a model of a synthesizer. After every seek the
+synthesizer must be in the same state as one that got all messages from the
+start of the song to the new position.
+
+Before a short step forward (or none) the synthesizer has the state of the old
+position. Otherwise it starts in its initial state: data increments and
+decrements and a Data Entry LSB change a parameter relative to its current
+value, which a Reset All Controllers message does not reset, so the saved
+state can only be replayed on parameters that have their initial values.
+
+A small chunk size is used, so that many controller states are saved.
+
+Exits with a non-zero status if a difference is found.
+
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+
+from PyQt5.QtCore import QCoreApplication
+
+from midifile import benchmark, output, song
+from midifile.event import MIDI_CTL_RESET_CONTROLLERS
+
+
+# RPN MSB and LSB, NRPN MSB and LSB
+_selects = {'rpn': (0x65, 0x64), 'nrpn': (0x63, 0x62)}
+
+
+class Synthesizer(object):
+    """A model of the controller state of a synthesizer.
+
+    A Data Entry MSB sets the LSB of the parameter value to 0, increments
+    and decrements change the 14-bit value by one.
+
+    """
+    def __init__(self):
+        self.controllers = {}   # (channel, controller): value
+        self.programs = {}      # channel: (bank MSB, bank LSB, program)
+        self.selection = {}     # channel: 'rpn' or 'nrpn'
+        self.parameters = {}    # (channel, 'rpn' or 'nrpn', MSB, LSB): value
+
+    def send(self, m):
+        """Handles a message packed like PortMIDI does."""
+        kind, channel = m & 0xF0, m & 0x0F
+        data1, data2 = m >> 8 & 0x7F, m >> 16 & 0x7F
+        if kind == 0xC0:
+            self.programs[channel] = (self.controllers.get((channel, 0x00)),
+                self.controllers.get((channel, 0x20)), data1)
+        elif kind != 0xB0:
+            return
+        elif data1 == MIDI_CTL_RESET_CONTROLLERS:
+            for key in [key for key in self.controllers if key[0] == channel]:
+                del self.controllers[key]
+            self.selection.pop(channel, None)
+        elif data1 in (0x06, 0x26, 0x60, 0x61):
+            group = self.selection.get(channel)
+            if group:
+                msb, lsb = (self.controllers.get((channel, c))
+                            for c in _selects[group])
+                key = (channel, group, msb, lsb)
+                value = self.parameters.get(key, 0)
+                if data1 == 0x06:
+                    value = data2 << 7
+                elif data1 == 0x26:
+                    value = value & 0x3F80 | data2
+                elif data1 == 0x60:
+                    value = min(value + 1, 0x3FFF)
+                else:
+                    value = max(value - 1, 0)
+                self.parameters[key] = value
+        else:
+            for group, controllers in _selects.items():
+                if data1 in controllers:
+                    self.selection[channel] = group
+            self.controllers[(channel, data1)] = data2
+
+    def state(self):
+        """Returns the state, to compare it with another Synthesizer."""
+        return self.controllers, self.programs, self.selection, self.parameters
+
+
+class SynthesizerOutput(output.PortMidiOutput):
+    """A PortMidiOutput that writes to a Synthesizer."""
+    def __init__(self):
+        self.synthesizer = Synthesizer()
+
+    def write_messages(self, messages, timestamps):
+        for m in messages:
+            self.synthesizer.send(m)
+
+
+def controller(channel, number, value):
+    """Returns the bytes of a controller event."""
+    return bytes(bytearray((0xB0 | channel, number, value)))
+
+
+def random_messages(rng):
+    """Returns a list of bytes with random controller and program changes.
+
+    The MSB and LSB of a parameter selection are always sent together.
+
+    """
+    messages = []
+    for i in range(rng.randint(0, 600)):
+        channel = rng.randrange(3)
+        kind = rng.random()
+        if kind < 0.2:
+            messages.append(bytes(bytearray((0x90 | channel,
+                rng.randrange(128), rng.randrange(128)))))
+        elif kind < 0.3:
+            messages.append(controller(channel, rng.choice([0x00, 0x20]),
+                                       rng.randrange(3)))
+        elif kind < 0.4:
+            messages.append(bytes(bytearray((0xC0 | channel, rng.randrange(5)))))
+        elif kind < 0.5:
+            numbers = list(_selects[rng.choice(['rpn', 'nrpn'])])
+            rng.shuffle(numbers)
+            messages.extend(controller(channel, n, rng.randrange(2))
+                            for n in numbers)
+        elif kind < 0.75:
+            messages.append(controller(channel,
+                rng.choice([0x06, 0x26, 0x60, 0x61]), rng.randrange(128)))
+        elif kind < 0.78:
+            messages.append(controller(channel, MIDI_CTL_RESET_CONTROLLERS, 0))
+        else:
+            messages.append(controller(channel, rng.choice([0x01, 0x07, 0x0A]),
+                                       rng.randrange(128)))
+    return messages
+
+
+def check(seed):
+    """Returns None if all is well, otherwise a description of the difference."""
+    from miditool import player
+    rng = random.Random(seed)
+    events = [(rng.choice([0, 0, 10, 100]), m) for m in random_messages(rng)]
+    s = song.Song(384, [benchmark.track(events)[8:]])
+    p = player.Player()
+    p.set_song(s)
+    length = len(p._events)
+    for step in range(200):
+        old = rng.randint(0, length)
+        if rng.random() < 0.5:
+            new = max(0, min(length, old + rng.randint(-5, 2 * player.chunksize)))
+        else:
+            new = rng.randint(0, length)
+        p.set_output(None)
+        p.set_position(old)
+        out = SynthesizerOutput()
+        out.reset()     # as when playing starts at the beginning
+        if old <= new <= old + player.chunksize:
+            out.write_messages(p.messages(0, old), None)
+        p.set_output(out)
+        p.set_position(new)
+        reference = SynthesizerOutput()
+        reference.reset()
+        reference.write_messages(p.messages(0, new), None)
+        if out.synthesizer.state() != reference.synthesizer.state():
+            return "state differs after going from {0} to {1}".format(old, new)
+
+
+def main():
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    app = QCoreApplication(sys.argv[:1])
+    from miditool import player
+    player.chunksize = 16
+    failed = 0
+    for seed in range(seeds):
+        result = check(seed)
+        if result:
+            print("seed {0}: {1}".format(seed, result))
+            failed += 1
+    print("{0} seeds: {1} failed".format(seeds, failed))
+    del app
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
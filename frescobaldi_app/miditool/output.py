@@ -24,12 +24,17 @@ Handles output to MIDI ports.
 
 
 import midifile.output
+import midihub
 
 
 class Output(midifile.output.PortMidiOutput):
     """Handles the output, e.g. for a MIDI player."""
     def __init__(self, output):
         self.output = output
+    
+    def timestamp(self, delay):
+        """Returns the PortMIDI time delay msec from now."""
+        return midihub.time() + int(round(delay))
 
 
 
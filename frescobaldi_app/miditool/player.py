@@ -22,42 +22,150 @@ The MIDI player for Frescobaldi.
 """
 
 
-from midifile.event import ControllerEvent, ProgramChangeEvent
+import array
+import weakref
+
+from midifile.event import MIDI_CTL_RESET_CONTROLLERS
 import qmidi.player
-import midihub
 
 
-def event_filter(midi_event):
-    """If this function returns True, the MIDI event is sent while seeking."""
-    return isinstance(midi_event, (ControllerEvent, ProgramChangeEvent))
+# the number of events between two saved controller states
+chunksize = 1024
 
+_states = weakref.WeakKeyDictionary()   # Timeline -> list of states
+
+
+# controllers that select the parameter data entry messages apply to
+_select_controllers = {
+    0x65: 'rpn', 0x64: 'rpn',       # RPN MSB and LSB
+    0x63: 'nrpn', 0x62: 'nrpn',     # NRPN MSB and LSB
+}
+
+# data entry MSB, LSB, increment and decrement
+_data_controllers = (0x06, 0x26, 0x60, 0x61)
 
-class Player(qmidi.player.Player):
-    """This Player uses the time from midihub."""
-    def timer_midi_time(self):
-        return midihub.time()
 
+def controller_messages(messages):
+    """Yields the controller and program change messages of the packed messages."""
+    for m in messages:
+        if m & 0xF0 in (0xB0, 0xC0):
+            yield m
+
+
+def update_state(state, messages):
+    """Updates the state dict with the packed messages sent while seeking.
+    
+    The state maps keys to tuples of messages, in the order in which they
+    were last sent. Most controllers keep only the last message. For the
+    controllers whose meaning depends on messages sent before them, the
+    messages are grouped:
+    
+    - a program change keeps the bank select messages sent before it;
+    - the data entry messages are kept per (N)RPN parameter, together with
+      the messages selecting that parameter, and the last selection is kept
+      as well (this assumes both the MSB and LSB of a parameter are sent).
+    
+    A Reset All Controllers message removes the controllers and the (N)RPN
+    selection of the channel.
+    
+    """
+    for m in messages:
+        kind = m & 0xF0
+        status = m & 0xFF
+        if kind == 0xB0:
+            controller = m >> 8 & 0x7F
+            if controller == MIDI_CTL_RESET_CONTROLLERS:
+                # this does not change the values of the (N)RPN parameters
+                for key in [key for key in state if _status(key) == status
+                            and not (isinstance(key, tuple) and key[1] == 'data')]:
+                    del state[key]
+            if controller in _select_controllers:
+                # keep the last message of every selecting controller
+                key = (status, 'select')
+                value = tuple(s for s in state.get(key, ())
+                              if s >> 8 & 0x7F != controller) + (m,)
+            elif controller in _data_controllers:
+                # the last selecting controller determines RPN or NRPN
+                selection = state.get((status, 'select'))
+                if not selection:
+                    continue    # no parameter selected, ignored
+                group = _select_controllers[selection[-1] >> 8 & 0x7F]
+                selection = tuple(sorted(s for s in selection
+                    if _select_controllers[s >> 8 & 0x7F] == group))
+                key = (status, 'data', selection)
+                if controller == 0x06:
+                    value = selection + (m,)
+                else:
+                    value = state.get(key, selection) + (m,)
+            else:
+                key = m & 0xFFFF
+                value = (m,)
+        elif kind == 0xC0:
+            # the bank select messages take effect on the program change
+            key = status
+            channel = status & 0x0F
+            value = tuple(state[k][0] for k in (0xB0 | channel, 0x20B0 | channel)
+                          if k in state) + (m,)
+        else:
+            # no note events of course
+            continue
+        state.pop(key, None)
+        state[key] = value
+
+
+def _status(key):
+    """Returns the status byte a key of a state dict belongs to."""
+    return key[0] if isinstance(key, tuple) else key & 0xFF
+
+
+class Player(qmidi.player.Player):
+    """The Player used by the MIDI tool."""
     def position_event(self, old, new):
-        """Called when seeking. Performs program changes."""
+        """Called when seeking. Performs program changes.
+        
+        For a short step forward, the controller and program changes in
+        between are sent, in order. Otherwise the state at the new position
+        is sent, which is computed from the states saved every chunksize
+        events.
+        
+        """
         super(Player, self).position_event(old, new)
         output = self.output()
         if not output:
             return
-        if new > old:
-            evs = self._events[old:new]
+        if old < new <= old + chunksize:
+            messages = array.array('I',
+                controller_messages(self.messages(old, new)))
         else:
-            evs = self._events[:new]
-            output.reset()
-        for time, e in evs:
-            if e.midi:
-                if isinstance(e.midi, dict):
-                    # dict mapping track to events?
-                    midi = sum(map(e.midi.get, sorted(e.midi)), [])
-                else:
-                    midi = e.midi
-                # no note events of course
-                midi = [mev for mev in midi if event_filter(mev)]
-                if midi:
-                    output.send_events(midi)
-
-
+            if new < old:
+                output.reset()
+            messages = array.array('I')
+            for value in self.state(new).values():
+                messages.extend(value)
+        output.write_messages(messages, array.array('I', [0]) * len(messages))
+    
+    def messages(self, start, end):
+        """Returns an array with the packed messages of the events in range."""
+        messages = array.array('I')
+        for time, e in self._events[start:end]:
+            if e.messages:
+                messages.extend(e.messages)
+        return messages
+    
+    def state(self, position):
+        """Returns the state of the controllers at the position in the events.
+        
+        See update_state(). The states every chunksize events are saved for
+        the timeline of the song when they are needed.
+        
+        """
+        states = _states.setdefault(self._timeline, [{}])
+        chunk = position // chunksize
+        while len(states) <= chunk:
+            start = (len(states) - 1) * chunksize
+            state = dict(states[-1])
+            update_state(state, self.messages(start, start + chunksize))
+            states.append(state)
+        state = dict(states[chunk])
+        update_state(state, self.messages(chunk * chunksize, position))
+        return state
@@ -122,7 +122,7 @@ class Widget(QWidget):
         self._outputCloseTimer.stop()
         if not self._player.output():
             p = QSettings().value("midi/player/output_port", midihub.default_output(), str)
-            o = midihub.output_by_name(p)
+            o = midihub.output_by_name(p, 1)
             if o:
                 self._player.set_output(output.Output(o))
     
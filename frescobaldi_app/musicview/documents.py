@@ -35,6 +35,7 @@ except ImportError:
 
 import app
 import plugin
+import qpopplerview.cache
 import resultfiles
 import signals
 import popplertools
@@ -75,6 +76,8 @@ def load(filename):
         doc = popplerqt5.Poppler.Document.loadFromData(data)
         if doc:
             _cache[key] = doc
+            # enables rendering pages in parallel
+            qpopplerview.cache.setdata(doc, data)
         return doc or None
 
 
@@ -89,8 +92,42 @@ class Document(popplertools.Document):
     """Represents a (lazily) loaded PDF document."""
     updated = True
     
+    # list of (filename, pageNumber) tuples if pages of other PDF documents
+    # are spliced in (see engrave.partial)
+    pages = None
+    
+    # dict mapping the source files in the links of the spliced pages to the
+    # source file of the document
+    sources = None
+    
     def load(self):
         return load(self.filename())
+    
+    def popplerPages(self):
+        """Return the list of (Poppler.Document, pageNumber) tuples to display.
+        
+        Returns None if not all documents could be loaded.
+        
+        """
+        if self.pages is None:
+            document = self.document()
+            if document:
+                return [(document, num) for num in range(document.numPages())]
+            return
+        documents = {}
+        result = []
+        for filename, num in self.pages:
+            try:
+                document = documents[filename]
+            except KeyError:
+                try:
+                    document = documents[filename] = load(filename)
+                except (IOError, OSError):
+                    return
+            if not document or num >= document.numPages():
+                return
+            result.append((document, num))
+        return result
         
     if popplerqt5 is None:
         def document(self):
@@ -135,6 +172,10 @@ class DocumentGroup(plugin.DocumentPlugin):
         
         results = resultfiles.results(self.document())
         files = results.files(".pdf", newer)
+        from engrave import partial
+        spliced = partial.pages(self.document())
+        if spliced and spliced[0] not in files:
+            files.insert(0, spliced[0])
         if files:
             # reuse the older Document objects, they will probably be displaying
             # (about) the same documents, and so the viewer will remember their position.
@@ -149,6 +190,10 @@ class DocumentGroup(plugin.DocumentPlugin):
             for filename, doc in zip(files, docs()):
                 doc.setFilename(filename)
                 doc.updated = newer or results.is_newer(filename)
+                if spliced and filename == spliced[0]:
+                    doc.pages, doc.sources = spliced[1:]
+                else:
+                    doc.pages = doc.sources = None
                 documents.append(doc)
             self._documents = documents
             return True
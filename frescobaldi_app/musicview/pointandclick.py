@@ -28,42 +28,70 @@ import os
 import sys
 import weakref
 
-import qpopplerview
-
 import util
 import textedit
 import pointandclick
+import popplerlinks
 
 
 # cache point and click handlers for poppler documents
 _cache = weakref.WeakKeyDictionary()
 
+# the last (pages, Links) of spliced_links()
+_spliced = None
+
 
 def links(document):
+    """Returns the Links of the Poppler document.
+    
+    The links are read in a background thread and added to the returned
+    Links object while they come in. Use Links.prioritize() to read the links
+    of certain pages (e.g. the ones on screen) first.
+    
+    """
     try:
         return _cache[document]
     except KeyError:
         l = _cache[document] = Links()
-        with l:
-            import popplerqt5
-            with qpopplerview.lock(document):
-                for num in range(document.numPages()):
-                    page = document.page(num)
-                    for link in page.links():
-                        if isinstance(link, popplerqt5.Poppler.LinkBrowse):
-                            t = textedit.link(link.url())
-                            if t:
-                                filename = util.normpath(t.filename)
-                                l.add_link(filename, t.line, t.column, (num, link.linkArea()))
+        l.finish()
+        l.reader = popplerlinks.Reader(popplerlinks.pages(document), l)
         return l
 
 
+def spliced_links(pages, sources):
+    """Returns the Links of pages from different Poppler documents.
+    
+    The pages are a list of (Poppler.Document, pageNumber) tuples, as loaded
+    in a layout; the destinations of the links have the index in that list as
+    page number. The sources dictionary maps the filenames in the links of
+    some pages to the filename to use instead (see engrave.partial).
+    
+    The Links for the last list of pages are cached.
+    
+    """
+    global _spliced
+    if _spliced and _spliced[0] == pages:
+        return _spliced[1]
+    l = Links()
+    l.finish()
+    l.reader = popplerlinks.Reader(pages, l, sources)
+    _spliced = (pages, l)
+    return l
+
+
 class Links(pointandclick.Links):
     """Stores all the links of a Poppler document sorted by URL and text position.
     
     Only textedit:// urls are stored.
     
     """
+    reader = None
+    
+    def prioritize(self, pageNumbers):
+        """Reads the links of the specified pages first, if not already read."""
+        if self.reader:
+            self.reader.prioritize(pageNumbers)
+    
     def cursor(self, link, load=False):
         """Returns the destination of a link as a QTextCursor of the destination document.
         
@@ -87,6 +87,8 @@ class MusicView(QWidget):
         self.view.surface().linkLeft.connect(self.slotLinkLeft)
         self.view.surface().setShowUrlTips(False)
         self.view.surface().linkHelpRequested.connect(self.slotLinkHelpRequested)
+        self.view.verticalScrollBar().valueChanged.connect(self.slotVisiblePagesChanged)
+        self.view.horizontalScrollBar().valueChanged.connect(self.slotVisiblePagesChanged)
         
         self.view.viewModeChanged.connect(self.updateZoomInfo)
         self.view.surface().pageLayout().scaleChanged.connect(self.updateZoomInfo)
@@ -113,10 +115,25 @@ class MusicView(QWidget):
         self._currentDocument = doc
         document = doc.document()
         if document:
-            self._links = pointandclick.links(document)
-            self.view.load(document)
+            pages = doc.popplerPages()
+            if pages and doc.pages is not None:
+                # the page numbers in the links are the indices in the layout
+                self._links = pointandclick.spliced_links(pages, doc.sources)
+            else:
+                self._links = pointandclick.links(document)
+            if pages:
+                self.view.loadPages(pages)
+            else:
+                self.view.load(document)
             position = self._positions.get(doc, (0, 0, 0))
             self.view.setPosition(position, True)
+            self.slotVisiblePagesChanged()
+
+    def slotVisiblePagesChanged(self):
+        """Reads the links of the pages on screen first."""
+        if self._links:
+            layout = self.view.surface().pageLayout()
+            self._links.prioritize(layout.index(page) for page in self.view.visiblePages())
 
     def clear(self):
         """Empties the view."""
@@ -37,7 +37,10 @@ class Widget(QTreeWidget):
     def __init__(self, tool):
         super(Widget, self).__init__(tool,
             headerHidden=True)
-        self._timer = QTimer(singleShot=True, timeout=self.updateView)
+        self._timer = QTimer(singleShot=True, timeout=self.updateItems)
+        self._items = None      # QTreeWidgetItems, in outline order
+        self._dirty = None      # index of the first changed item
+        self._changed = None    # cursor at the first changed position
         tool.mainwindow().currentDocumentChanged.connect(self.slotCurrentDocumentChanged)
         self.itemClicked.connect(self.slotItemClicked)
         self.itemActivated.connect(self.slotItemClicked)
@@ -52,98 +55,181 @@ class Widget(QTreeWidget):
         """Called whenever the mainwindow changes the current document."""
         if old:
             old.contentsChange.disconnect(self.slotContentsChange)
+            structure = documentstructure.DocumentStructure.instance(old)
+            structure.outlineChanged.disconnect(self.slotOutlineChanged)
         if doc:
             doc.contentsChange.connect(self.slotContentsChange)
+            structure = documentstructure.DocumentStructure.instance(doc)
+            structure.outlineChanged.connect(self.slotOutlineChanged)
+            self._items = None
+            self._dirty = None
+            self._changed = None
             self._timer.start(100)
             
     def slotContentsChange(self, position, added, removed):
         """Updates the view on contents change."""
+        if self._changed is None:
+            self._changed = QTextCursor(self.parent().mainwindow().currentDocument())
+            self._changed.setPosition(position)
+        elif position < self._changed.position():
+            self._changed.setPosition(position)
         if added + removed > 1000:
             self._timer.start(100)
         else:
             self._timer.start(2000)
+    
+    def slotOutlineChanged(self, index, removed, added):
+        """Called when items in the outline of the current document changed.
+        
+        The items are replaced right away, but they are only put in the
+        tree when the timer fires.
+        
+        """
+        if self._items is None:
+            return
+        for item in self._items[index:index+removed]:
+            # children are re-parented on the next update
+            item.takeChildren()
+            (item.parent() or self.invisibleRootItem()).removeChild(item)
+        doc = self.parent().mainwindow().currentDocument()
+        outline = documentstructure.DocumentStructure.instance(doc).outline()
+        self._items[index:index+removed] = map(self.createItem, outline[index:index+added])
+        if self._dirty is None or index < self._dirty:
+            self._dirty = index
         
     def updateView(self):
         """Recreate the items in the view."""
         with qutil.signalsBlocked(self):
             self.clear()
+            self._items = None
+            self._dirty = None
+            self._changed = None
             doc = self.parent().mainwindow().currentDocument()
             if not doc:
                 return
-            view_cursor_position = self.parent().mainwindow().textCursor().position()
             structure = documentstructure.DocumentStructure.instance(doc)
+            self._items = list(map(self.createItem, structure.outline()))
+            self.layoutItems(0)
+    
+    def updateItems(self):
+        """Update the tree after changes, or recreate it if needed."""
+        if self._items is None:
+            return self.updateView()
+        start = self._dirty
+        if self._changed is not None:
+            # depths of following items may have changed
+            block = self._changed.block()
+            index = self.findItem(block.position()) + 1
+            if start is None or index < start:
+                start = index
+        self._dirty = None
+        self._changed = None
+        if start is not None:
+            with qutil.signalsBlocked(self):
+                self.layoutItems(start)
+    
+    def findItem(self, position):
+        """Return the index of the last item before position, or -1."""
+        lo, hi = 0, len(self._items)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._items[mid].outline.start() < position:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+    
+    def createItem(self, i):
+        """Create a QTreeWidgetItem (not yet in the tree) for an outline item."""
+        item = QTreeWidgetItem()
+        
+        # set item text and display style bold if 'title' was used
+        for name, text in i.groupdict().items():
+            if text:
+                if name.startswith('title'):
+                    font = item.font(0)
+                    font.setWeight(QFont.Bold)
+                    item.setFont(0, font)
+                    break
+                elif name.startswith('alert'):
+                    color = item.foreground(0).color()
+                    color = qutil.addcolor(color, 128, 0, 0)
+                    item.setForeground(0, QBrush(color))
+                    font = item.font(0)
+                    font.setStyle(QFont.StyleItalic)
+                    item.setFont(0, font)
+                elif name.startswith('text'):
+                    break
+        else:
+            text = i.group()
+        item.setText(0, text)
+        item.outline = i
+        return item
+    
+    def layoutItems(self, start):
+        """(Re)attach the items from start in the tree to their parents."""
+        root = self.invisibleRootItem()
+        items = self._items[start:]
+        for item in reversed(items):
+            (item.parent() or root).removeChild(item)
+        
+        view_cursor_position = self.parent().mainwindow().textCursor().position()
+        if start:
+            last_item = self._items[start-1]
+            last_block = last_item.outline.block
+        else:
             last_item = None
-            current_item = None
             last_block = None
-            for i in structure.outline():
-                position = i.start()
-                block = doc.findBlock(position)
-                depth = tokeniter.state(block).depth()
-                if block == last_block:
-                    parent = last_item
-                elif last_block is None or depth == 1:
-                    # a toplevel item anyway
-                    parent = self
+        current_item = None
+        for item in items:
+            position = item.outline.start()
+            block = item.outline.block
+            depth = tokeniter.state(block).depth()
+            if block == last_block:
+                parent = last_item
+            elif last_block is None or depth == 1:
+                # a toplevel item anyway
+                parent = root
+            else:
+                while last_item and depth <= last_item.depth:
+                    last_item = last_item.parent()
+                if not last_item:
+                    parent = root
                 else:
-                    while last_item and depth <= last_item.depth:
-                        last_item = last_item.parent()
-                    if not last_item:
-                        parent = self
-                    else:
-                        # the item could belong to a parent item, but see if they
-                        # really are in the same (toplevel) state
-                        b = last_block.next()
-                        while b < block:
-                            depth2 = tokeniter.state(b).depth()
-                            if depth2 == 1:
-                                parent = self
-                                break
-                            while last_item and depth2 <= last_item.depth:
-                                last_item = last_item.parent()
-                            if not last_item:
-                                parent = self
-                                break
-                            b = b.next()
-                        else:
-                            parent = last_item
-                
-                item = last_item = QTreeWidgetItem(parent)
-                
-                # set item text and display style bold if 'title' was used
-                for name, text in i.groupdict().items():
-                    if text:
-                        if name.startswith('title'):
-                            font = item.font(0)
-                            font.setWeight(QFont.Bold)
-                            item.setFont(0, font)
+                    # the item could belong to a parent item, but see if they
+                    # really are in the same (toplevel) state
+                    b = last_block.next()
+                    while b < block:
+                        depth2 = tokeniter.state(b).depth()
+                        if depth2 == 1:
+                            parent = root
                             break
-                        elif name.startswith('alert'):
-                            color = item.foreground(0).color()
-                            color = qutil.addcolor(color, 128, 0, 0)
-                            item.setForeground(0, QBrush(color))
-                            font = item.font(0)
-                            font.setStyle(QFont.StyleItalic)
-                            item.setFont(0, font)
-                        elif name.startswith('text'):
+                        while last_item and depth2 <= last_item.depth:
+                            last_item = last_item.parent()
+                        if not last_item:
+                            parent = root
                             break
-                else:
-                    text = i.group()
-                item.setText(0, text)
-                
-                # remember whether is was collapsed by the user
-                try:
-                    collapsed = block.userData().collapsed
-                except AttributeError:
-                    collapsed = False
-                item.setExpanded(not collapsed)
-                item.depth = depth
-                item.position = position
-                last_block = block
-                # scroll to the item at the view's cursor later
-                if position <= view_cursor_position:
-                    current_item = item
-            if current_item:
-                self.scrollToItem(current_item)
+                        b = b.next()
+                    else:
+                        parent = last_item
+            
+            parent.addChild(item)
+            item.depth = depth
+            last_item = item
+            last_block = block
+            # scroll to the item at the view's cursor later
+            if position <= view_cursor_position:
+                current_item = item
+        
+        # remember whether is was collapsed by the user
+        for item in items:
+            try:
+                collapsed = item.outline.block.userData().collapsed
+            except AttributeError:
+                collapsed = False
+            item.setExpanded(not collapsed)
+        if current_item:
+            self.scrollToItem(current_item)
     
     def cursorForItem(self, item):
         """Returns a cursor for the specified item.
@@ -154,7 +240,7 @@ class Widget(QTreeWidget):
         """
         doc = self.parent().mainwindow().currentDocument()
         cursor = QTextCursor(doc)
-        cursor.setPosition(item.position)
+        cursor.setPosition(item.outline.start())
         return cursor
         
     def slotItemClicked(self, item):
@@ -23,12 +23,16 @@ Generic Point and Click handling.
 
 
 import os
+import array
+import bisect
 import collections
+import heapq
 
 from PyQt5.QtCore import QUrl
 from PyQt5.QtGui import QTextCursor
 
 import app
+import cursortools
 import scratchdir
 import ly.lex.lilypond
 import ly.document
@@ -36,10 +40,18 @@ import lydocument
 
 
 class Links(object):
-    """Stores point and click links grouped by filename."""
+    """Stores point and click links grouped by filename.
+    
+    Links can also be added after finish() has been called, e.g. when they
+    are read in the background. They are then added to the bound documents
+    immediately.
+    
+    """
     def __init__(self):
         self._links = collections.defaultdict(lambda: collections.defaultdict(list))
         self._docs = {}
+        self._finished = False
+        self._reading = False
        
     def add_link(self, filename, line, column, destination):
         """Add a link.
@@ -49,7 +61,30 @@ class Links(object):
         destination can be any object that describes where the link points to.
         
         """
-        self._links[filename][(line, column)].append(destination)
+        self.add_links([(filename, line, column, destination)])
+    
+    def add_links(self, links):
+        """Add many links, an iterable of (filename, line, column, destination) tuples.
+        
+        If finish() already has been called, the new links are added to the
+        bound documents, and documents for new filenames are bound if loaded.
+        
+        """
+        new = collections.defaultdict(list)
+        for filename, line, column, destination in links:
+            dests = self._links[filename]
+            pos = (line, column)
+            if pos not in dests and self._finished:
+                new[filename].append(pos)
+            dests[pos].append(destination)
+        for filename, positions in new.items():
+            bound = self._docs.get(filename)
+            if bound:
+                bound.add_links((pos, self._links[filename][pos]) for pos in positions)
+            else:
+                d = scratchdir.findDocument(filename)
+                if d:
+                    self.bind(filename, d)
     
     def finish(self):
         """Call this when you are done with adding links.
@@ -61,6 +96,7 @@ class Links(object):
         On exit, finish() is automatically called.
         
         """
+        self._finished = True
         for filename in self._links:
             d = scratchdir.findDocument(filename)
             if d:
@@ -68,6 +104,18 @@ class Links(object):
         app.documentLoaded.connect(self.slotDocumentLoaded)
         app.documentClosed.connect(self.slotDocumentClosed)
     
+    def setReading(self, reading):
+        """Tells whether links are still being added after finish().
+        
+        While reading, e.g. in the background, the bound documents keep track
+        of the changes made to them, so that links added later get the right
+        position, also if the user edits the document in the meantime.
+        
+        """
+        self._reading = reading
+        for bound in self._docs.values():
+            bound.record(reading)
+    
     def __enter__(self):
         return self
     
@@ -83,7 +131,9 @@ class Links(object):
         
         """
         if filename not in self._docs:
-            self._docs[filename] = BoundLinks(doc, self._links[filename])
+            bound = self._docs[filename] = BoundLinks(doc, self._links[filename])
+            if self._reading:
+                bound.record(True)
     
     def slotDocumentLoaded(self, doc):
         """Called when a new document is loaded, it maybe possible to bind to it."""
@@ -125,33 +175,227 @@ class Links(object):
 
 
 class BoundLinks(object):
-    """Stores links as QTextCursors for a document."""
+    """Stores the text positions of links for a document.
+    
+    The links are kept sorted in chunks of about chunksize links. A chunk has
+    an array of the positions, relative to an offset per chunk, and lists of
+    the (line, column) keys and the destinations of its links. When the
+    document changes, the positions are adjusted like QTextCursors would be;
+    only the chunk containing the change is updated element by element, the
+    offsets of the chunks after it are simply shifted. When links are added,
+    only the chunks they fall in are merged again. QTextCursors are only
+    created when asked for.
+    
+    """
+    chunksize = 512
+    
     def __init__(self, doc, links):
-        """Creates QTextCursor instances for every link, keeps a reference to the document."""
+        """Stores the positions of the links, keeps a reference to the document."""
         self.document = doc
-        # make a sorted list of cursors with their [destination, ...] destinations list
-        self._cursor_dict = d = {}              # mapping from (line, col) to QTextCursor
-        self._cursors = cursors = []            # sorted list of the cursors
-        self._destinations = destinations = []  # corresponding list of destinations
-        for pos, dest in sorted(links.items()):
-            line, column = pos
-            b = doc.findBlockByNumber(line - 1)
-            if b.isValid():
-                c = d[pos] = QTextCursor(doc)
-                c.setPosition(b.position() + column)
-                cursors.append(c)
-                destinations.append(dest)
+        self._chunks = []           # arrays of sorted positions, relative to offset
+        self._offsets = []          # the offset of every chunk
+        self._keys = []             # per chunk the list of (line, col) of the links
+        self._destinations = []     # per chunk the corresponding list of destinations
+        self._starts = []           # the index of the first link of every chunk
+        self._lines = None          # the positions of the lines when recording started
+        self._edits = []            # the changes since then
+        doc.contentsChange.connect(self.slotContentsChange)
+        self.add_links(links.items())
+    
+    def record(self, enabled):
+        """Starts or stops keeping track of the changes in the document.
+        
+        This is used while links are still being added, e.g. read in the
+        background. Links added while recording are positioned in the document
+        as it was when the recording started, and then moved with the changes
+        made since, just like the links that were already there.
+        
+        """
+        if enabled:
+            self._lines = array.array('l',
+                (b.position() for b in cursortools.all_blocks(self.document)))
+        else:
+            self._lines = None
+        self._edits = []
+    
+    def add_links(self, links):
+        """Adds links, an iterable of ((line, column), destinations) tuples.
         
+        The new links are merged into the chunks they fall in. Links with a
+        position already known are ignored, as their destinations list is
+        shared with the Links object.
+        
+        """
+        new = []
+        lines = self._lines
+        for key, dest in links:
+            if self._find_key(key)[1]:
+                continue
+            line, column = key
+            if lines is not None:
+                if not 0 < line <= len(lines):
+                    continue
+                position = self._map(lines[line - 1] + column)
+            else:
+                b = self.document.findBlockByNumber(line - 1)
+                if not b.isValid():
+                    continue
+                position = b.position() + column
+            new.append((position, key, dest))
+        if not new:
+            return
+        # the order of the positions is the order of the keys
+        new.sort(key=lambda item: item[:2])
+        groups = collections.defaultdict(list)
+        for item in new:
+            groups[max(0, self._find_key(item[1])[0])].append(item)
+        if not self._chunks:
+            self._chunks.append(array.array('l'))
+            self._offsets.append(0)
+            self._keys.append([])
+            self._destinations.append([])
+        size = self.chunksize
+        for index in sorted(groups, reverse=True):
+            chunk, offset = self._chunks[index], self._offsets[index]
+            keys, dests = self._keys[index], self._destinations[index]
+            group = groups[index]
+            if len(group) * 8 < len(keys):
+                # insert a few links in place
+                for position, key, dest in group:
+                    i = bisect.bisect_right(keys, key)
+                    chunk.insert(i, position - offset)
+                    keys.insert(i, key)
+                    dests.insert(i, dest)
+                if len(keys) <= 2 * size:
+                    continue
+                group = []
+            old = zip((offset + pos for pos in chunk), keys, dests)
+            merged = list(heapq.merge(old, group, key=lambda item: item[:2]))
+            # split the chunk if it got too large
+            step = size if len(merged) > 2 * size else len(merged)
+            pieces = [merged[i:i+step] for i in range(0, len(merged), step)]
+            self._chunks[index:index+1] = [array.array('l',
+                (item[0] - piece[0][0] for item in piece)) for piece in pieces]
+            self._offsets[index:index+1] = [piece[0][0] for piece in pieces]
+            self._keys[index:index+1] = [[item[1] for item in piece] for piece in pieces]
+            self._destinations[index:index+1] = [[item[2] for item in piece] for piece in pieces]
+        starts = self._starts = []
+        count = 0
+        for keys in self._keys:
+            starts.append(count)
+            count += len(keys)
+    
+    def _find_key(self, key):
+        """Returns (chunk, index) for the link with the (line, column) key.
+        
+        If there is no such link, index is None and chunk is the index of the
+        chunk the link would be in (-1 if before all).
+        
+        """
+        chunks = self._keys
+        lo, hi = 0, len(chunks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < chunks[mid][0]:
+                hi = mid
+            else:
+                lo = mid + 1
+        chunk = lo - 1
+        if chunk >= 0:
+            keys = chunks[chunk]
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return chunk, self._starts[chunk] + i
+        return chunk, None
+    
+    def _map(self, position):
+        """Returns the position moved with the changes made since recording started."""
+        for pos, removed, added in self._edits:
+            if position >= pos + removed:
+                position += added - removed
+            elif position >= pos:
+                position = pos + added
+        return position
+    
+    def slotContentsChange(self, position, removed, added):
+        """Called when the document changes, adjusts the stored positions."""
+        if removed == added:
+            # this is also emitted when only formatting changes (e.g. highlighting)
+            return
+        if self._lines is not None:
+            self._edits.append((position, removed, added))
+        delta = added - removed
+        end = position + removed
+        chunks, offsets = self._chunks, self._offsets
+        # find the first chunk that has positions after the change
+        lo, hi = 0, len(chunks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if offsets[mid] + chunks[mid][-1] < position:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in range(lo, len(chunks)):
+            chunk, offset = chunks[i], offsets[i]
+            if offset + chunk[0] >= end:
+                # this chunk and the following ones just move
+                for j in range(i, len(chunks)):
+                    offsets[j] += delta
+                break
+            for k, pos in enumerate(chunk):
+                pos += offset
+                if pos >= end:
+                    chunk[k] = pos + delta - offset
+                elif pos >= position:
+                    # the text at the link was removed
+                    chunk[k] = position + added - offset
+    
+    def positions(self):
+        """Yields the positions of the links in the document, sorted."""
+        for offset, chunk in zip(self._offsets, self._chunks):
+            for pos in chunk:
+                yield offset + pos
+    
+    def position(self, index):
+        """Returns the position of the link at index in the document."""
+        chunk = bisect.bisect_right(self._starts, index) - 1
+        return self._offsets[chunk] + self._chunks[chunk][index - self._starts[chunk]]
+    
+    def find(self, position):
+        """Returns the index of the last link at or before position, -1 if none."""
+        chunks, offsets = self._chunks, self._offsets
+        lo, hi = 0, len(chunks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if position < offsets[mid] + chunks[mid][0]:
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == 0:
+            return -1
+        chunk = lo - 1
+        i = bisect.bisect_right(chunks[chunk], position - offsets[chunk])
+        return self._starts[chunk] + i - 1
+    
     def cursor(self, line, column):
-        """Returns the QTextCursor for the give line/col."""
-        return self._cursor_dict.get((line, column))
+        """Returns a QTextCursor for the give line/col, None if there is no link."""
+        index = self._find_key((line, column))[1]
+        if index is not None:
+            c = QTextCursor(self.document)
+            c.setPosition(self.position(index))
+            return c
     
     def cursors(self):
-        """Return the list of cursors, sorted on cursor position."""
-        return self._cursors
+        """Return a list of cursors for all links, sorted on cursor position."""
+        cursors = []
+        for pos in self.positions():
+            c = QTextCursor(self.document)
+            c.setPosition(pos)
+            cursors.append(c)
+        return cursors
         
     def destinations(self):
-        """Return the list of destination lists.
+        """Return the sequence of destination lists.
         
         Each destination corresponds with the cursor at the same index in
         the cursors() list. Each destination is a list of destination items
@@ -159,8 +403,10 @@ class BoundLinks(object):
         point-and-click objects can point to the same place in the text
         document.
         
+        The returned sequence can be indexed and sliced like a list.
+        
         """
-        return self._destinations
+        return Destinations(self)
     
     def indices(self, cursor):
         """Return a Python slice object or None or False.
@@ -175,24 +421,13 @@ class BoundLinks(object):
         points to the _ending_ point of a slur, beam or phrasing slur.
         
         """
-        cursors = self._cursors
-        
-        def findlink(pos):
-            # binary search in list of cursors
-            lo, hi = 0, len(cursors)
-            while lo < hi:
-                mid = (lo + hi) // 2
-                if pos < cursors[mid].position():
-                    hi = mid
-                else:
-                    lo = mid + 1
-            return lo - 1
+        findlink = self.find
         
         if cursor.hasSelection():
             end = findlink(cursor.selectionEnd() - 1)
             if end >= 0:
                 start = findlink(cursor.selectionStart())
-                if start < 0 or cursors[start].position() < cursor.selectionStart():
+                if start < 0 or self.position(start) < cursor.selectionStart():
                     start += 1
                 if start <= end:
                     return slice(start, end+1)
@@ -202,12 +437,13 @@ class BoundLinks(object):
         if index < 0:
             return # before all other links
         
-        cur2 = cursors[index]
-        if cur2.position() < cursor.position():
+        pos2 = self.position(index)
+        block2 = self.document.findBlock(pos2)
+        if pos2 < cursor.position():
             # is the cursor at an ending token like a slur end?
             prevcol = -1
-            if cur2.block() == cursor.block():
-                prevcol = cur2.position() - cur2.block().position()
+            if block2 == cursor.block():
+                prevcol = pos2 - block2.position()
             col = cursor.position() - cursor.block().position()
             found = False
             tokens = ly.document.Runner(lydocument.Document(cursor.document()))
@@ -232,14 +468,50 @@ class BoundLinks(object):
                         break
             if found:
                 index = findlink(tokens.block.position() + token.pos)
-                if index < 0 or cursors[index].block() != tokens.block:
+                if index < 0 or self.document.findBlock(self.position(index)) != tokens.block:
                     return
-            elif cur2.block() != cursor.block():
+            elif block2 != cursor.block():
                 return False
         # highlight it!
         return slice(index, index+1)
 
 
+class Destinations(object):
+    """The destinations of BoundLinks, a sequence that can be indexed and sliced."""
+    def __init__(self, bound):
+        self._bound = bound
+    
+    def __len__(self):
+        bound = self._bound
+        return bound._starts[-1] + len(bound._keys[-1]) if bound._starts else 0
+    
+    def __iter__(self):
+        for dests in self._bound._destinations:
+            for dest in dests:
+                yield dest
+    
+    def __getitem__(self, index):
+        bound = self._bound
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return list(self)[index]
+            result = []
+            while start < stop:
+                chunk = bisect.bisect_right(bound._starts, start) - 1
+                first = bound._starts[chunk]
+                dests = bound._destinations[chunk][start-first:stop-first]
+                result.extend(dests)
+                start += len(dests)
+            return result
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("destination index out of range")
+        chunk = bisect.bisect_right(bound._starts, index) - 1
+        return bound._destinations[chunk][index - bound._starts[chunk]]
+
+
 def positions(cursor):
     """Return a list of QTextCursors describing the grob the cursor points at.
     
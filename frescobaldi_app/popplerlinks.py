@@ -0,0 +1,131 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Reads the textedit links of Poppler documents in a background thread.
+
+This is used by the Point and Click handling of the Music View and the
+viewers.
+
+"""
+
+
+import threading
+import weakref
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+import qpopplerview
+
+import util
+import textedit
+
+
+# keep the running Reader threads referenced
+_readers = set()
+
+
+def pages(document):
+    """Returns a list of (document, pageNumber) tuples for all pages of the document."""
+    return [(document, num) for num in range(document.numPages())]
+
+
+class Reader(QThread):
+    """Reads the textedit links of Poppler documents in a background thread.
+    
+    The pages are a list of (Poppler.Document, pageNumber) tuples; the
+    destinations of the links contain the index in this list as page number.
+    For the pages of one document (see pages()) that is the page number itself.
+    
+    The optional filenames dictionary maps the (normalized) filenames in the
+    links to the filenames to store the links with.
+    
+    The links are sent in batches to the Links object. Prioritized pages are
+    sent by themselves, so they are available as soon as possible.
+    
+    """
+    linksRead = pyqtSignal(object)
+    
+    batchsize = 20  # number of pages per batch
+    
+    def __init__(self, pages, links, filenames=None):
+        super(Reader, self).__init__()
+        self.pages = pages
+        self.filenames = filenames or {}
+        self.links = weakref.ref(links)
+        self._lock = threading.Lock()
+        self._pages = list(range(len(pages)))  # pages still to read
+        self._priority = []
+        self.linksRead.connect(self.slotLinksRead)
+        self.finished.connect(self.slotFinished)
+        links.setReading(True)
+        _readers.add(self)
+        self.start()
+    
+    def prioritize(self, pageNumbers):
+        """Moves the specified page numbers (indices in pages) to the front of the queue."""
+        with self._lock:
+            for num in pageNumbers:
+                if num in self._pages:
+                    self._pages.remove(num)
+                    self._priority.append(num)
+    
+    def nextPages(self):
+        """Returns the next list of page numbers to read, empty when done."""
+        with self._lock:
+            if self._priority:
+                return [self._priority.pop(0)]
+            pages, self._pages[:self.batchsize] = self._pages[:self.batchsize], []
+            return pages
+    
+    def run(self):
+        """Main method of this thread, called by Qt on start()."""
+        import popplerqt5
+        while True:
+            pageNumbers = self.nextPages()
+            if not pageNumbers:
+                break
+            result = []
+            for num in pageNumbers:
+                document, pageNumber = self.pages[num]
+                with qpopplerview.lock(document):
+                    links = document.page(pageNumber).links()
+                for link in links:
+                    if isinstance(link, popplerqt5.Poppler.LinkBrowse):
+                        t = textedit.link(link.url())
+                        if t:
+                            filename = util.normpath(t.filename)
+                            filename = self.filenames.get(filename, filename)
+                            result.append((filename, t.line, t.column, (num, link.linkArea())))
+            if result:
+                self.linksRead.emit(result)
+    
+    def slotLinksRead(self, result):
+        """Called in the main thread with a batch of links."""
+        links = self.links()
+        if links:
+            links.add_links(result)
+    
+    def slotFinished(self):
+        """Called when the thread has completed."""
+        links = self.links()
+        if links:
+            links.setReading(False)
+            links.reader = None
+        _readers.discard(self)
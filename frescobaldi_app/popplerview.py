@@ -25,11 +25,14 @@ This is used throughout Frescobaldi, to obey color settings etc.
 """
 
 
-from PyQt5.QtCore import QSettings
+import os
+
+from PyQt5.QtCore import QSettings, QStandardPaths, QThread
 
 import app
 import textformats
 import qpopplerview
+import qpopplerview.diskcache
 
 
 # global setup of background color
@@ -46,6 +49,24 @@ _setbackground()
 qpopplerview.cache.options().setOversampleThreshold(96)
 
 
+# number of pages rendered in parallel and the disk cache
+def _setrendersettings():
+    s = QSettings()
+    s.beginGroup("musicview")
+    count = s.value("render_threads", 0, int)
+    qpopplerview.cache.setmaxthreads(count or QThread.idealThreadCount())
+    qpopplerview.cache.setmaxclonesize(s.value("render_clone_memory", 200, int))
+    if s.value("disk_cache", False, bool):
+        path = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+        qpopplerview.diskcache.setdirectory(os.path.join(path, "pages"))
+    else:
+        qpopplerview.diskcache.setdirectory(None)
+    qpopplerview.diskcache.setmaxsize(s.value("disk_cache_size", 500, int))
+
+app.settingsChanged.connect(_setrendersettings)
+_setrendersettings()
+
+
 class View(qpopplerview.View):
     def __init__(self, parent=None):
         super(View, self).__init__(parent)
@@ -203,6 +203,23 @@ class Output(object):
         """
         self._output.Write(data)
 
+    def write_messages(self, messages, timestamps):
+        """Writes MIDI messages packed in integers to the output.
+        
+        messages and timestamps are arrays of typecode 'I' of equal length,
+        of at most 1024 items. Every message is an integer with the status
+        byte in the lowest 8 bits and the data bytes in the next ones.
+        
+        """
+        try:
+            write = self._output.WriteMessages
+        except AttributeError:
+            # not the ctypes module
+            self._output.Write([[[m & 0xFF, m >> 8 & 0xFF, m >> 16 & 0xFF], t]
+                                for m, t in zip(messages, timestamps)])
+        else:
+            write(messages, timestamps)
+
     def write_short(self, status, data1 = 0, data2 = 0):
         """Output MIDI information of 3 bytes or less."""
         self._output.WriteShort(status, data1, data2)
@@ -111,6 +111,23 @@ class Output(object):
         err = libpm.Pm_Write(self._midi_stream, buf, len(data))
         _check_error(err)
 
+    def WriteMessages(self, messages, timestamps):
+        """messages and timestamps are arrays of typecode 'I' of equal length.
+
+        Every message is a short MIDI message packed in an integer. The arrays
+        are interleaved into the event buffer without converting the messages.
+
+        """
+        count = len(messages)
+        if count > self.buffer_size:
+            raise ValueError("too much data for buffer")
+        buf = array.array('I', [0]) * (count * 2)
+        buf[0::2] = messages
+        buf[1::2] = timestamps
+        err = libpm.Pm_Write(self._midi_stream,
+            (PmEvent * count).from_buffer(buf), count)
+        _check_error(err)
+
     def WriteShort(self, status, data1=0, data2=0):
         buf = PmEvent()
         buf.timestamp = libpt.Pt_Time()
@@ -29,12 +29,13 @@ from PyQt5.QtCore import QSettings, Qt
 from PyQt5.QtWidgets import (
     QAbstractItemView, QCheckBox, QDialog, QDialogButtonBox, QFileDialog,
     QGridLayout, QHBoxLayout, QLabel, QLineEdit, QListWidgetItem,
-    QPushButton, QRadioButton, QTabWidget, QVBoxLayout, QWidget)
+    QPushButton, QRadioButton, QSpinBox, QTabWidget, QVBoxLayout, QWidget)
 
 import app
 import userguide
 import qutil
 import icons
+import jobqueue
 import preferences
 import lilypondinfo
 import qsettings
@@ -303,6 +304,12 @@ class Running(preferences.Group):
         self.deleteFiles = QCheckBox(clicked=self.changed)
         self.embedSourceCode = QCheckBox(clicked=self.changed)
         self.noTranslation = QCheckBox(clicked=self.changed)
+        self.partialEngraving = QCheckBox(clicked=self.changed)
+        self.useServer = QCheckBox(clicked=self.changed)
+        self.maxJobsLabel = QLabel()
+        self.maxJobs = QSpinBox(valueChanged=self.changed)
+        self.maxJobs.setRange(1, 64)
+        self.maxJobsLabel.setBuddy(self.maxJobs)
         self.includeLabel = QLabel()
         self.include = widgets.listedit.FilePathEdit()
         self.include.listBox.setDragDropMode(QAbstractItemView.InternalMove)
@@ -311,6 +318,13 @@ class Running(preferences.Group):
         layout.addWidget(self.deleteFiles)
         layout.addWidget(self.embedSourceCode)
         layout.addWidget(self.noTranslation)
+        layout.addWidget(self.partialEngraving)
+        layout.addWidget(self.useServer)
+        hbox = QHBoxLayout()
+        hbox.addWidget(self.maxJobsLabel)
+        hbox.addWidget(self.maxJobs)
+        hbox.addStretch(1)
+        layout.addLayout(hbox)
         layout.addWidget(self.includeLabel)
         layout.addWidget(self.include)
         app.translateUI(self)
@@ -333,6 +347,20 @@ class Running(preferences.Group):
         self.noTranslation.setToolTip(_(
             "If checked, LilyPond's output messages will be in English.\n"
             "This can be useful for bug reports."))
+        self.partialEngraving.setText(_("Only engrave changed \\bookparts in preview mode"))
+        self.partialEngraving.setToolTip(_(
+            "If checked, and the document consists of \\bookpart blocks, only the\n"
+            "changed \\bookparts are engraved and their pages replace the old ones\n"
+            "in the Music View. Page numbers are not updated until a full run."))
+        self.useServer.setText(_("Keep LilyPond running between jobs (experimental)"))
+        self.useServer.setToolTip(_(
+            "If checked, LilyPond processes are kept running in the background\n"
+            "and reused for the next jobs, so LilyPond's startup time is saved.\n"
+            "If this does not work, LilyPond is started normally."))
+        self.maxJobsLabel.setText(_("Maximum number of jobs running at the same time:"))
+        self.maxJobs.setToolTip(_(
+            "The number of LilyPond processes that may run at the same time\n"
+            "for all documents together. Further jobs wait until one finishes."))
         self.includeLabel.setText(_("LilyPond include path:"))
     
     def loadSettings(self):
@@ -341,6 +369,9 @@ class Running(preferences.Group):
         self.deleteFiles.setChecked(s.value("delete_intermediate_files", True, bool))
         self.embedSourceCode.setChecked(s.value("embed_source_code", False, bool))
         self.noTranslation.setChecked(s.value("no_translation", False, bool))
+        self.partialEngraving.setChecked(s.value("partial_engraving", False, bool))
+        self.useServer.setChecked(s.value("use_server", False, bool))
+        self.maxJobs.setValue(s.value("max_jobs", jobqueue.default_max_jobs(), int))
         include_path = qsettings.get_string_list(s, "include_path")
         self.include.setValue(include_path)
         
@@ -350,6 +381,9 @@ class Running(preferences.Group):
         s.setValue("delete_intermediate_files", self.deleteFiles.isChecked())
         s.setValue("embed_source_code", self.embedSourceCode.isChecked())
         s.setValue("no_translation", self.noTranslation.isChecked())
+        s.setValue("partial_engraving", self.partialEngraving.isChecked())
+        s.setValue("use_server", self.useServer.isChecked())
+        s.setValue("max_jobs", self.maxJobs.value())
         s.setValue("include_path", self.include.value())
 
 
@@ -155,6 +155,15 @@ class MusicView(preferences.Group):
         layout.addWidget(self.magnifierScaleSlider, 2, 1)
         layout.addWidget(self.magnifierScaleSpinBox, 2, 2)
         
+        self.renderThreadsLabel = QLabel()
+        self.renderThreadsSpinBox = QSpinBox(valueChanged=self.changed)
+        self.renderThreadsSpinBox.setRange(0, 32)
+        layout.addWidget(self.renderThreadsLabel, 3, 0)
+        layout.addWidget(self.renderThreadsSpinBox, 3, 2)
+        
+        self.diskCache = QCheckBox(toggled=self.changed)
+        layout.addWidget(self.diskCache, 4, 0, 1, 3)
+        
         self.enableKineticScrolling = QCheckBox(toggled=self.changed)
         layout.addWidget(self.enableKineticScrolling)
         self.showScrollbars = QCheckBox(toggled=self.changed)
@@ -176,6 +185,14 @@ class MusicView(preferences.Group):
         self.magnifierScaleLabel.setToolTip(_(
             "Magnification of the magnifier."))
         self.magnifierScaleSpinBox.setSuffix(_("percent unit sign", "%"))
+        self.renderThreadsLabel.setText(_("Rendering Threads:"))
+        self.renderThreadsLabel.setToolTip(_(
+            "The number of pages that are rendered at the same time."))
+        self.renderThreadsSpinBox.setSpecialValueText(_("Automatic"))
+        self.diskCache.setText(_("Keep rendered pages on disk"))
+        self.diskCache.setToolTip(_(
+            "If checked, rendered pages are also stored on disk, so that\n"
+            "documents that are opened again are displayed faster."))
         # L10N: "Kinetic Scrolling" is a checkbox label, as in "Enable Kinetic Scrolling"
         self.enableKineticScrolling.setText(_("Kinetic Scrolling"))
         self.showScrollbars.setText(_("Show Scrollbars"))
@@ -193,6 +210,8 @@ class MusicView(preferences.Group):
         self.enableKineticScrolling.setChecked(kineticScrollingActive)
         showScrollbars = s.value("show_scrollbars", True, bool)
         self.showScrollbars.setChecked(showScrollbars)
+        self.renderThreadsSpinBox.setValue(s.value("render_threads", 0, int))
+        self.diskCache.setChecked(s.value("disk_cache", False, bool))
     
     def saveSettings(self):
         s = popplerview.MagnifierSettings()
@@ -205,6 +224,8 @@ class MusicView(preferences.Group):
         s.setValue("newer_files_only", self.newerFilesOnly.isChecked())
         s.setValue("kinetic_scrolling", self.enableKineticScrolling.isChecked())
         s.setValue("show_scrollbars", self.showScrollbars.isChecked())
+        s.setValue("render_threads", self.renderThreadsSpinBox.value())
+        s.setValue("disk_cache", self.diskCache.isChecked())
 
 
 class CharMap(preferences.Group):
@@ -68,7 +68,10 @@ View, Surface, (Abstract)Layout and Page can all be inherited from to build
 more specialized Poppler viewers.
 
 The cache module implements in-memory caching for drawn Page images.
-The images are rendered in a background thread.
+The images are rendered in background threads. Large pages (e.g. at a high
+zoom level) are rendered and cached in tiles, of which only the visible ones
+are rendered. The diskcache module can optionally keep the rendered images on
+disk, so they survive restarting the application.
 
 Furthermore, there is a printer module containing functions to create a PostScript
 file of a Poppler.Document and a class to print a Poppler.Document to a QPrinter
@@ -97,11 +100,12 @@ from .highlight import Highlighter
 from .magnifier import Magnifier
 from .locking import lock
 from . import cache
+from . import diskcache
 
 
 __all__ = [
     'FixedScale', 'FitWidth', 'FitHeight', 'FitBoth',
     'View', 'Page', 'AbstractLayout', 'Layout', 'Surface',
     'RenderOptions', 'Highlighter', 'Magnifier',
-    'lock', 'cache',
+    'lock', 'cache', 'diskcache',
 ]
@@ -0,0 +1,115 @@
+# This file is part of the qpopplerview package.
+#
+# Copyright (c) 2010 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+
+"""
+qpopplerview.benchmark_cache -- measures the image cache at steady state.
+
+Run with: python -m qpopplerview.benchmark_cache [operations] [sizes...]
+
+For every size (default 100, 1000, 10000 and 50000 images) the cache is
+filled to its maximum size with small images of a few documents. Then the
+given number of operations (default 20000) is timed: adding an image of a
+new page, which evicts the least recently used image, and looking up an
+image that is in the cache. The time per operation should not grow with the
+size of the cache.
+
+No PDF documents are needed; the cache only uses the documents as keys.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from PyQt5.QtGui import QImage
+
+from . import cache
+
+
+class Document(object):
+    """Stands in for a Poppler.Document, the cache only uses it as a key."""
+
+
+class Page(object):
+    """Has the methods of a qpopplerview.Page the cache uses to find images."""
+    def __init__(self, document, pageNumber, width=100, height=141):
+        self._document = document
+        self._pageNumber = pageNumber
+        self._width = width
+        self._height = height
+
+    def document(self):
+        return self._document
+
+    def pageNumber(self):
+        return self._pageNumber
+
+    def rotation(self):
+        return 0
+
+    def physWidth(self):
+        return self._width
+
+    def physHeight(self):
+        return self._height
+
+
+def measure(count, operations, documents=4):
+    """Returns the seconds per add() and per image() with count images cached."""
+    image = QImage(16, 16, QImage.Format_ARGB32)
+    cache.clear()
+    cache.setmaxsize(count * image.byteCount() / 1048576.0)
+    docs = [Document() for i in range(documents)]
+    pages = [Page(docs[i % documents], i // documents) for i in range(count)]
+    for page in pages:
+        cache.add(image, page.document(), page.pageNumber(), 0,
+                  page.physWidth(), page.physHeight())
+
+    # every add evicts the least recently used image
+    start = time.time()
+    for i in range(count, count + operations):
+        cache.add(image, docs[i % documents], i // documents, 0, 100, 141)
+    added = time.time() - start
+
+    # look up the most recently added images, which are still cached
+    recent = [Page(docs[i % documents], i // documents)
+              for i in range(count + operations - min(count, operations),
+                             count + operations)]
+    start = time.time()
+    for i in range(operations):
+        cache.image(recent[i % len(recent)])
+    found = time.time() - start
+    cache.clear()
+    return added / operations, found / operations
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    operations = args[0] if args else 20000
+    sizes = args[1:] or [100, 1000, 10000, 50000]
+    print("{0:>10} {1:>12} {2:>12}".format("images", "add (us)", "image (us)"))
+    for count in sizes:
+        added, found = measure(count, operations)
+        print("{0:>10} {1:>12.2f} {2:>12.2f}".format(count, added * 1e6, found * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# This file is part of the qpopplerview package.
+#
+# Copyright (c) 2010 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+
+"""
+qpopplerview.benchmark_layout -- measures finding pages in a large layout.
+
+Run with: python -m qpopplerview.benchmark_layout [pages] [lookups]
+
+Loads a combined document of the given number of pages (default 500), taken
+from two documents, in a RowLayout with one and with two pages per row, as
+the Music View uses. Then it times the given number of lookups (default
+20000) at random positions: pageAt(), which is called on every mouse move to
+find a link to hover, and pagesAt() with a viewport sized rectangle, which is
+called on every paint. The same lookups are also done by scanning all pages,
+as was done before the index was used.
+
+No PDF documents are needed; the layouts only use the page sizes.
+
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from PyQt5.QtCore import QPoint, QRect, QSizeF
+
+from . import layout
+
+
+class Document(object):
+    """Stands in for a Poppler.Document, the pages only ask for the page size."""
+    def __init__(self, width=595, height=842):
+        self._size = QSizeF(width, height)
+
+    def page(self, num):
+        return self
+
+    def pageSize(self):
+        return self._size
+
+
+def scan_pageAt(lay, point):
+    """Finds the page at the point by looking at all pages."""
+    for page in lay.pages():
+        if page.rect().contains(point):
+            return page
+
+
+def scan_pagesAt(lay, rect):
+    """Finds the pages touching the rect by looking at all pages."""
+    return [page for page in lay.pages() if page.rect().intersects(rect)]
+
+
+def measure(lay, points, rects):
+    """Returns the microseconds per lookup: indexed and scanning, for both queries."""
+    results = []
+    for func, args in ((lay.pageAt, points), (scan_pageAt, points),
+                       (lambda rect: list(lay.pagesAt(rect)), rects),
+                       (scan_pagesAt, rects)):
+        if func in (scan_pageAt, scan_pagesAt):
+            call = lambda arg: func(lay, arg)
+        else:
+            call = func
+        start = time.time()
+        for arg in args:
+            call(arg)
+        results.append((time.time() - start) / len(args) * 1e6)
+    # check that both ways find the same pages
+    for point in points[:1000]:
+        assert lay.pageAt(point) is scan_pageAt(lay, point)
+    return results
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    count = args[0] if args else 500
+    lookups = args[1] if len(args) > 1 else 20000
+    docs = [Document(), Document(842, 595)]
+    pages = [(docs[i * 2 // count], i) for i in range(count)]
+    print("{0} pages, {1} lookups, microseconds per lookup".format(count, lookups))
+    print("{0:>10} {1:>12} {2:>12} {3:>12} {4:>12}".format(
+        "per row", "pageAt", "(scan)", "pagesAt", "(scan)"))
+    for perRow in (1, 2):
+        lay = layout.RowLayout()
+        lay.setPagesPerRow(perRow)
+        lay.loadPages(pages)
+        lay.update()
+        size = lay.size()
+        rng = random.Random(0)
+        points = [QPoint(rng.randrange(size.width()), rng.randrange(size.height()))
+                  for i in range(lookups)]
+        rects = [QRect(p, p + QPoint(1000, 700)) for p in points]
+        print("{0:>10} {1:>12.2f} {2:>12.2f} {3:>12.2f} {4:>12.2f}".format(
+            perRow, *measure(lay, points, rects)))
+
+
+if __name__ == '__main__':
+    main()
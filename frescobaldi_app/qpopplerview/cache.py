@@ -22,6 +22,8 @@
 Caching of generated images.
 """
 
+import collections
+import threading
 import time
 import weakref
 
@@ -30,20 +32,31 @@ try:
 except ImportError:
     from . import popplerqt5_dummy as popplerqt5
 
-from PyQt5.QtCore import Qt, QThread
+from PyQt5.QtCore import Qt, QRect, QThread, QTimer
 from PyQt5.QtGui import QImage, QPainter, QFont
 
+from . import diskcache
 from . import render
 from . import rectangles
 from .locking import lock
 
-__all__ = ['maxsize', 'setmaxsize', 'image', 'generate', 'clear', 'links', 'options']
+__all__ = [
+    'maxsize', 'setmaxsize', 'size', 'image', 'generate', 'clear', 'links', 'options',
+    'setdata', 'maxthreads', 'setmaxthreads', 'maxclonesize', 'setmaxclonesize',
+    'prefetch', 'reschedule', 'statistics', 'tiled', 'tiles', 'tile',
+]
 
 
-_cache = weakref.WeakKeyDictionary()
+_cache = weakref.WeakKeyDictionary()    # document -> {pageKey: {sizeKey: image}}
+_lru = collections.OrderedDict()        # (docref, pageKey, sizeKey) -> byteCount, oldest first
+_docrefs = weakref.WeakKeyDictionary()  # document -> docref used in the _lru keys
+_docsizes = {}                          # docref -> byteCount
 _schedulers = weakref.WeakKeyDictionary()
 _options = weakref.WeakKeyDictionary()
 _links = weakref.WeakKeyDictionary()
+_data = weakref.WeakKeyDictionary()     # document -> PDF data it was loaded from
+_digests = weakref.WeakKeyDictionary()  # document -> (hash, PDF data), for the disk cache
+_digestlock = threading.Lock()
 
 
 # cache size
@@ -52,6 +65,23 @@ _currentsize = 0
 
 _globaloptions = None
 
+# render pool
+_maxthreads = max(1, QThread.idealThreadCount())
+_maxclonesize = 209715200 # 200M
+_cloneidletime = 60         # seconds after which an idle clone is dropped
+_clonetimer = None
+_runningcount = 0
+
+# tiled rendering of large pages
+_tilesize = 512             # width and height of a tile in pixels
+_tilethreshold = 4194304    # pages with more pixels are rendered in tiles
+
+# scheduling statistics
+_canceledcount = 0
+_renderedcount = 0
+_firstpainttime = 0.0       # total time from request to image of rendered pages
+_firstpaintmax = 0.0
+
 
 def setmaxsize(maxsize):
     """Sets the maximum cache size in Megabytes."""
@@ -65,16 +95,120 @@ def maxsize():
     return _maxsize / 1048576
 
 
+def setmaxthreads(count):
+    """Sets the maximum number of pages that are rendered at the same time.
+    
+    Pages of one document can only be rendered in parallel if the PDF data of
+    the document is known (see setdata()).
+    
+    """
+    global _maxthreads
+    _maxthreads = max(1, count)
+    _checkstart()
+
+
+def maxthreads():
+    """Returns the maximum number of pages that are rendered at the same time."""
+    return _maxthreads
+
+
+def setmaxclonesize(maxsize):
+    """Sets the maximum size in Megabytes of the PDF data of the document clones.
+    
+    A document clone is an extra Poppler.Document, loaded from the same PDF
+    data, that is used to render pages in parallel. The total size of the PDF
+    data of the clones of all documents is limited to this size. Idle clones
+    are dropped when a new clone would not fit, or when they were not used
+    for a while.
+    
+    """
+    global _maxclonesize
+    _maxclonesize = maxsize * 1048576
+    _purgeclones()
+
+
+def maxclonesize():
+    """Returns the maximum size in Megabytes of the PDF data of the document clones."""
+    return _maxclonesize / 1048576
+
+
+def setdata(document, data):
+    """Sets the PDF data (QByteArray) the Poppler.Document was loaded from.
+    
+    This enables rendering multiple pages of the document at the same time,
+    using clones of the document loaded from the same data, and storing the
+    images in the disk cache (see the diskcache module).
+    Use None to unset the data.
+    
+    """
+    _digests.pop(document, None)
+    if data is None:
+        _data.pop(document, None)
+    else:
+        _data[document] = data
+
+
+def _diskkey(document, job):
+    """(Internal) Returns the key for the job's image in the disk cache, or None.
+    
+    None is returned if the disk cache is disabled or the PDF data is unknown.
+    The key does not yet contain the hash of the PDF data, see _digest().
+    
+    """
+    if not diskcache.directory() or document not in _data:
+        return
+    return (job.pageNumber, job.rotation, job.width, job.height, job.tile,
+            options().key(), options(document).key())
+
+
+def _digest(document, data):
+    """(Internal) Returns the hash of the PDF data of the document.
+    
+    The hash is computed only once for the data, in the first render thread
+    that needs it; other threads wait for it.
+    
+    """
+    with _digestlock:
+        try:
+            digest, hashed = _digests[document]
+            if hashed is data:
+                return digest
+        except KeyError:
+            pass
+        digest = diskcache.digest(data)
+        _digests[document] = (digest, data)
+        return digest
+
+
+def size(document=None):
+    """Returns the number of bytes used by the cache, or by the given Poppler.Document."""
+    if document:
+        try:
+            return _docsizes[_docrefs[document]]
+        except KeyError:
+            return 0
+    return _currentsize
+
+
 def clear(document=None):
     """Clears the whole cache or the cache for the given Poppler.Document."""
+    global _currentsize
     if document:
         try:
-            del _cache[document]
+            pageKeys = _cache.pop(document)
         except KeyError:
-            pass
+            return
+        ref = _docrefs[document]
+        for pageKey, sizeKeys in pageKeys.items():
+            for sizeKey in sizeKeys:
+                del _lru[(ref, pageKey, sizeKey)]
+        _currentsize -= _docsizes[ref]
+        _docsizes[ref] = 0
     else:
         _cache.clear()
-        global _currentsize
+        _lru.clear()
+        for ref in _docsizes:
+            _docsizes[ref] = 0
         _currentsize = 0
 
 
@@ -92,43 +226,144 @@ def image(page, exact=True):
     
     if exact:
         try:
-            entry = _cache[document][pageKey][sizeKey]
+            image = _cache[document][pageKey][sizeKey]
         except KeyError:
             return
         else:
-            entry[1] = time.time()
-            return entry[0]
+            _lru.move_to_end((_docrefs[document], pageKey, sizeKey))
+            return image
     try:
-        sizes = _cache[document][pageKey].keys()
+        sizes = [s for s in _cache[document][pageKey] if len(s) == 2]
     except KeyError:
         return
     # find the closest size (assuming aspect ratio has not changed)
     if sizes:
-        sizes = sorted(sizes, key=lambda s: abs(1 - s[0] / float(page.physWidth())))
-        return _cache[document][pageKey][sizes[0]][0]
+        size = min(sizes, key=lambda s: abs(1 - s[0] / float(page.physWidth())))
+        return _cache[document][pageKey][size]
+
+
+def tiled(page):
+    """Returns True if the Page is so large that it is rendered in tiles."""
+    return page.physWidth() * page.physHeight() > _tilethreshold
 
 
-def generate(page):
-    """Schedule an image to be generated for the cache."""
+def tiles(page, rect):
+    """Yields (tile, QRect) tuples for the tiles of the page touched by the QRect.
+    
+    The rect and the yielded rectangles are in physical pixels, relative to the
+    top-left of the page. A tile is a (column, row) tuple.
+    
+    """
+    width, height = int(page.physWidth()), int(page.physHeight())
+    left = max(0, rect.left()) // _tilesize
+    top = max(0, rect.top()) // _tilesize
+    right = min(width - 1, rect.right()) // _tilesize
+    bottom = min(height - 1, rect.bottom()) // _tilesize
+    for row in range(top, bottom + 1):
+        for col in range(left, right + 1):
+            x, y = col * _tilesize, row * _tilesize
+            yield (col, row), QRect(x, y, min(_tilesize, width - x), min(_tilesize, height - y))
+
+
+def tile(page, tile):
+    """Returns the rendered image of the tile (column, row) of the Page if in cache."""
+    document = page.document()
+    pageKey = (page.pageNumber(), page.rotation())
+    sizeKey = (page.physWidth(), page.physHeight()) + tile
+    try:
+        image = _cache[document][pageKey][sizeKey]
+    except KeyError:
+        return
+    _lru.move_to_end((_docrefs[document], pageKey, sizeKey))
+    return image
+
+
+def generate(page, tile=None):
+    """Schedule an image to be generated for the cache.
+    
+    If a tile (column, row) is given, only that tile of the page is rendered.
+    
+    """
     # Poppler-Qt4 crashes when different pages from a Document are rendered at the same time,
-    # so we schedule them to be run in sequence.
+    # so the scheduler renders them in sequence or using clones of the Document.
     document = page.document()
     try:
         scheduler = _schedulers[document]
     except KeyError:
         scheduler = _schedulers[document] = Scheduler()
-    scheduler.schedulejob(page)
+    scheduler.schedulejob(page, tile=tile)
+
+
+def prefetch(page):
+    """Schedule an image to be generated for the cache at idle priority.
+    
+    Does nothing if the image is already in the cache or if the page is rendered
+    in tiles. Use this for pages that are not visible but will probably be shown
+    soon.
+    
+    """
+    if not tiled(page) and image(page) is None:
+        document = page.document()
+        try:
+            scheduler = _schedulers[document]
+        except KeyError:
+            scheduler = _schedulers[document] = Scheduler()
+        scheduler.schedulejob(page, True)
 
 
-def add(image, document, pageNumber, rotation, width, height):
-    """(Internal) Adds an image to the cache."""
+def reschedule():
+    """Cancels jobs for pages that are too far out of view and starts jobs.
+    
+    Call this when the visible rectangle of a layout has changed.
+    
+    """
+    for scheduler in list(_schedulers.values()):
+        scheduler.cancelInvisible()
+    _checkstart()
+
+
+def statistics():
+    """Returns a dictionary with statistics about rendering page images.
+    
+    The keys are:
+    
+    queued:         the number of jobs waiting to be started
+    running:        the number of jobs currently rendering
+    canceled:       the number of jobs canceled because their page was out of view
+    rendered:       the number of page or tile images rendered (not counting
+                    prefetched pages)
+    firstpaint:     the average time in seconds between the request for an
+                    image and the image being ready
+    firstpaintmax:  the maximum of that time
+    
+    """
+    return {
+        'queued': sum(len(s._schedule) for s in list(_schedulers.values())),
+        'running': _runningcount,
+        'canceled': _canceledcount,
+        'rendered': _renderedcount,
+        'firstpaint': _firstpainttime / _renderedcount if _renderedcount else 0.0,
+        'firstpaintmax': _firstpaintmax,
+    }
+
+
+def add(image, document, pageNumber, rotation, width, height, tile=None):
+    """(Internal) Adds an image (of the page or one of its tiles) to the cache."""
+    global _currentsize
     pageKey = (pageNumber, rotation)
-    sizeKey = (width, height)
-    _cache.setdefault(document, {}).setdefault(pageKey, {})[sizeKey] = [image, time.time()]
+    sizeKey = (width, height) if tile is None else (width, height) + tile
+    ref = _docref(document)
+    key = (ref, pageKey, sizeKey)
+    byteCount = image.byteCount()
+    
+    # an image may be rendered again, e.g. when the render options change
+    old = _lru.pop(key, 0)
+    _cache.setdefault(document, {}).setdefault(pageKey, {})[sizeKey] = image
+    _lru[key] = byteCount
+    _docsizes[ref] += byteCount - old
+    _currentsize += byteCount - old
     
     # maintain cache size
-    global _maxsize, _currentsize
-    _currentsize += image.byteCount()
     if _currentsize > _maxsize:
         purge()
 
@@ -138,26 +373,39 @@ def purge():
     
     (Not necessary to call, as the cache will monitor its size automatically.)
     
+    The most recently used image is always kept, even if it is larger than
+    the maximum size.
+    
     """
-    # make a list of the images, sorted on time, newest first
-    images = iter(sorted((
-        (time, document, pageKey, sizeKey, image.byteCount())
-            for document, pageKeys in _cache.items()
-            for pageKey, sizeKeys in pageKeys.items()
-            for sizeKey, (image, time) in sizeKeys.items()),
-                reverse=True))
-
-    # sum the size of the newest images
-    global _maxsize, _currentsize
-    byteCount = 0
-    for item in images:
-        byteCount += item[4]
-        if byteCount > _maxsize:
-            break
-    _currentsize = byteCount
-    # delete the other images
-    for time, document, pageKey, sizeKey, byteCount in images:
-        del _cache[document][pageKey][sizeKey]
+    global _currentsize
+    while _currentsize > _maxsize and len(_lru) > 1:
+        (ref, pageKey, sizeKey), byteCount = _lru.popitem(last=False)
+        _currentsize -= byteCount
+        _docsizes[ref] -= byteCount
+        document = ref()
+        if document is not None:
+            sizeKeys = _cache[document][pageKey]
+            del sizeKeys[sizeKey]
+            if not sizeKeys:
+                del _cache[document][pageKey]
+
+
+def _docref(document):
+    """(Internal) Returns the weak reference used for the document in the LRU keys."""
+    try:
+        return _docrefs[document]
+    except KeyError:
+        ref = _docrefs[document] = weakref.ref(document, _forget)
+        _docsizes[ref] = 0
+        return ref
+
+
+def _forget(ref):
+    """(Internal) Called when a document is garbage collected; drops its accounting."""
+    global _currentsize
+    for key in [key for key in _lru if key[0] is ref]:
+        del _lru[key]
+    _currentsize -= _docsizes.pop(ref, 0)
 
 
 def links(page):
@@ -208,104 +456,332 @@ def setoptions(options, document=None):
             pass
 
 
+def _purgeclones(size=0):
+    """(Internal) Drops idle clones, the longest idle first.
+    
+    Clones are dropped until size more bytes fit in the maximum clone size,
+    and all clones that were idle longer than _cloneidletime are dropped.
+    Returns True if size more bytes fit.
+    
+    """
+    schedulers = list(_schedulers.values())
+    clones = sorted(((clone[2], scheduler, clone)
+        for scheduler in schedulers
+        for clone in scheduler._clones), key=lambda c: c[0])
+    total = _clonesize()
+    now = time.time()
+    for idle, scheduler, clone in clones:
+        if total + size <= _maxclonesize and now - idle < _cloneidletime:
+            break
+        scheduler._clones.remove(clone)
+        scheduler.dropclone(clone[1])
+        total -= clone[1]
+    if any(scheduler._clones for scheduler in schedulers):
+        _startclonetimer()
+    return total + size <= _maxclonesize
+
+
+def _clonesize():
+    """(Internal) Returns the total size of the PDF data of all clones."""
+    return sum(scheduler._clonesize for scheduler in list(_schedulers.values()))
+
+
+def _startclonetimer():
+    """(Internal) Makes sure idle clones are dropped after some time."""
+    global _clonetimer
+    if _clonetimer is None:
+        _clonetimer = QTimer(singleShot=True, timeout=_purgeclones)
+    if not _clonetimer.isActive():
+        _clonetimer.start(_cloneidletime * 1000)
+
+
+def _checkstart():
+    """(Internal) Starts jobs in all schedulers while render threads are available."""
+    for scheduler in list(_schedulers.values()):
+        if _runningcount >= _maxthreads:
+            break
+        scheduler.checkStart()
+
+
+def _distance(page, job):
+    """(Internal) Returns the distance in pixels of a Job to the visible part of the layout.
+    
+    The job's rectangle on the Page is used, which is the whole page unless
+    a tile is rendered.
+    Returns 0 if the page is visible or if it is not known what is visible.
+    Returns None if the page is so far out of view that it should not be rendered.
+    
+    """
+    layout = page.layout()
+    if not layout:
+        return 0
+    visible = layout.visibleRect()
+    if not visible.isValid():
+        return 0
+    rect = page.rect()
+    left, top = rect.left(), rect.top()
+    hscale = rect.width() / float(job.width or 1)
+    vscale = rect.height() / float(job.height or 1)
+    right = left + (job.x + job.w) * hscale
+    bottom = top + (job.y + job.h) * vscale
+    left += job.x * hscale
+    top += job.y * vscale
+    dx = max(0, visible.left() - right, left - visible.right())
+    dy = max(0, visible.top() - bottom, top - visible.bottom())
+    # keep pages within one viewport size around the visible rectangle
+    if dx > visible.width() or dy > visible.height():
+        return None
+    return dx + dy
+
+
 class Scheduler(object):
-    """Manages running rendering jobs in sequence for a Document."""
+    """Manages running rendering jobs for a Document.
+    
+    Poppler crashes when different pages from a Document are rendered at the
+    same time, so every running job gets its own renderer: the document itself
+    or a clone of it, loaded from the same PDF data (see setdata()).
+    
+    Jobs for pages closest to the visible part of their layout are started
+    first, and jobs for pages that have scrolled far out of view are canceled.
+    Prefetch jobs are only started when no other jobs are waiting.
+    
+    """
     def __init__(self):
         self._schedule = []     # order
+        self._sequence = 0      # increases every time a job is scheduled
         self._jobs = {}         # jobs on key
         self._waiting = weakref.WeakKeyDictionary()      # jobs on page
-        self._running = None
+        self._running = {}      # runners on job
+        self._busy = False      # whether the document itself is rendering
+        self._clones = []       # idle clones: (clone, size of its data, idle since)
+        self._clonecount = 0    # number of clones created (idle or running)
+        self._clonesize = 0     # size of the PDF data of those clones
         
-    def schedulejob(self, page):
+    def schedulejob(self, page, prefetch=False, tile=None):
         """Creates or retriggers an existing Job.
         
         If a Job was already scheduled for the page, it is canceled.
         The page's update() method will be called when the Job has completed.
+        If prefetch is True, the job gets idle priority.
+        If a tile (column, row) is given, only that tile of the page is rendered.
         
         """
         # uniquely identify the image to be generated
-        key = (page.pageNumber(), page.rotation(), page.physWidth(), page.physHeight())
+        key = (page.pageNumber(), page.rotation(), page.physWidth(), page.physHeight(), tile)
         try:
             job = self._jobs[key]
         except KeyError:
-            job = self._jobs[key] = Job(page)
+            job = self._jobs[key] = Job(page, tile)
             job.key = key
+            job.prefetch = prefetch
         else:
-            self._schedule.remove(job)
-        self._schedule.append(job)
+            if job in self._schedule:
+                self._schedule.remove(job)
+            job.prefetch = job.prefetch and prefetch
+        if job not in self._running:
+            self._sequence += 1
+            job.sequence = self._sequence
+            self._schedule.append(job)
+        old = self._waiting.get(page)
+        if old is not None and old is not job:
+            old.pages.discard(page)
         self._waiting[page] = job
+        job.pages.add(page)
         self.checkStart()
+    
+    def pages(self, job):
+        """Returns the list of pages waiting for the job."""
+        return list(job.pages)
+    
+    def priority(self, job):
+        """Returns a sortable priority for the job, the lowest value runs first.
+        
+        Returns None if the job should be canceled.
+        
+        """
+        distances = [d for d in (_distance(page, job) for page in self.pages(job))
+                       if d is not None]
+        if not distances:
+            return None
+        # among equal distances, the most recently scheduled job runs first
+        return job.prefetch, min(distances), -job.sequence
+    
+    def cancelInvisible(self):
+        """Cancels the waiting jobs whose pages are too far out of view."""
+        global _canceledcount
+        for job in self._schedule[:]:
+            if self.priority(job) is None:
+                pages = self.pages(job)
+                for page in pages:
+                    del self._waiting[page]
+                job.pages.clear()
+                self.done(job)
+                if pages:
+                    _canceledcount += 1
         
     def checkStart(self):
-        """Starts a job if none is running and at least one is waiting."""
-        while self._schedule and not self._running:
-            job = self._schedule[-1]
-            document = job.document()
-            if document and job in self._waiting.values():
-                self._running = Runner(self, document, job)
+        """Starts jobs while render threads are available and jobs are waiting."""
+        global _runningcount
+        while self._schedule and _runningcount < _maxthreads:
+            self.cancelInvisible()
+            if not self._schedule:
                 break
+            job = min(self._schedule, key=self.priority)
+            document = job.document()
+            if document:
+                renderer = self.renderer(document)
+                if renderer is None:
+                    break
+                self._schedule.remove(job)
+                self._running[job] = Runner(self, document, renderer, job)
+                _runningcount += 1
             else:
                 self.done(job)
-            
+    
+    def renderer(self, document):
+        """Returns a (Poppler.Document, size) tuple to render a job with.
+        
+        The renderer is the document itself, an idle clone, or None if a new
+        clone needs to be loaded (this is done in the Runner thread). The size
+        is the size of the PDF data counted for the clone, 0 for the document.
+        Returns None if no renderer is available.
+        
+        """
+        if not self._busy:
+            self._busy = True
+            return document, 0
+        elif self._clones:
+            clone, size, idle = self._clones.pop()
+            return clone, size
+        elif document in _data and self._clonecount < _maxthreads - 1:
+            size = len(_data[document])
+            if _purgeclones(size):
+                self._clonecount += 1
+                self._clonesize += size
+                return None, size
+    
+    def release(self, document, renderer, size):
+        """Called when a renderer has finished a job."""
+        if renderer is document:
+            self._busy = False
+        elif (renderer is None or self._clonecount > _maxthreads - 1
+              or _clonesize() > _maxclonesize):
+            self.dropclone(size)
+        else:
+            self._clones.append((renderer, size, time.time()))
+            _startclonetimer()
+    
+    def dropclone(self, size):
+        """Forgets a clone that is not idle anymore, with its data size."""
+        self._clonecount -= 1
+        self._clonesize -= size
+    
     def done(self, job):
         """Called when the job has completed."""
         del self._jobs[job.key]
-        self._schedule.remove(job)
-        self._running = None
-        for page in list(self._waiting):
-            if self._waiting[page] is job:
-                page.update()
-                del self._waiting[page]
+        if job in self._schedule:
+            self._schedule.remove(job)
+        self._running.pop(job, None)
+        for page in list(job.pages):
+            page.update()
+            del self._waiting[page]
+        job.pages.clear()
 
 
 class Job(object):
-    """Simply contains data needed to create an image later."""
-    def __init__(self, page):
+    """Simply contains data needed to create an image later.
+    
+    The width and height are the size of the whole page; x, y, w and h the
+    rectangle to render, which is the whole page unless a tile is rendered.
+    
+    """
+    def __init__(self, page, tile=None):
         self.document = weakref.ref(page.document())
+        self.pages = weakref.WeakSet()  # the pages waiting for this job
         self.pageNumber = page.pageNumber()
         self.rotation = page.rotation()
         self.width = page.physWidth()
         self.height = page.physHeight()
+        self.tile = tile
+        if tile is None:
+            self.x, self.y, self.w, self.h = 0, 0, self.width, self.height
+        else:
+            self.x, self.y = tile[0] * _tilesize, tile[1] * _tilesize
+            self.w = min(_tilesize, self.width - self.x)
+            self.h = min(_tilesize, self.height - self.y)
+        self.time = time.time()
+        self.prefetch = False
 
 
 class Runner(QThread):
-    """Immediately runs a Job in a background thread."""
-    def __init__(self, scheduler, document, job):
+    """Immediately runs a Job in a background thread.
+    
+    The renderer is a tuple (renderer, size) from Scheduler.renderer(): the
+    Poppler.Document to render the page with, the document itself or a clone,
+    and the size of the clone's PDF data. If the renderer is None, a clone is
+    loaded from the document's data.
+    
+    """
+    def __init__(self, scheduler, document, renderer, job):
         super(Runner, self).__init__()
         self.scheduler = scheduler
         self.job = job
         self.document = document # keep reference now so that it does not die during this thread
+        self.renderer, self.clonesize = renderer
+        self.data = _data.get(document)
+        self.diskkey = _diskkey(document, job)
         self.finished.connect(self.slotFinished)
         self.start()
         
     def run(self):
         """Main method of this thread, called by Qt on start()."""
-        page = self.document.page(self.job.pageNumber)
-        pageSize = page.pageSize()
-        if self.job.rotation & 1:
-            pageSize.transpose()
-        xres = 72.0 * self.job.width / pageSize.width()
-        yres = 72.0 * self.job.height / pageSize.height()
-        threshold = options().oversampleThreshold() or options(self.document).oversampleThreshold()
-        multiplier = 2 if xres < threshold else 1
-        with lock(self.document):
-            options().write(self.document)
-            options(self.document).write(self.document)
-            self.image = page.renderToImage(xres * multiplier, yres * multiplier, 0, 0, self.job.width * multiplier, self.job.height * multiplier, self.job.rotation)
+        if self.diskkey:
+            self.diskkey = (_digest(self.document, self.data),) + self.diskkey
+            self.image = diskcache.load(self.diskkey)
+            if self.image is not None:
+                return
+        if self.renderer is None:
+            self.renderer = popplerqt5.Poppler.Document.loadFromData(self.data) or None
+        renderer = self.renderer or self.document
+        with lock(renderer):
+            page = renderer.page(self.job.pageNumber)
+            pageSize = page.pageSize()
+            if self.job.rotation & 1:
+                pageSize.transpose()
+            xres = 72.0 * self.job.width / pageSize.width()
+            yres = 72.0 * self.job.height / pageSize.height()
+            threshold = options().oversampleThreshold() or options(self.document).oversampleThreshold()
+            multiplier = 2 if xres < threshold else 1
+            options().write(renderer)
+            options(self.document).write(renderer)
+            self.image = page.renderToImage(xres * multiplier, yres * multiplier,
+                self.job.x * multiplier, self.job.y * multiplier,
+                self.job.w * multiplier, self.job.h * multiplier, self.job.rotation)
 
         if self.image.isNull():
-            self.image = QImage( self.job.width, self.job.height, QImage.Format_RGB32 )
+            self.image = QImage( self.job.w, self.job.h, QImage.Format_RGB32 )
             self.image.fill( Qt.white )
             p = QPainter(self.image)
-            p.setFont(QFont("Helvetica",self.job.height/20))
+            p.setFont(QFont("Helvetica",self.job.h/20))
             p.drawText(self.image.rect(), Qt.AlignCenter,
                        _("Failed to render page") );
+            return
         elif multiplier == 2:
-            self.image = self.image.scaledToWidth(self.job.width, Qt.SmoothTransformation)
+            self.image = self.image.scaledToWidth(self.job.w, Qt.SmoothTransformation)
+        if self.diskkey:
+            diskcache.save(self.diskkey, self.image)
         
     def slotFinished(self):
         """Called when the thread has completed."""
-        add(self.image, self.document, self.job.pageNumber, self.job.rotation, self.job.width, self.job.height)
+        global _runningcount, _renderedcount, _firstpainttime, _firstpaintmax
+        _runningcount -= 1
+        if not self.job.prefetch:
+            duration = time.time() - self.job.time
+            _renderedcount += 1
+            _firstpainttime += duration
+            _firstpaintmax = max(_firstpaintmax, duration)
+        add(self.image, self.document, self.job.pageNumber, self.job.rotation,
+            self.job.width, self.job.height, self.job.tile)
+        self.scheduler.release(self.document, self.renderer, self.clonesize)
         self.scheduler.done(self.job)
-        self.scheduler.checkStart()
-
+        _checkstart()
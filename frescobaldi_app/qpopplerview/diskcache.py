@@ -0,0 +1,206 @@
+# This file is part of the qpopplerview package.
+#
+# Copyright (c) 2010 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+
+"""
+Persistent caching of generated images on disk.
+
+This is an optional second tier below the in-memory cache. The images are
+stored as PNG files in a directory. The file name is derived from a key
+containing the content hash of the PDF data, the page number, rotation, size
+and the rendering options, so a document that is loaded again (e.g. in a new
+session) finds back its images, even if the PDF file was written again.
+
+The total size of the files is limited; the least recently used files are
+removed first. Images are loaded in the render threads and saved by a
+background thread, so all functions in this module are thread-safe.
+
+"""
+
+import collections
+import hashlib
+import os
+import queue
+import threading
+
+from PyQt5.QtGui import QImage
+
+__all__ = ['directory', 'setdirectory', 'maxsize', 'setmaxsize', 'digest', 'load', 'save']
+
+
+_directory = None
+_maxsize = 524288000 # 500M
+_currentsize = 0
+_index = None                   # OrderedDict filename -> size, oldest first
+_lock = threading.RLock()
+_queue = queue.Queue()
+_writer = None
+
+
+def setdirectory(directory):
+    """Sets the directory to store the images in. None disables the disk cache."""
+    global _directory, _index, _currentsize
+    with _lock:
+        if directory != _directory:
+            _directory = directory
+            _index = None
+            _currentsize = 0
+
+
+def directory():
+    """Returns the directory the images are stored in, None if the disk cache is disabled."""
+    return _directory
+
+
+def setmaxsize(maxsize):
+    """Sets the maximum size of the disk cache in Megabytes."""
+    global _maxsize
+    with _lock:
+        _maxsize = maxsize * 1048576
+        if _index is not None:
+            _purge()
+
+
+def maxsize():
+    """Returns the maximum size of the disk cache in Megabytes."""
+    return _maxsize / 1048576
+
+
+def digest(data):
+    """Returns a hash of the PDF data (a QByteArray or bytes) to use in keys."""
+    return hashlib.sha1(bytes(data)).hexdigest()
+
+
+def load(key):
+    """Returns the QImage stored for the key (a tuple), or None if not available."""
+    name = _filename(key)
+    with _lock:
+        if not _directory or name not in _getindex():
+            return
+        _index.move_to_end(name)
+        path = os.path.join(_directory, name)
+    image = QImage(path)
+    if image.isNull():
+        return
+    try:
+        os.utime(path, None)
+    except (IOError, OSError):
+        pass
+    return image
+
+
+def save(key, image):
+    """Stores the QImage for the key (a tuple) in the background."""
+    global _writer
+    if not _directory:
+        return
+    _queue.put((_directory, _filename(key), image))
+    with _lock:
+        if not _writer:
+            _writer = threading.Thread(target=_write, name="qpopplerview.diskcache")
+            _writer.daemon = True
+            _writer.start()
+
+
+def _filename(key):
+    """(Internal) Returns the file name for the key."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.png'
+
+
+def _getindex():
+    """(Internal) Returns the index, reading the directory the first time.
+    
+    Must be called with the lock held.
+    
+    """
+    global _index, _currentsize
+    if _index is None:
+        entries = []
+        try:
+            if not os.path.isdir(_directory):
+                os.makedirs(_directory)
+            for name in os.listdir(_directory):
+                if name.endswith('.png'):
+                    st = os.stat(os.path.join(_directory, name))
+                    entries.append((st.st_mtime, name, st.st_size))
+        except (IOError, OSError):
+            pass
+        entries.sort()
+        _index = collections.OrderedDict((name, size) for mtime, name, size in entries)
+        _currentsize = sum(_index.values())
+        _purge()
+    return _index
+
+
+def _purge():
+    """(Internal) Removes the least recently used files to limit the space used.
+    
+    Must be called with the lock held.
+    
+    """
+    global _currentsize
+    while _currentsize > _maxsize and _index:
+        name, size = _index.popitem(last=False)
+        _currentsize -= size
+        try:
+            os.remove(os.path.join(_directory, name))
+        except (IOError, OSError):
+            pass
+
+
+def _remove(path):
+    """(Internal) Removes the file if it exists, ignoring errors."""
+    try:
+        os.remove(path)
+    except (IOError, OSError):
+        pass
+
+
+def _write():
+    """(Internal) Saves the queued images, runs in a background thread."""
+    global _currentsize
+    while True:
+        directory, name, image = _queue.get()
+        path = os.path.join(directory, name)
+        temp = path + '.tmp'
+        with _lock:
+            if directory != _directory:
+                continue
+            _getindex()
+        written = temp
+        try:
+            if not image.save(temp, 'PNG'):
+                raise IOError("could not save image")
+            os.replace(temp, path)
+            written = path
+            size = os.path.getsize(path)
+        except (IOError, OSError):
+            # don't leave files behind that are not counted in the index
+            _remove(written)
+            if written == path:
+                with _lock:
+                    if directory == _directory and _index is not None:
+                        _currentsize -= _index.pop(name, 0)
+            continue
+        with _lock:
+            if directory == _directory and _index is not None:
+                old = _index.pop(name, 0)
+                _index[name] = size
+                _currentsize += size - old
+                _purge()
@@ -22,6 +22,7 @@
 Manages and positions a group of Page instances.
 """
 
+import bisect
 import weakref
 
 from PyQt5.QtCore import QObject, QPoint, QRect, QSize, Qt, pyqtSignal
@@ -43,6 +44,9 @@ class AbstractLayout(QObject):
     You can also iterate over pages(), which only yields the Page instances
     that are visible().
     
+    On update() an index of the page positions is built, so that pageAt() and
+    pagesAt() can find pages using a binary search.
+    
     """
     
     redraw = pyqtSignal(QRect)
@@ -58,6 +62,8 @@ class AbstractLayout(QObject):
         self._scale = 1.0
         self._scaleChanged = False
         self._dpi = (72, 72)
+        self._visibleRect = QRect()
+        self._index = None
         
     def own(self, page):
         """(Internal) Makes the page have ourselves as layout."""
@@ -65,10 +71,12 @@ class AbstractLayout(QObject):
             page.layout().remove(page)
         page._layout = weakref.ref(self)
         page.computeSize()
+        self._index = None
     
     def disown(self, page):
         """(Internal) Removes ourselves as owner of the page."""
         page._layout = lambda: None
+        self._index = None
         
     def append(self, page):
         self.own(page)
@@ -155,10 +163,24 @@ class AbstractLayout(QObject):
         self._dpi = xdpi, ydpi or xdpi
         for page in self:
             page.computeSize()
+        self._index = None
     
     def dpi(self):
         """Returns our DPI as a tuple(XDPI, YDPI)."""
         return self._dpi
+    
+    def setVisibleRect(self, rect):
+        """Sets the rectangle of the layout that is visible in the View.
+        
+        The cache uses this to render the visible pages first and to cancel
+        rendering pages that are far out of view.
+        
+        """
+        self._visibleRect = QRect(rect)
+    
+    def visibleRect(self):
+        """Returns the rectangle that is visible in the View (invalid if unknown)."""
+        return QRect(self._visibleRect)
         
     def scale(self):
         """Returns the scale (1.0 == 100%)."""
@@ -171,6 +193,7 @@ class AbstractLayout(QObject):
             for page in self:
                 page.setScale(scale)
             self._scaleChanged = True
+            self._index = None
     
     def setPageWidth(self, width, sameScale=True):
         """Sets the width of all pages.
@@ -247,6 +270,7 @@ class AbstractLayout(QObject):
     def update(self):
         """Performs the layout (positions the Pages and adjusts our size)."""
         self.reLayout()
+        self.buildIndex()
         if self._scaleChanged:
             self.scaleChanged.emit(self._scale)
             self._scaleChanged = False
@@ -261,6 +285,39 @@ class AbstractLayout(QObject):
         """
         pass
     
+    def buildIndex(self):
+        """Builds the index used by pageAt() and pagesAt().
+        
+        This is called by update(). The visible pages are sorted on their
+        position along the longest side of the layout. Besides the start
+        coordinates, the running maximum of the end coordinates is stored,
+        so the pages touching a range can be found by bisecting both lists.
+        
+        """
+        pages = list(self.pages())
+        horizontal = self.width() > self.height()
+        if horizontal:
+            ranges = [(page.rect().left(), page.rect().right()) for page in pages]
+        else:
+            ranges = [(page.rect().top(), page.rect().bottom()) for page in pages]
+        order = sorted(range(len(pages)), key=lambda i: ranges[i][0])
+        starts = [ranges[i][0] for i in order]
+        ends = []
+        for i in order:
+            ends.append(max(ends[-1], ranges[i][1]) if ends else ranges[i][1])
+        self._index = (horizontal, starts, ends, [pages[i] for i in order])
+    
+    def candidates(self, rect):
+        """Returns the visible pages that possibly touch the QRect, using the index."""
+        if self._index is None:
+            self.buildIndex()
+        horizontal, starts, ends, pages = self._index
+        if horizontal:
+            low, high = rect.left(), rect.right()
+        else:
+            low, high = rect.top(), rect.bottom()
+        return pages[bisect.bisect_left(ends, low):bisect.bisect_right(starts, high)]
+    
     def updatePage(self, page):
         """Called by the Page when an image has been generated."""
         self.redraw.emit(page.rect())
@@ -291,15 +348,13 @@ class AbstractLayout(QObject):
         
     def pageAt(self, point):
         """Returns the page that contains the given QPoint."""
-        # Specific layouts may use faster algorithms to find the page.
-        for page in self.pages():
+        for page in self.candidates(QRect(point, point)):
             if page.rect().contains(point):
                 return page
     
     def pagesAt(self, rect):
         """Yields the pages touched by the given QRect."""
-        # Specific layouts may use faster algorithms to find the pages.
-        for page in self.pages():
+        for page in self.candidates(rect):
             if page.rect().intersects(rect):
                 yield page
         
@@ -336,8 +391,16 @@ class AbstractLayout(QObject):
         
     def load(self, document):
         """Convenience method to load all the pages of the given Poppler.Document using page.Page()."""
+        self.loadPages((document, num) for num in range(document.numPages()))
+    
+    def loadPages(self, pages):
+        """Load the pages, an iterable of (Poppler.Document, pageNumber) tuples.
+        
+        The pages may come from different documents.
+        
+        """
         self.clear()
-        for num in range(document.numPages()):
+        for document, num in pages:
             p = page.Page(document, num)
             p.setScale(self._scale)
             self.append(p)
@@ -165,6 +165,9 @@ class Page(object):
     def rotation(self):
         return self._rotation
     
+    def layout(self):
+        return None
+    
     def update(self):
         if self.magnifier:
             self.magnifier.update()
@@ -174,6 +174,10 @@ class Page(object):
         image_rect.moveTopLeft( image_rect.topLeft()*self._retinaFactor );
         image_rect.setSize( image_rect.size()*self._retinaFactor );
 
+        if cache.tiled(self):
+            self.paintTiles(painter, update_rect, image_rect)
+            return
+        
         image = cache.image(self)
         self._waiting = not image
         if image:
@@ -196,6 +200,42 @@ class Page(object):
                          or cache.options().paperColor() or self.document().paperColor())
                 painter.fillRect(update_rect, color)
 
+    def paintTiles(self, painter, update_rect, image_rect):
+        """Paints a large page using the cached tiles that touch image_rect.
+        
+        The update_rect is in surface coordinates, the image_rect in physical
+        pixels relative to our top-left position. Missing tiles are scheduled
+        to be rendered and meanwhile drawn from a scaled image, if available.
+        
+        """
+        factor = float(self._retinaFactor)
+        pos = self.pos()
+        waiting = False
+        scaled = None
+        for tile, tile_rect in cache.tiles(self, image_rect):
+            source = tile_rect & image_rect
+            target = QRectF(source.x() / factor + pos.x(), source.y() / factor + pos.y(),
+                            source.width() / factor, source.height() / factor)
+            image = cache.tile(self, tile)
+            if image:
+                painter.drawImage(target, image, QRectF(source.translated(-tile_rect.topLeft())))
+                continue
+            # schedule the tile to be generated, if done our update() method is called
+            waiting = True
+            cache.generate(self, tile)
+            if scaled is None:
+                scaled = cache.image(self, False) or False
+            if scaled:
+                hscale = float(scaled.width()) / self.physWidth()
+                vscale = float(scaled.height()) / self.physHeight()
+                painter.drawImage(target, scaled, QRectF(source.x() * hscale, source.y() * vscale,
+                                            source.width() * hscale, source.height() * vscale))
+            else:
+                color = (cache.options(self.document()).paperColor()
+                         or cache.options().paperColor() or self.document().paperColor())
+                painter.fillRect(target, color)
+        self._waiting = waiting
+    
     def update(self):
         """Called when an image is drawn."""
         # only redraw when we were waiting for a correctly sized image.
@@ -205,7 +245,11 @@ class Page(object):
     def repaint(self):
         """Call this to force a repaint (e.g. when the rendering options are changed)."""
         self._waiting = True
-        cache.generate(self)
+        if cache.tiled(self):
+            # the tiles are requested when painting
+            self.update()
+        else:
+            cache.generate(self)
     
     def image(self, rect, xdpi=72.0, ydpi=None, options=None):
         """Returns a QImage of the specified rectangle (relative to our top-left position).
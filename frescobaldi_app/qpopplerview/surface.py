@@ -37,6 +37,7 @@ try:
 except ImportError:
     from . import popplerqt5_dummy as popplerqt5
 
+from . import cache
 from . import layout
 from . import page
 from . import highlight
@@ -117,6 +118,7 @@ class Surface(QWidget):
         self._scrollTimer = QTimer(interval=100, timeout=self._scrollTimeout)
         self._pageLayout = None
         self._highlights = weakref.WeakKeyDictionary()
+        self._prefetchTimer = QTimer(singleShot=True, interval=250, timeout=self.prefetch)
         self.setPageLayout(layout.Layout())
         self.setContextMenuPolicy(Qt.PreventContextMenu)
         self.setLinksEnabled(True)
@@ -143,6 +145,38 @@ class Surface(QWidget):
     def viewportRect(self):
         """Returns the rectangle of us that is visible in the View."""
         return self.view().viewport().rect().translated(-self.pos())
+    
+    def updateVisibleRect(self):
+        """Tells the layout which rectangle is visible, to prioritize rendering.
+        
+        This is called on move and resize; jobs for pages that scrolled out of
+        view are canceled and the neighbouring pages are prefetched when idle.
+        
+        """
+        self._pageLayout.setVisibleRect(self.viewportRect() & self.rect())
+        cache.reschedule()
+        self._prefetchTimer.start()
+    
+    def prefetch(self):
+        """Schedules rendering the pages before and after the visible pages."""
+        pages = list(self._pageLayout.pages())
+        visible = set(self._pageLayout.pagesAt(self._pageLayout.visibleRect()))
+        for i, page in enumerate(pages):
+            if page not in visible:
+                continue
+            for j in (i - 1, i + 1):
+                if 0 <= j < len(pages) and pages[j] not in visible:
+                    cache.prefetch(pages[j])
+    
+    def moveEvent(self, ev):
+        """Reimplemented to update the visible rectangle of the layout."""
+        super(Surface, self).moveEvent(ev)
+        self.updateVisibleRect()
+    
+    def resizeEvent(self, ev):
+        """Reimplemented to update the visible rectangle of the layout."""
+        super(Surface, self).resizeEvent(ev)
+        self.updateVisibleRect()
         
     def setSelectionEnabled(self, enabled):
         """Enables or disables selecting rectangular regions."""
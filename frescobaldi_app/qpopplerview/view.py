@@ -134,6 +134,13 @@ class View(KineticScrollArea):
             self.fit()
         self.surface().pageLayout().update()
 
+    def loadPages(self, pages):
+        """Convenience method to load pages, a list of (Poppler.Document, pageNumber) tuples."""
+        self.surface().pageLayout().loadPages(pages)
+        if self.viewMode():
+            self.fit()
+        self.surface().pageLayout().update()
+
     def clear(self):
         """Convenience method to clear the current layout."""
         self.surface().pageLayout().clear()
@@ -241,6 +248,7 @@ class View(KineticScrollArea):
         
     def resizeEvent(self, ev):
         super(View, self).resizeEvent(ev)
+        self.surface().updateVisibleRect()
         # Adjust the size of the document if desired
         if self.viewMode() and any(self.surface().pageLayout().pages()):
             if self._centerPos is False:
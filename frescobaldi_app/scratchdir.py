@@ -49,7 +49,8 @@ def findDocument(filename):
         if d.url().toLocalFile() == filename:
             return d
         s = ScratchDir.instance(d)
-        if s.directory() and util.equal_paths(filename, s.path()):
+        if s.directory() and (util.equal_paths(filename, s.path())
+                              or s.isPartialPath(filename)):
             return d
 
 
@@ -77,6 +78,38 @@ class ScratchDir(plugin.DocumentPlugin):
                 basename = 'document' + ly.lex.extensions[documentinfo.mode(self.document())]
             return os.path.join(self._directory, basename)
             
+    def partialDirectory(self):
+        """Returns the directory containing the partial copies of the document text.
+        
+        Returns None if no temporary area was created. The directory itself
+        is created by partialPath().
+        
+        """
+        if self._directory:
+            return os.path.join(self._directory, 'partial')
+    
+    def partialPath(self, run):
+        """Returns the path for a partial copy of the document text.
+        
+        This is used by engrave.partial to engrave only parts of the document.
+        Every run (a number) gets its own subdirectory, so the output files of
+        earlier runs are kept. Creates the temporary area and the subdirectory
+        for this file if needed.
+        
+        """
+        self.create()
+        directory = os.path.join(self.partialDirectory(), str(run))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return os.path.join(directory, os.path.basename(self.path()))
+    
+    def isPartialPath(self, filename):
+        """Returns True if the filename is a path returned by partialPath()."""
+        directory = self.partialDirectory()
+        return bool(directory
+            and os.path.basename(filename) == os.path.basename(self.path())
+            and util.equal_paths(os.path.dirname(os.path.dirname(filename)), directory))
+    
     def saveDocument(self):
         """Writes the text of the document to our path()."""
         if not self._directory:
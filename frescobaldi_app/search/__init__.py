@@ -26,7 +26,7 @@ import bisect
 import re
 import weakref
 
-from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtCore import QEvent, QPoint, Qt
 from PyQt5.QtGui import QKeySequence, QPalette, QTextCursor
 from PyQt5.QtWidgets import (
     QAction, QApplication, QCheckBox, QGridLayout, QLabel, QLineEdit,
@@ -43,12 +43,14 @@ import wordboundary
 import viewhighlighter
 import gadgets.borderlayout
 
+from . import engine
+
 
 class Search(plugin.MainWindowPlugin, QWidget):
     def __init__(self, mainwindow):
         QWidget.__init__(self, mainwindow)
         self._currentView = None
-        self._positions = []
+        self._engine = None
         self._positionsDirty = True
         self._replace = False  # are we in replace mode?
         self._going = False    # are we moving the text cursor?
@@ -142,9 +144,11 @@ class Search(plugin.MainWindowPlugin, QWidget):
         if cur:
             cur.selectionChanged.disconnect(self.slotSelectionChanged)
             cur.document().contentsChanged.disconnect(self.slotDocumentContentsChanged)
+            cur.verticalScrollBar().valueChanged.disconnect(self.slotScrolled)
         if view:
             view.selectionChanged.connect(self.slotSelectionChanged)
             view.document().contentsChanged.connect(self.slotDocumentContentsChanged)
+            view.verticalScrollBar().valueChanged.connect(self.slotScrolled)
         self._currentView = weakref.ref(view) if view else None
     
     def showWidget(self):
@@ -182,10 +186,23 @@ class Search(plugin.MainWindowPlugin, QWidget):
                 self.highlightingOn()
 
     def slotDocumentContentsChanged(self):
-        """Called when the current document changes."""
-        self.markPositionsDirty()
+        """Called when the current document changes.
+        
+        While visible, the search engine follows the changes itself.
+        
+        """
+        if not self.isVisible():
+            self.markPositionsDirty()
+    
+    def slotScrolled(self):
+        """Called when the current View scrolls; highlights the visible matches."""
+        if self.isVisible() and self._engine:
+            self.highlightingOn()
+    
+    def slotEngineChanged(self):
+        """Called when the search engine has found new matches or changed."""
+        self.updateCount()
         if self.isVisible():
-            self.updatePositions()
             self.highlightingOn()
         
     def slotHide(self):
@@ -248,28 +265,37 @@ class Search(plugin.MainWindowPlugin, QWidget):
         self.markPositionsDirty()
         self.updatePositions()
         self.highlightingOn()
-        if not self._replace and self._positions:
-            positions = [c.position() for c in self._positions]
+        if not self._replace and self._engine:
             cursor = self.currentView().textCursor()
-            index = bisect.bisect_left(positions, cursor.selectionStart())
-            if index == len(positions):
-                index -= 1
-            elif index > 0:
-                # it might be possible that the text cursor currently already
-                # is in a search result. This happens when the search is pop up
-                # with an empty text and the current word is then set as search
-                # text.
-                if cursortools.contains(self._positions[index-1], cursor):
+            self._engine.ensure(cursor.selectionStart())
+            positions = self._engine.starts()
+            if positions:
+                index = bisect.bisect_left(positions, cursor.selectionStart())
+                if index == len(positions):
                     index -= 1
-            self.gotoPosition(index)
+                elif index > 0:
+                    # it might be possible that the text cursor currently already
+                    # is in a search result. This happens when the search is pop up
+                    # with an empty text and the current word is then set as search
+                    # text.
+                    if cursortools.contains(self._engine.cursor(index-1), cursor):
+                        index -= 1
+                self.gotoPosition(index)
         self._going = False
 
     def highlightingOn(self, view=None):
-        """Show the current search result positions."""
+        """Show the current search result positions that are visible."""
         if view is None:
             view = self.currentView()
         if view:
-            viewhighlighter.highlighter(view).highlight("search", self._positions, 1)
+            cursors = []
+            if self._engine:
+                start = view.cursorForPosition(QPoint(0, 0)).block().position()
+                rect = view.viewport().rect()
+                block = view.cursorForPosition(rect.bottomRight()).block()
+                end = block.position() + block.length()
+                cursors = self._engine.cursors(start, end)
+            viewhighlighter.highlighter(view).highlight("search", cursors, 1)
     
     def highlightingOff(self, view=None):
         """Hide the current search result positions."""
@@ -280,7 +306,9 @@ class Search(plugin.MainWindowPlugin, QWidget):
             
     def markPositionsDirty(self):
         """Delete positions and mark them dirty, i.e. they need updating."""
-        self._positions = []
+        if self._engine:
+            self._engine.close()
+            self._engine = None
         self._positionsDirty = True
     
     def updatePositions(self):
@@ -291,50 +319,57 @@ class Search(plugin.MainWindowPlugin, QWidget):
         search = self.searchEntry.text()
         cursor = view.textCursor()
         document = view.document()
-        self._positions = []
+        if self._engine:
+            self._engine.close()
+            self._engine = None
         if search:
-            text = document.toPlainText()
-            start = 0
-            if (self._replace or not self._going) and cursor.hasSelection():
-                # don't search outside the selection
-                start = cursor.selectionStart()
-                text = text[start:cursor.selectionEnd()]
             flags = re.MULTILINE | re.DOTALL
             if not self.caseCheck.isChecked():
                 flags |= re.IGNORECASE
             if not self.regexCheck.isChecked():
                 search = re.escape(search)
             try:
-                matches = re.finditer(search, text, flags)
+                regexp = re.compile(search, flags)
             except re.error:
                 pass
             else:
-                for m in matches:
-                    c = QTextCursor(document)
-                    c.setPosition(start + m.end())
-                    c.setPosition(start + m.start(), QTextCursor.KeepAnchor)
-                    self._positions.append(c)
-        self.countLabel.setText(format(len(self._positions)))
-        enabled = len(self._positions) > 0
+                if not ((self._replace or not self._going) and cursor.hasSelection()):
+                    # search the whole document
+                    cursor = None
+                self._engine = engine.Engine(document, regexp, cursor)
+                self._engine.changed.connect(self.slotEngineChanged)
+        self.updateCount()
+        self._positionsDirty = False
+    
+    def updateCount(self):
+        """Show the number of matches and enable the buttons if there are any."""
+        count = self._engine.count() if self._engine else 0
+        text = format(count)
+        if self._engine and not self._engine.isFinished():
+            text += "\u2026"   # the count is not yet complete
+        self.countLabel.setText(text)
+        enabled = count > 0
         self.replaceButton.setEnabled(enabled)
         self.replaceAllButton.setEnabled(enabled)
         self.prevButton.setEnabled(enabled)
         self.nextButton.setEnabled(enabled)
-        self._positionsDirty = False
         
     def findNext(self):
         """Called on menu Find Next."""
         self._going = True
         self.updatePositions()
         view = self.currentView()
-        if view and self._positions:
-            positions = [c.position() for c in self._positions]
-            index = bisect.bisect_right(positions, view.textCursor().position())
-            if index < len(positions):
-                self.gotoPosition(index)
-            else:
-                self.gotoPosition(0)
-            view.ensureCursorVisible()
+        if view and self._engine:
+            position = view.textCursor().position()
+            self._engine.ensure(position + 1)
+            positions = self._engine.starts()
+            if positions:
+                index = bisect.bisect_right(positions, position)
+                if index < len(positions):
+                    self.gotoPosition(index)
+                else:
+                    self.gotoPosition(0)
+                view.ensureCursorVisible()
         self._going = False
 
     def findPrevious(self):
@@ -342,15 +377,21 @@ class Search(plugin.MainWindowPlugin, QWidget):
         self._going = True
         self.updatePositions()
         view = self.currentView()
-        positions = [c.position() for c in self._positions]
-        if view and positions:
-            index = bisect.bisect_left(positions, view.textCursor().position()) - 1
-            self.gotoPosition(index)
+        if view and self._engine:
+            position = view.textCursor().position()
+            self._engine.ensure(position)
+            positions = self._engine.starts()
+            if positions:
+                index = bisect.bisect_left(positions, position) - 1
+                if index < 0:
+                    # wrap around to the last match
+                    self._engine.complete()
+                self.gotoPosition(index)
         self._going = False
     
     def gotoPosition(self, index):
-        """Scrolls the current View to the position in the _positions list at index."""
-        c = QTextCursor(self._positions[index])
+        """Scrolls the current View to the search result at index."""
+        c = self._engine.cursor(index)
         #c.clearSelection()
         self.currentView().gotoTextCursor(c)
         self.currentView().ensureCursorVisible()
@@ -378,7 +419,7 @@ class Search(plugin.MainWindowPlugin, QWidget):
     def keyPressEvent(self, ev):
         """Catches Up and Down to jump between search results."""
         # if in search mode, Up and Down jump between search results
-        if not self._replace and self._positions and self.searchEntry.text() and not ev.modifiers():
+        if not self._replace and self._engine and self._engine.count() and self.searchEntry.text() and not ev.modifiers():
             if ev.key() == Qt.Key_Up:
                 self.findPrevious()
                 return
@@ -391,9 +432,12 @@ class Search(plugin.MainWindowPlugin, QWidget):
             return
         super(Search, self).keyPressEvent(ev)
 
-    def doReplace(self, cursor):
-        """Perform one replace action."""
-        text = cursor.selection().toPlainText()
+    def replacement(self, text):
+        """Return the replacement text for the found text, or None.
+        
+        None is returned if the text can't be replaced.
+        
+        """
         search = self.searchEntry.text()
         replace = self.replaceEntry.text()
         ok = text == search
@@ -407,35 +451,45 @@ class Search(plugin.MainWindowPlugin, QWidget):
                 except re.error:
                     pass
         if ok:
+            return replace
+    
+    def doReplace(self, cursor):
+        """Perform one replace action."""
+        replace = self.replacement(cursor.selection().toPlainText())
+        if replace is not None:
             pos = cursor.position()
             cursor.insertText(replace)
             cursor.setPosition(pos, QTextCursor.KeepAnchor)
-        return ok
+            return True
+        return False
         
     def slotReplace(self):
         """Called when the user clicks Replace."""
         view = self.currentView()
-        if view and self._positions:
-            positions = [c.position() for c in self._positions]
-            index = bisect.bisect_left(positions, view.textCursor().position())
+        if view and self._engine:
+            position = view.textCursor().position()
+            self._engine.ensure(position)
+            positions = self._engine.starts()
+            if not positions:
+                return
+            index = bisect.bisect_left(positions, position)
             if index >= len(positions):
                 index = 0
-            if self.doReplace(self._positions[index]):
+            if self.doReplace(self._engine.cursor(index)):
                 self.findNext()
     
     def slotReplaceAll(self):
         """Called when the user clicks Replace All."""
         view = self.currentView()
-        if view:
-            replaced = False
-            cursors = self._positions
-            if view.textCursor().hasSelection():
-                cursors = [cursor for cursor in cursors if cursortools.contains(view.textCursor(), cursor)]
-            with cursortools.compress_undo(view.textCursor()):
-                for cursor in cursors:
-                    if self.doReplace(cursor):
-                        replaced = True
-            if replaced:
+        if view and self._engine:
+            self._engine.complete()
+            first, last = 0, self._engine.count()
+            cursor = view.textCursor()
+            if cursor.hasSelection():
+                # only replace the matches inside the selection
+                first = bisect.bisect_left(self._engine.starts(), cursor.selectionStart())
+                last = bisect.bisect_right(self._engine.ends(), cursor.selectionEnd())
+            if self._engine.replace(self.replacement, first, last):
                 self.highlightingOn()
 
 
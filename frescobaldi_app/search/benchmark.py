@@ -0,0 +1,123 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+search.benchmark -- measures Replace All in a large synthetic score.
+
+Run with: python -m search.benchmark [lines] [old_lines]
+
+Creates a score of the given number of lines (default 50000) in a document
+with the LilyPond highlighter, searches it and replaces every match (two on
+every line) with Engine.replace(), as Replace All does. For comparison the
+same is done the way Replace All did before, replacing the matches one by
+one with a QTextCursor per match, in a score of old_lines lines (default
+5000), as that takes too long for the full score.
+
+The time to search and the time to replace are printed, and it is checked
+that the results equal re.sub().
+
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication
+
+import cursortools
+
+from . import engine
+
+
+SEARCH = r"c'(\d+)"
+REPLACE = r"cis'\1"
+
+
+def score(lines):
+    """Returns the text of a synthetic score with two matches on every line."""
+    line = "  c'4( d' e') f'8 g' c'2 | % bar"
+    return '\n'.join(line.replace('bar', str(i + 1)) for i in range(lines))
+
+
+def replacement(text):
+    """Returns the replacement text, like Search.replacement() for a regexp."""
+    m = re.match(SEARCH, text)
+    if m:
+        return m.expand(REPLACE)
+
+
+def replace_with_cursors(cursors):
+    """Replaces the matches one by one, as Replace All did before."""
+    with cursortools.compress_undo(cursors[0]):
+        for cursor in cursors:
+            replace = replacement(cursor.selection().toPlainText())
+            if replace is not None:
+                pos = cursor.position()
+                cursor.insertText(replace)
+                cursor.setPosition(pos, QTextCursor.KeepAnchor)
+
+
+def measure(lines, old=False):
+    """Returns the number of matches, and the seconds to search and to replace."""
+    import document
+    import highlighter
+    doc = document.Document()
+    text = score(lines)
+    doc.setPlainText(text)
+    highlighter.highlighter(doc)
+    start = time.time()
+    e = engine.Engine(doc, re.compile(SEARCH))
+    e.complete()
+    searched = time.time() - start
+    count = e.count()
+    start = time.time()
+    if old:
+        cursors = list(e.cursors())
+        e.close()
+        replace_with_cursors(cursors)
+    else:
+        e.replace(replacement)
+        e.close()
+    replaced = time.time() - start
+    assert doc.toPlainText() == re.sub(SEARCH, REPLACE, text)
+    return count, searched, replaced
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    lines = args[0] if args else 50000
+    old_lines = args[1] if len(args) > 1 else 5000
+    app = QApplication(sys.argv[:1])
+    print("{0:>12} {1:>8} {2:>8} {3:>12} {4:>12}".format(
+        "", "lines", "matches", "search (s)", "replace (s)"))
+    for name, n, old in (
+            ("replace()", lines, False),
+            ("replace()", old_lines, False),
+            ("cursors", old_lines, True)):
+        count, searched, replaced = measure(n, old)
+        print("{0:>12} {1:>8} {2:>8} {3:>12.3f} {4:>12.3f}".format(
+            name, n, count, searched, replaced))
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+search.check -- checks the matches the Engine keeps up to date.
+
+Run with: python -m search.check [seeds] [edits]
+
+For every seed (default 20) and a few patterns, some of which match a
+newline, a random text of 20000 characters is searched with an Engine. Then the given number of
+random edits (default 200) is made, each inserting or removing a few
+characters or newlines. After every edit the matches of the Engine must equal
+the matches of a fresh search of the whole text.
+
+Exits with a non-zero status if a difference is found.
+
+"""
+
+from __future__ import print_function
+
+import random
+import re
+import sys
+
+from PyQt5.QtGui import QTextCursor, QTextDocument
+from PyQt5.QtWidgets import QApplication
+
+from . import engine
+
+
+PATTERNS = [
+    r"\w+\n\w",
+    r"c'\d*",
+    r"\w \w+",
+    r"[de]\n",
+    r"^c|d$",
+]
+
+CHARACTERS = "cde' 4\n\n"
+
+
+def fresh(regexp, text):
+    """Returns the (start, end) tuples of all matches in the text."""
+    return [m.span() for m in regexp.finditer(text)]
+
+
+def check(pattern, seed, edits):
+    """Returns the number of the first edit that gave a difference, or None."""
+    rng = random.Random(seed)
+    regexp = re.compile(pattern, re.MULTILINE | re.DOTALL) # as Search does
+    doc = QTextDocument()
+    doc.documentLayout() # contentsChange is only emitted with a layout
+    doc.setPlainText(''.join(rng.choice(CHARACTERS) for i in range(20000)))
+    e = engine.Engine(doc, regexp)
+    e.complete()
+    cursor = QTextCursor(doc)
+    try:
+        for num in range(edits):
+            length = doc.characterCount() - 1
+            pos = rng.randrange(length + 1)
+            cursor.setPosition(pos)
+            if rng.random() < 0.5 and pos < length:
+                cursor.setPosition(min(length, pos + rng.randint(1, 5)),
+                                   QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+            else:
+                cursor.insertText(''.join(rng.choice(CHARACTERS)
+                                          for i in range(rng.randint(1, 5))))
+            e.complete()
+            matches = list(zip(e.starts(), e.ends()))
+            if matches != fresh(regexp, doc.toPlainText()):
+                return num
+    finally:
+        e.close()
+
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:3]]
+    seeds = args[0] if args else 20
+    edits = args[1] if len(args) > 1 else 200
+    app = QApplication(sys.argv[:1])
+    failed = 0
+    for pattern in PATTERNS:
+        for seed in range(seeds):
+            num = check(pattern, seed, edits)
+            if num is not None:
+                print("{0!r}, seed {1}: difference after edit {2}".format(
+                    pattern, seed, num))
+                failed += 1
+    print("{0} patterns, {1} seeds, {2} edits: {3} failed".format(
+        len(PATTERNS), seeds, edits, failed))
+    del app
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
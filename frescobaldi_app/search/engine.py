@@ -0,0 +1,372 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Finds the matches of a regular expression in a document.
+
+The Engine searches the document in chunks, using a timer, so that searching
+a large document does not block the user interface. The matches are stored as
+start and end positions in arrays, and QTextCursors are only created when
+asked for. After a change in the document, only the changed lines, the line
+before them and the lines of the matches touching those are searched again,
+and the search goes on after them until the matches are the same as before.
+So a match spanning more than two lines that would start by a change further
+on is not found.
+"""
+
+
+import array
+import bisect
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextCursor
+
+import cursortools
+
+
+class Engine(QObject):
+    """Finds and keeps the matches of a regular expression in a QTextDocument.
+
+    The changed() signal is emitted when matches have been found or have
+    changed, the finished() signal when the whole document (or range) has
+    been searched. Call close() when the Engine is not needed anymore.
+
+    """
+    changed = pyqtSignal()
+    finished = pyqtSignal()
+
+    # the number of characters to search in one step
+    chunksize = 65536
+
+    # the number of characters a match may extend beyond a chunk
+    overlap = 4096
+
+    def __init__(self, document, regexp, cursor=None):
+        """Start searching regexp (a compiled regular expression) in document.
+
+        If a cursor with a selection is given, only the selection is searched.
+
+        """
+        QObject.__init__(self)
+        self._document = document
+        self._regexp = regexp
+        self._range = QTextCursor(cursor) if cursor and cursor.hasSelection() else None
+        self._starts = array.array('l')
+        self._ends = array.array('l')
+        self._pos = self.rangeStart()   # None when the search is finished
+        self._timer = QTimer(singleShot=True, timeout=self._step)
+        document.contentsChange.connect(self.slotContentsChange)
+        self._timer.start(0)
+
+    def close(self):
+        """Stop searching and stop following changes in the document."""
+        self._timer.stop()
+        self._document.contentsChange.disconnect(self.slotContentsChange)
+
+    def document(self):
+        """Return the document."""
+        return self._document
+
+    def rangeStart(self):
+        """Return the start position of the searched range."""
+        return self._range.selectionStart() if self._range else 0
+
+    def rangeEnd(self):
+        """Return the end position of the searched range."""
+        if self._range:
+            return self._range.selectionEnd()
+        return self._document.characterCount() - 1
+
+    def isFinished(self):
+        """Return True if the whole range has been searched."""
+        return self._pos is None
+
+    def count(self):
+        """Return the number of matches found so far."""
+        return len(self._starts)
+
+    def starts(self):
+        """Return the array of start positions of the matches (do not alter)."""
+        return self._starts
+
+    def ends(self):
+        """Return the array of end positions of the matches (do not alter)."""
+        return self._ends
+
+    def cursor(self, index):
+        """Return a QTextCursor for the match at index.
+
+        The cursor's anchor is at the end of the match and its position at the
+        start.
+
+        """
+        c = QTextCursor(self._document)
+        c.setPosition(self._ends[index])
+        c.setPosition(self._starts[index], QTextCursor.KeepAnchor)
+        return c
+
+    def cursors(self, start=0, end=None):
+        """Yield QTextCursors for the matches overlapping the range start-end.
+
+        By default, yields cursors for all matches found so far.
+
+        """
+        first = bisect.bisect_left(self._ends, start)
+        last = len(self._starts) if end is None else bisect.bisect_right(self._starts, end)
+        for index in range(first, last):
+            yield self.cursor(index)
+
+    def ensure(self, position):
+        """Search until the first match at or after position is known.
+
+        Returns when such a match has been found or the search has finished.
+
+        """
+        while self._pos is not None and not (
+                self._starts and self._starts[-1] >= position):
+            self._step(False)
+
+    def complete(self):
+        """Search the remaining part of the document right now."""
+        while self._pos is not None:
+            self._step(False)
+
+    def replace(self, replacement, first=0, last=None):
+        """Replace the matches from index first to last in one go.
+        
+        replacement(text) is called with the text of every match and should
+        return the new text, or None to leave the match alone.
+        
+        The new text is computed first; then every line (or group of lines)
+        containing replaced matches is changed with a single edit, from the end
+        of the document to the start, all in one undo step. As Qt only notifies
+        the listeners to the document at the end of an edit block, they are
+        notified just once.
+        
+        Returns the number of replaced matches.
+        
+        """
+        self.complete()
+        if last is None:
+            last = len(self._starts)
+        if first >= last:
+            return 0
+        offset = self._starts[first]
+        text = self._text(offset, self._ends[last-1])
+        edits = []
+        pieces = []
+        count = 0
+        edit_start = edit_end = None
+        for start, end in zip(self._starts[first:last], self._ends[first:last]):
+            old = text[start-offset:end-offset]
+            new = replacement(old)
+            if new is None:
+                continue
+            count += 1
+            if new == old:
+                continue
+            if pieces and '\n' not in text[edit_end-offset:start-offset]:
+                # add to the edit on the same line
+                pieces.append(text[edit_end-offset:start-offset])
+                pieces.append(new)
+            else:
+                if pieces:
+                    edits.append((edit_start, edit_end, ''.join(pieces)))
+                edit_start = start
+                pieces = [new]
+            edit_end = end
+        if pieces:
+            edits.append((edit_start, edit_end, ''.join(pieces)))
+        cursor = QTextCursor(self._document)
+        with cursortools.compress_undo(cursor):
+            for start, end, new in reversed(edits):
+                cursor.setPosition(start)
+                cursor.setPosition(end, QTextCursor.KeepAnchor)
+                cursor.insertText(new)
+        return count
+
+    def _text(self, start, end):
+        """Return the text of the document between start and end."""
+        c = QTextCursor(self._document)
+        c.setPosition(start)
+        c.setPosition(end, QTextCursor.KeepAnchor)
+        return c.selectedText().replace('\u2029', '\n')
+
+    def _search(self, start, end, limit):
+        """Return the matches starting between start and end as two lists.
+
+        Matches may extend to limit. The start and limit positions should be
+        at the start and end of a line.
+
+        """
+        starts, ends = [], []
+        for m in self._regexp.finditer(self._text(start, limit)):
+            if start + m.start() >= end:
+                break
+            starts.append(start + m.start())
+            ends.append(start + m.end())
+        return starts, ends
+
+    def _blockStart(self, position):
+        """Return the position of the start of the block at position."""
+        return self._document.findBlock(position).position()
+
+    def _blockEnd(self, position):
+        """Return the position of the end of the block at position."""
+        block = self._document.findBlock(position)
+        if not block.isValid():
+            block = self._document.lastBlock()
+        return block.position() + block.length() - 1
+
+    def _step(self, emit=True):
+        """Search the next chunk."""
+        end = self.rangeEnd()
+        start = self._pos
+        if start >= end:
+            chunk = limit = end
+        else:
+            chunk = self._blockStart(min(end, start + self.chunksize))
+            if chunk <= start:
+                chunk = min(end, self._blockEnd(start) + 1)
+            limit = min(end, self._blockEnd(min(end, chunk + self.overlap)))
+            starts, ends = self._search(start, chunk, limit)
+            self._starts.extend(starts)
+            self._ends.extend(ends)
+            if ends:
+                chunk = max(chunk, ends[-1])
+        if chunk >= end:
+            self._pos = None
+        else:
+            self._pos = chunk
+            if emit:
+                self._timer.start(0)
+        if emit:
+            self.changed.emit()
+            if self._pos is None:
+                self.finished.emit()
+
+    def slotContentsChange(self, position, removed, added):
+        """Update the matches after a change in the document."""
+        delta = added - removed
+        starts, ends = self._starts, self._ends
+
+        # first remove matches overlapping the change, and shift the others
+        lo = bisect.bisect_left(ends, position)
+        hi = bisect.bisect_right(starts, position + removed)
+        removed_matches = list(zip(starts[lo:hi], ends[lo:hi]))
+        del starts[lo:hi], ends[lo:hi]
+        if delta:
+            starts[lo:] = array.array('l', (s + delta for s in starts[lo:]))
+            ends[lo:] = array.array('l', (e + delta for e in ends[lo:]))
+
+        if self._pos is not None:
+            if position >= self._pos:
+                if removed_matches:
+                    self.changed.emit()
+                return
+            elif position + removed >= self._pos:
+                # the change extends into the part not yet searched
+                self._pos = max(self.rangeStart(), self._blockStart(position))
+                lo = bisect.bisect_left(ends, self._pos)
+                del starts[lo:], ends[lo:]
+                self.changed.emit()
+                return
+            self._pos += delta
+
+        # search the changed lines again, also in matches touching them, and
+        # the line before, as a match can start there if it matches a newline
+        block = self._document.findBlock(position)
+        if block.previous().isValid():
+            block = block.previous()
+        rstart = block.position()
+        rend = self._blockEnd(position + added)
+        if removed_matches:
+            rstart = min(rstart, self._blockStart(removed_matches[0][0]))
+            end = removed_matches[-1][1]
+            if end > position + removed:
+                rend = max(rend, self._blockEnd(end + delta))
+        end = self.rangeEnd() if self._pos is None else self._pos
+        rstart = max(self.rangeStart(), rstart)
+        rend = min(end, rend)
+        lo = bisect.bisect_left(ends, rstart)
+        hi = bisect.bisect_right(starts, rend)
+        if lo < hi:
+            rstart = max(self.rangeStart(), min(rstart, self._blockStart(starts[lo])))
+            rend = min(end, max(rend, self._blockEnd(ends[hi-1])))
+        if rend < rstart:
+            if removed_matches:
+                self.changed.emit()
+            return
+        # The matches after the changed lines can also change, if a match now
+        # ends elsewhere. At the start of a line no match (old or new) extends
+        # over, the matches are the same as before again. Search at most a
+        # chunk further (like _step()) to find such a line.
+        chunk = min(end, self._blockEnd(min(end, rend + self.overlap)) + 1)
+        limit = min(end, self._blockEnd(min(end, chunk + self.overlap)))
+        # don't overlap matches before the searched region: start after them,
+        # as a search from the start of the document would do
+        pos = max(rstart, ends[lo-1]) if lo else rstart
+        new_starts, new_ends = [], []
+        line = rend + 1
+        synced = False
+        for m in self._regexp.finditer(self._text(rstart, limit), pos - rstart):
+            start, stop = rstart + m.start(), rstart + m.end()
+            while start >= line and not synced:
+                line, synced = self._sync(line, hi)
+            if synced or start >= chunk:
+                break
+            new_starts.append(start)
+            new_ends.append(stop)
+            if stop > line:
+                line = self._lineStart(stop)
+        else:
+            while line <= limit and not synced:
+                line, synced = self._sync(line, hi)
+        if synced:
+            hi = bisect.bisect_left(starts, line, hi)
+        else:
+            hi = len(starts)
+        old = sorted(removed_matches + list(zip(starts[lo:hi], ends[lo:hi])))
+        starts[lo:hi] = array.array('l', new_starts)
+        ends[lo:hi] = array.array('l', new_ends)
+        if not synced and limit < end:
+            # search the rest of the document again
+            self._pos = max(chunk, new_ends[-1]) if new_ends else chunk
+            self._timer.start(0)
+            self.changed.emit()
+        elif old != list(zip(new_starts, new_ends)):
+            self.changed.emit()
+
+    def _lineStart(self, position):
+        """Return position if it is at the start of a line, else the start of the next."""
+        if self._blockStart(position) == position:
+            return position
+        return self._blockEnd(position) + 1
+
+    def _sync(self, line, index):
+        """Return (line, True) if no stored match from index on extends over line.
+
+        Otherwise return the start of the line after the end of that match, and
+        False.
+
+        """
+        i = bisect.bisect_left(self._starts, line, index)
+        if i > 0 and self._ends[i-1] > line:
+            return self._lineStart(self._ends[i-1]), False
+        return line, True
@@ -0,0 +1,201 @@
+# This file is part of the Frescobaldi project, http://www.frescobaldi.org/
+#
+# Copyright (c) 2008 - 2014 by Wilbert Berendsen
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+# See http://www.gnu.org/licenses/ for more information.
+
+"""
+Keeps a hash of the tokens of a document up to date.
+
+The hash only covers tokens that are not whitespace or comments, so it can
+be used to see whether a document really changed, e.g. before running
+LilyPond again.
+
+The hash is a polynomial rolling hash over the significant tokens. The
+highlighter stores the rolling hash of the tokens of every block in its
+fingerprint, and those are combined per chunk of blocks and then for the whole
+document. After a change only the chunks with changed blocks are hashed again.
+Because the rolling hash of a sequence can be computed from the hashes of its
+parts, the result does not depend on how the tokens are divided over the
+blocks and the blocks over the chunks: adding or removing a line break or a
+comment does not change the hash.
+
+"""
+
+
+import highlighter
+import plugin
+import tokeniter
+
+
+# modulus and base of the rolling hash
+_modulus = (1 << 61) - 1
+_base = 1000003
+
+
+def token_hash(document):
+    """Return the hash of the significant tokens of the document.
+
+    Returns 0 if the document has no tokens other than whitespace or comments.
+
+    """
+    return TokenHash.instance(document).hash()
+
+
+def tokens_hash(tokens):
+    """Return a (hash, count) tuple for the rolling hash of the tokens."""
+    h = 0
+    for t in tokens:
+        h = (h * _base + (hash(t) & _modulus)) % _modulus
+    return h, len(tokens)
+
+
+def _combine(parts):
+    """Return the rolling hash of a sequence from (hash, count) tuples."""
+    h = 0
+    for value, count in parts:
+        h = (h * pow(_base, count, _modulus) + value) % _modulus
+    return h
+
+
+class TokenHash(plugin.DocumentPlugin):
+    """Keeps a hash of the significant tokens of a document."""
+
+    # the number of blocks in a chunk
+    chunksize = 256
+
+    # forget all hashes if more blocks than this changed between two hash()
+    # calls
+    max_pending = 10000
+
+    def __init__(self, document):
+        self._chunks = None     # list of [lines, hash or None, count]
+        self._hash = None
+        self._pending = []      # blocks with changed tokens
+        document.contentsChange.connect(self.slotContentsChange)
+        highlighter.highlighter(document).tokensChanged.connect(self.slotTokensChanged)
+
+    def hash(self):
+        """Return the hash of the significant tokens of the document."""
+        doc = self.document()
+        if self._chunks is None:
+            count = doc.blockCount()
+            size = self.chunksize
+            self._chunks = [[min(size, count - i), None, 0]
+                            for i in range(0, count, size)]
+            self._pending = []
+            self._hash = None
+        elif self._pending:
+            pending, self._pending = self._pending, []
+            for block in pending:
+                if block.isValid():
+                    self._chunks[self._find(block.blockNumber())[0]][1] = None
+                    self._hash = None
+        if self._hash is None:
+            line = 0
+            for chunk in self._chunks:
+                if chunk[1] is None:
+                    chunk[1], chunk[2] = self._hash_blocks(
+                        doc.findBlockByNumber(line), chunk[0])
+                line += chunk[0]
+            self._hash = _combine((h, c) for lines, h, c in self._chunks)
+        return self._hash
+
+    def slotContentsChange(self, position, removed, added):
+        """Called when the document changes, marks the changed blocks."""
+        if self._chunks is None:
+            return
+        doc = self.document()
+        first = doc.findBlock(position)
+        last = doc.findBlock(position + added)
+        if not last.isValid():
+            last = doc.lastBlock()
+        if not first.isValid():
+            first = last
+        added_lines = last.blockNumber() - first.blockNumber() + 1
+        removed_lines = added_lines - doc.blockCount() + sum(c[0] for c in self._chunks)
+        if removed_lines < 1:
+            self._chunks = None     # should not happen
+        else:
+            self._replace(first.blockNumber(), removed_lines, added_lines)
+            self._hash = None
+
+    def slotTokensChanged(self, block):
+        """Called when the highlighter changed the tokens of a block.
+
+        As this can happen before our slotContentsChange() is called, the
+        block is only looked up on the next hash() call.
+
+        """
+        if self._chunks is not None:
+            if len(self._pending) < self.max_pending:
+                self._pending.append(block)
+            else:
+                self._chunks = None
+
+    def _find(self, line):
+        """Return the index of the chunk containing the line and its start."""
+        start = 0
+        for index, chunk in enumerate(self._chunks):
+            if line < start + chunk[0]:
+                break
+            start += chunk[0]
+        return index, start
+
+    def _replace(self, line, removed, added):
+        """Replace removed lines at line with added lines."""
+        chunks = self._chunks
+        index, start = self._find(line)
+        chunk = chunks[index]
+        # remove the lines from this and the following chunks
+        remove = min(removed, start + chunk[0] - line)
+        chunk[0] += added - remove
+        chunk[1] = None
+        removed -= remove
+        i = index + 1
+        while removed and i < len(chunks):
+            remove = min(removed, chunks[i][0])
+            chunks[i][0] -= remove
+            chunks[i][1] = None
+            removed -= remove
+            i += 1
+        # split large chunks and drop empty ones
+        size = self.chunksize
+        new = []
+        for c in chunks[index:i]:
+            if c[0] > 2 * size:
+                new.extend([min(size, c[0] - j), None, 0] for j in range(0, c[0], size))
+            elif c[0]:
+                new.append(c)
+        chunks[index:i] = new
+        if not chunks:
+            chunks.append([0, None, 0])
+
+    def _hash_blocks(self, block, count):
+        """Return the rolling hash and the number of significant tokens of count blocks."""
+        parts = []
+        for i in range(count):
+            data = block.userData()
+            if data and hasattr(data, 'tokens') and hasattr(data, 'fingerprint'):
+                fingerprint = data.fingerprint[1]
+            else:
+                fingerprint = highlighter.fingerprint(tokeniter.tokens(block))[1]
+            if fingerprint is not None:
+                parts.append(fingerprint)
+            block = block.next()
+        return _combine(parts), sum(n for h, n in parts)
+
+
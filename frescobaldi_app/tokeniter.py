@@ -25,6 +25,9 @@ The core methods of this module are tokens() and state(). These access
 the token information from the highlighter, and also run the highlighter
 if it has not run yet.
 
+Large documents are lexed in the background; use ready(), wait() or
+when_ready() if you do not want to block until their tokens are known.
+
 If you alter the document and directly after that need the new tokens,
 use update().
 
@@ -54,19 +57,43 @@ def tokens(block):
 def state(block):
     """Return the ly.lex.State() object at the beginning of the given QTextBlock."""
     hl = highlighter.highlighter(block.document())
-    if block.previous().userState() == -1 and block.blockNumber() > 0:
-        hl.rehighlight()
+    if block.blockNumber() > 0:
+        hl.wait(block.previous())
     return hl.state(block.previous())
 
 
 def state_end(block):
     """Return the ly.lex.State() object at the end of the given QTextBlock."""
     hl = highlighter.highlighter(block.document())
-    if block.userState() == -1:
-        hl.rehighlight()
+    hl.wait(block)
     return hl.state(block)
 
 
+def ready(block):
+    """Return True if the tokens and state of the block are known.
+    
+    If this returns False, the document is being lexed in the background,
+    and calling tokens() or state() for the block would need to wait.
+    
+    """
+    return (block.userState() != -1
+            or not highlighter.highlighter(block.document()).isLexing())
+
+
+def wait(block):
+    """Wait until the tokens and state of the block are known."""
+    highlighter.highlighter(block.document()).wait(block)
+
+
+def when_ready(block, func):
+    """Call func() without arguments as soon as the block has been lexed.
+    
+    If the block's tokens are already known, func() is called immediately.
+    
+    """
+    highlighter.highlighter(block.document()).when_ready(block, func)
+
+
 def update(block):
     """Retokenize the given block, saving the tokens in the UserData.
     
@@ -35,6 +35,7 @@ except ImportError:
 
 import app
 import plugin
+import qpopplerview.cache
 import resultfiles
 import signals
 import popplertools
@@ -73,6 +74,8 @@ def load(filename):
         doc = popplerqt5.Poppler.Document.loadFromData(data)
         if doc:
             _cache[key] = doc
+            # enables rendering pages in parallel
+            qpopplerview.cache.setdata(doc, data)
         return doc or None
 
 
@@ -28,11 +28,10 @@ import os
 import sys
 import weakref
 
-import qpopplerview
-
 import util
 import textedit
 import pointandclick
+import popplerlinks
 
 
 # cache point and click handlers for poppler documents
@@ -40,21 +39,19 @@ _cache = weakref.WeakKeyDictionary()
 
 
 def links(document):
+    """Returns the Links of the Poppler document.
+    
+    The links are read in a background thread and added to the returned
+    Links object while they come in. Use Links.prioritize() to read the links
+    of certain pages (e.g. the ones on screen) first.
+    
+    """
     try:
         return _cache[document]
     except KeyError:
         l = _cache[document] = Links()
-        with l:
-            import popplerqt5
-            with qpopplerview.lock(document):
-                for num in range(document.numPages()):
-                    page = document.page(num)
-                    for link in page.links():
-                        if isinstance(link, popplerqt5.Poppler.LinkBrowse):
-                            t = textedit.link(link.url())
-                            if t:
-                                filename = util.normpath(t.filename)
-                                l.add_link(filename, t.line, t.column, (num, link.linkArea()))
+        l.finish()
+        l.reader = popplerlinks.Reader(popplerlinks.pages(document), l)
         return l
 
 
@@ -64,6 +61,13 @@ class Links(pointandclick.Links):
     Only textedit:// urls are stored.
     
     """
+    reader = None
+    
+    def prioritize(self, pageNumbers):
+        """Reads the links of the specified pages first, if not already read."""
+        if self.reader:
+            self.reader.prioritize(pageNumbers)
+    
     def cursor(self, link, load=False):
         """Returns the destination of a link as a QTextCursor of the destination document.
         
@@ -149,6 +149,8 @@ class AbstractPopplerWidget(abstractviewwidget.AbstractViewWidget):
         surface.linkHovered.connect(self.slotLinkHovered)
         surface.linkLeft.connect(self.slotLinkLeft)
         surface.linkHelpRequested.connect(self.slotLinkHelpRequested)
+        self.view.verticalScrollBar().valueChanged.connect(self.slotVisiblePagesChanged)
+        self.view.horizontalScrollBar().valueChanged.connect(self.slotVisiblePagesChanged)
 
     def viewerName(self):
         """Return the viewerName() attribute of the panel."""
@@ -180,6 +182,7 @@ class AbstractPopplerWidget(abstractviewwidget.AbstractViewWidget):
                 self.view.load(document)
                 position = self._positions.get(doc, (0, 0, 0))
                 self.view.setPosition(position, True)
+                self.slotVisiblePagesChanged()
         except OSError:
             # the file is not found on the given path
             dlg = widgets.dialog.Dialog(buttons=('yes', 'no'))
@@ -197,6 +200,11 @@ class AbstractPopplerWidget(abstractviewwidget.AbstractViewWidget):
             else:
                 doc.ispresent = False
 
+    def slotVisiblePagesChanged(self):
+        """Reads the links of the pages on screen first."""
+        if self._links:
+            self._links.prioritize(page.pageNumber() for page in self.view.visiblePages())
+
     def clear(self):
         """Empties the view."""
         cur = self._currentViewdoc
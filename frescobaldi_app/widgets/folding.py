@@ -45,7 +45,7 @@ information.
 import collections
 
 from PyQt5.QtCore import QEvent, QObject, QPoint, QRect, QSize, Qt, QTimer
-from PyQt5.QtGui import QPainter, QPalette
+from PyQt5.QtGui import QPainter, QPalette, QTextBlock, QTextCursor
 from PyQt5.QtWidgets import QWidget
 
 import cursortools
@@ -94,31 +94,348 @@ class LinePainter(QObject):
         return True
 
 
+class DepthIndex(object):
+    """Keeps the fold levels of all blocks of a document, for fast queries.
+    
+    The Level of every block is stored in chunks of lines, and a segment tree
+    over the chunks keeps the sum of the levels and the lowest depth reached
+    within them. This way depth(), region() and friends need only a few steps
+    per chunk instead of walking through the document.
+    
+    Changed lines are stored as None and are only computed again (using the
+    fold_level function given on construction) when a query is done.
+    
+    """
+    chunksize = 64
+    
+    def __init__(self, document, fold_level):
+        self._document = document
+        self._fold_level = fold_level
+        levels = [fold_level(b) for b in cursortools.all_blocks(document)]
+        self._chunks = [_Chunk(levels[i:i+self.chunksize])
+                        for i in range(0, len(levels), self.chunksize)] or [_Chunk([])]
+        self._count = len(levels)
+        self._stale = set()     # chunks with changed or None levels
+        self._build()
+    
+    def __len__(self):
+        return self._count
+    
+    def replace(self, line, removed, added):
+        """Replace removed lines at line with added lines, to be computed later."""
+        self._count += added - removed
+        index, offset = self._find_line(line)
+        chunk = self._chunks[index]
+        if offset + removed <= len(chunk.levels):
+            chunk.levels[offset:offset+removed] = [None] * added
+            self._stale.add(chunk)
+            if len(chunk.levels) > 2 * self.chunksize or (
+                    not chunk.levels and len(self._chunks) > 1):
+                self._rechunk(index, index + 1)
+        else:
+            # the change spans multiple chunks, merge and split them again
+            last = index
+            end = offset + removed
+            while last < len(self._chunks) - 1 and end > len(self._chunks[last].levels):
+                end -= len(self._chunks[last].levels)
+                last += 1
+            levels = []
+            for c in self._chunks[index:last+1]:
+                levels.extend(c.levels)
+            del levels[offset:offset+removed]
+            levels[offset:offset] = [None] * added
+            self._chunks[index:last+1] = [_Chunk(levels)]
+            self._rechunk(index, index + 1)
+    
+    def invalidate(self, line):
+        """Compute the level of the line again on the next query."""
+        index, offset = self._find_line(line)
+        chunk = self._chunks[index]
+        if offset < len(chunk.levels):
+            chunk.levels[offset] = None
+            self._stale.add(chunk)
+    
+    def _rechunk(self, start, end):
+        """Split or drop the chunks from start to end, and rebuild the tree."""
+        levels = []
+        for c in self._chunks[start:end]:
+            levels.extend(c.levels)
+        size = self.chunksize
+        chunks = [_Chunk(levels[i:i+size]) for i in range(0, len(levels), size)]
+        if not chunks and len(self._chunks) == end - start:
+            chunks = [_Chunk([])]
+        self._chunks[start:end] = chunks
+        self._stale.update(chunks)
+        self._tree = None
+    
+    def _clean(self):
+        """Compute the changed lines and update the tree."""
+        if not self._stale:
+            return
+        if self._tree is None:
+            # the chunks changed, compute the start lines linearly
+            line = 0
+            for i, c in enumerate(self._chunks):
+                c.index = i
+                if c in self._stale:
+                    c.compute(line, self._document, self._fold_level)
+                line += len(c.levels)
+            self._stale.clear()
+            self._build()
+            return
+        # only the lengths of the stale chunks may have changed
+        delta = 0
+        for c in sorted(self._stale, key=lambda c: c.index):
+            line = self._prefix(c.index)[0] + delta
+            delta += len(c.levels) - self._tree[self._size + c.index][0]
+            c.compute(line, self._document, self._fold_level)
+        for c in self._stale:
+            self._update(c.index)
+        self._stale.clear()
+    
+    def _build(self):
+        """Build the segment tree over the chunks."""
+        for i, c in enumerate(self._chunks):
+            c.index = i
+            if c in self._stale:
+                self._stale.discard(c)
+        size = 1
+        while size < len(self._chunks):
+            size *= 2
+        self._size = size
+        self._tree = tree = [_empty] * (2 * size)
+        for i, c in enumerate(self._chunks):
+            tree[size + i] = c.summary()
+        for i in range(size - 1, 0, -1):
+            tree[i] = _combine(tree[2*i], tree[2*i+1])
+    
+    def _update(self, index):
+        """Update the tree after the chunk at index changed."""
+        tree = self._tree
+        i = self._size + index
+        tree[i] = self._chunks[index].summary()
+        i //= 2
+        while i:
+            tree[i] = _combine(tree[2*i], tree[2*i+1])
+            i //= 2
+    
+    def _prefix(self, index):
+        """Return (lines, depth) before the chunk at index."""
+        tree = self._tree
+        lines = depth = 0
+        i = self._size + index
+        while i > 1:
+            if i & 1:
+                node = tree[i - 1]
+                lines += node[0]
+                depth += node[1]
+            i //= 2
+        return lines, depth
+    
+    def _find_line(self, line):
+        """Return (chunk index, offset) for the line, using the chunk lengths."""
+        if self._tree is not None and not self._stale:
+            tree = self._tree
+            i = 1
+            while i < self._size:
+                if line < tree[2*i][0] or tree[2*i+1][0] == 0:
+                    i = 2 * i
+                else:
+                    line -= tree[2*i][0]
+                    i = 2 * i + 1
+            index = i - self._size
+            if index < len(self._chunks):
+                return index, line
+        # slow path, when the tree is not up to date
+        for index, c in enumerate(self._chunks):
+            if line < len(c.levels) or index == len(self._chunks) - 1:
+                return index, line
+            line -= len(c.levels)
+    
+    def level(self, line):
+        """Return the Level of the line."""
+        self._clean()
+        index, offset = self._find_line(line)
+        return self._chunks[index].levels[offset]
+    
+    def depth(self, line):
+        """Return the depth at the start of the line."""
+        self._clean()
+        index, offset = self._find_line(line)
+        depth = self._prefix(index)[1]
+        for level in self._chunks[index].levels[:offset]:
+            depth += level.stop + level.start
+        return depth
+    
+    def rfind(self, line, threshold, starts=True):
+        """Return the last line <= line with depth + stop < threshold, or -1.
+        
+        If starts is True, only lines that start a region are considered.
+        
+        """
+        self._clean()
+        index, offset = self._find_line(line)
+        lines, depth = self._prefix(index)
+        found = self._chunks[index].rfind(offset, depth, threshold, starts)
+        if found != -1:
+            return lines + found
+        # descend the tree to find the last chunk before index with a match
+        key = 3 if starts else 2
+        tree = self._tree
+        nodes = []
+        i = self._size + index
+        while i > 1:
+            if i & 1:
+                nodes.append(i - 1)
+            i //= 2
+        # nodes are left siblings, from near to far; compute their depths
+        depths = []
+        d = depth
+        for n in nodes:
+            d -= tree[n][1]
+            depths.append(d)
+        for n, d in zip(nodes, depths):
+            if d + tree[n][key] < threshold:
+                while n < self._size:
+                    right = 2 * n + 1
+                    rdepth = d + tree[2*n][1]
+                    if rdepth + tree[right][key] < threshold:
+                        n, d = right, rdepth
+                    else:
+                        n = 2 * n
+                index = n - self._size
+                lines = self._prefix(index)[0]
+                c = self._chunks[index]
+                return lines + c.rfind(len(c.levels) - 1, d, threshold, starts)
+        return -1
+    
+    def find(self, line, threshold):
+        """Return the first line >= line with depth + stop <= threshold, or -1."""
+        self._clean()
+        index, offset = self._find_line(line)
+        lines, depth = self._prefix(index)
+        c = self._chunks[index]
+        found = c.find(offset, depth, threshold)
+        if found != -1:
+            return lines + found
+        # descend the tree to find the first chunk after index with a match
+        tree = self._tree
+        nodes = []
+        i = self._size + index
+        while i > 1:
+            if not i & 1:
+                nodes.append(i + 1)
+            i //= 2
+        d = depth + tree[self._size + index][1]
+        for n in nodes:
+            if d + tree[n][2] <= threshold:
+                while n < self._size:
+                    if d + tree[2*n][2] <= threshold:
+                        n = 2 * n
+                    else:
+                        d += tree[2*n][1]
+                        n = 2 * n + 1
+                index = n - self._size
+                return self._prefix(index)[0] + self._chunks[index].find(0, d, threshold)
+            d += tree[n][1]
+        return -1
+
+
+class _Chunk(object):
+    """A number of consecutive lines in a DepthIndex."""
+    index = 0
+    
+    def __init__(self, levels):
+        self.levels = levels
+    
+    def compute(self, line, document, fold_level):
+        """Compute the missing levels, line is the number of our first line."""
+        levels = self.levels
+        for i, level in enumerate(levels):
+            if level is None:
+                levels[i] = fold_level(document.findBlockByNumber(line + i))
+    
+    def summary(self):
+        """Return (lines, sum, lowest depth + stop, idem for lines starting a region).
+        
+        The depths are relative to the start of the chunk.
+        
+        """
+        depth = 0
+        lowest = lowest_start = _inf
+        for stop, start in self.levels:
+            if depth + stop < lowest:
+                lowest = depth + stop
+            if start and depth + stop < lowest_start:
+                lowest_start = depth + stop
+            depth += stop + start
+        return len(self.levels), depth, lowest, lowest_start
+    
+    def rfind(self, offset, depth, threshold, starts):
+        """Return the last offset <= offset with depth + stop < threshold, or -1.
+        
+        depth is the depth at the start of the chunk.
+        
+        """
+        depths = []
+        for stop, start in self.levels[:offset+1]:
+            depths.append(depth + stop)
+            depth += stop + start
+        for i in range(len(depths) - 1, -1, -1):
+            if depths[i] < threshold and (not starts or self.levels[i].start):
+                return i
+        return -1
+    
+    def find(self, offset, depth, threshold):
+        """Return the first offset >= offset with depth + stop <= threshold, or -1.
+        
+        depth is the depth at the start of the chunk.
+        
+        """
+        for i, (stop, start) in enumerate(self.levels):
+            if i >= offset and depth + stop <= threshold:
+                return i
+            depth += stop + start
+        return -1
+
+
+_inf = float('inf')
+_empty = (0, 0, _inf, _inf)
+
+
+def _combine(a, b):
+    """Combine two segment tree nodes."""
+    return (a[0] + b[0], a[1] + b[1],
+            min(a[2], a[1] + b[2]), min(a[3], a[1] + b[3]))
+
+
 class Folder(QObject):
     """Manages the folding of a QTextDocument.
     
     You should inherit from this class to provide folding events.
     It is enough to implement the fold_events() method.
     
-    By default, simple caching is used to store the nesting depth every
-    20 lines. This makes the depth() method faster, which would otherwise count
-    the fold_events() for every block from the beginning of the document.
+    By default, a DepthIndex is used to store the fold level of every block.
+    This makes the depth() and region() methods fast, which would otherwise
+    walk through the fold_events() of all the blocks before or after a block.
+    The index is updated for the changed blocks on every document change.
     
-    The depth() caching expects that the fold_events that a text block
-    generates do not depend on the contents of a text block later in the
-    document.
+    The index expects that the fold_events that a text block generates do
+    not depend on the contents of a text block later in the document.
     
     If your fold_events() method generates events for a text block that depend
-    on a later block, you should disable caching by setting the
+    on a later block, you should disable the index by setting the
     cache_depth_lines instance (or class) attribute to zero.
     
     """
-    # cache depth() for every n lines (0=disable)
+    # use a DepthIndex (0=disable)
     cache_depth_lines = 20
     
     def __init__(self, doc):
         QObject.__init__(self, doc)
-        self._depth_cache = []      # cache result of depth()
+        self._index = None          # DepthIndex, created on first use
+        self._pending = []          # blocks with changed fold events
+        self._changed = None        # cursor selecting the changed blocks
         self._all_visible = None    # True when all are certainly visible
         doc.contentsChange.connect(self.slot_contents_change)
         self._timer = QTimer(singleShot=True, timeout=self.check_consistency)
@@ -137,17 +454,38 @@ class Folder(QObject):
         """Called when the document changes.
         
         Provides limited support for unhiding regions when the user types
-        text in it, and deletes the depth() cache for lines from position.
+        text in it, and updates the depth index for the changed lines.
         
         """
-        block = self.document().findBlock(position)
-        if self.cache_depth_lines:
-            chunk = block.blockNumber() // self.cache_depth_lines
-            del self._depth_cache[chunk:]
+        doc = self.document()
+        block = doc.findBlock(position)
+        if self._index is not None:
+            last = doc.findBlock(position + added)
+            if not last.isValid():
+                last = doc.lastBlock()
+            first = block.blockNumber() if block.isValid() else last.blockNumber()
+            added_lines = last.blockNumber() - first + 1
+            removed_lines = added_lines - doc.blockCount() + len(self._index)
+            if removed_lines < 0 or first + removed_lines > len(self._index):
+                self._index = None  # should not happen
+            else:
+                self._index.replace(first, removed_lines, added_lines)
         
         if self._all_visible:
             return
         
+        # remember the changed range for check_consistency()
+        end = min(position + added, doc.characterCount() - 1)
+        if self._changed is None:
+            self._changed = QTextCursor(doc)
+            self._changed.setPosition(position)
+            self._changed.setPosition(end, QTextCursor.KeepAnchor)
+        else:
+            start = min(position, self._changed.selectionStart())
+            end = max(end, self._changed.selectionEnd())
+            self._changed.setPosition(start)
+            self._changed.setPosition(end, QTextCursor.KeepAnchor)
+        
         if not block.isVisible():
             self.ensure_visible(block)
         else:
@@ -167,30 +505,72 @@ class Folder(QObject):
                     n = n.next()
                 start = block.next().position()
                 self.document().markContentsDirty(start, n.position() - start)
-        self._timer.start(250 + self.document().blockCount())
+        if self.cache_depth_lines:
+            self._timer.start(250)
+        else:
+            self._timer.start(250 + self.document().blockCount())
     
     def invalidate_depth_cache(self, block):
         """Makes sure the depth is recomputed from the specified block."""
+        self._index = None
+        self._pending = []
+    
+    def block_changed(self, block):
+        """Call this when the fold events of a block changed, but not its text.
+        
+        This can happen if the fold events depend on the result of a syntax
+        highlighter, that may highlight blocks after the changed text again.
+        The block is looked up in the depth index on its next use.
+        
+        """
+        if self._index is not None:
+            self._pending.append(block)
+    
+    def depth_index(self):
+        """Return the DepthIndex, or None if disabled by cache_depth_lines."""
         if self.cache_depth_lines:
-            chunk = block.blockNumber() // self.cache_depth_lines
-            del self._depth_cache[chunk:]
+            if self._index is None:
+                self._index = DepthIndex(self.document(), self.fold_level)
+                self._pending = []
+            elif self._pending:
+                pending, self._pending = self._pending, []
+                for block in pending:
+                    if block.isValid():
+                        self._index.invalidate(block.blockNumber())
+        return self._index
     
     def check_consistency(self):
         """Called some time after the last document change.
         
-        Walk through the whole document, unfolding folded lines that
+        Walk through the toplevel regions containing the changed blocks (or,
+        without depth index, the whole document), unfolding folded lines that
         - are in the toplevel
         - are in regions that have visible lines
         - are in regions that have visible sub-regions
         
         """
         show_blocks = []
-        self._all_visible = True    # for now at least ...
+        changed, self._changed = self._changed, None
+        index = self.depth_index()
+        if index is not None and changed is not None:
+            # only check the toplevel regions that contain changes
+            first = changed.document().findBlock(changed.selectionStart())
+            last = changed.document().findBlock(changed.selectionEnd())
+            r = self.region(first, -1)
+            if r:
+                first = r.start
+            r = self.region(last, -1)
+            if r:
+                last = r.end
+            start_depth = index.depth(first.blockNumber())
+        else:
+            first, last, start_depth = self.document().firstBlock(), QTextBlock(), 0
+            self._all_visible = True    # for now at least ...
         
         def blocks_gen():
             """Yield depth (before block), block and fold_level per block."""
-            depth = 0
-            for b in cursortools.all_blocks(self.document()):
+            depth = start_depth
+            for b in cursortools.forwards(first, last):
                 l = self.fold_level(b)
                 yield depth, b, l
                 depth += sum(l)
@@ -284,30 +664,17 @@ class Folder(QObject):
     def depth(self, block):
         """Return the number of active regions at the start of this block.
         
-        The default implementation simply counts all the fold_events from
-        the beginning of the document, using caching if the cache_depth_lines
-        instance attribute is set to a value > 0.
+        The default implementation uses the depth index if the
+        cache_depth_lines instance attribute is set to a value > 0, and
+        otherwise simply counts all the fold_events from the beginning of the
+        document.
         
         """
+        index = self.depth_index()
+        if index is not None:
+            return index.depth(block.blockNumber())
         depth = 0
         last = block.document().firstBlock()
-        if self.cache_depth_lines:
-            chunk = block.blockNumber() // self.cache_depth_lines
-            if chunk:
-                target = block.document().findBlockByNumber(chunk * self.cache_depth_lines)
-                if chunk <= len(self._depth_cache):
-                    depth = self._depth_cache[chunk - 1]
-                    last = target
-                else:
-                    # some values need to be computed first
-                    if self._depth_cache:
-                        depth = self._depth_cache[-1]
-                        last = block.document().findBlockByNumber(len(self._depth_cache) * self.cache_depth_lines)
-                    while last < target:
-                        depth += sum(self.fold_events(last))
-                        last = last.next()
-                        if last.blockNumber() % self.cache_depth_lines == 0:
-                            self._depth_cache.append(depth)
         while last < block:
             depth += sum(self.fold_events(last))
             last = last.next()
@@ -325,6 +692,9 @@ class Folder(QObject):
         find one more above that, etc. Use -1 to get the top-most region.
         
         """
+        index = self.depth_index()
+        if index is not None:
+            return self._region(index, block, depth)
         start = None
         start_depth = 0
         count = 0
@@ -349,6 +719,41 @@ class Folder(QObject):
             if end:
                 return Region(start, end)
         
+    def _region(self, index, block, depth):
+        """Implementation of region() using the depth index.
+        
+        Walking backwards from the block, the number of regions a block b
+        opens that are still open at the end of the block is the depth at the
+        end of the block minus the lowest depth within b (its depth + stop).
+        
+        """
+        doc = block.document()
+        num = block.blockNumber()
+        level = index.level(num)
+        target = index.depth(num) + level.stop + level.start
+        start = -1
+        start_depth = 0
+        line = num
+        while line >= 0:
+            line = index.rfind(line, target - start_depth)
+            if line == -1:
+                break
+            l = index.level(line)
+            start = line
+            start_depth = target - index.depth(line) - l.stop
+            if start_depth > depth > -1:
+                break
+            line -= 1
+        if start == -1:
+            return
+        l = index.level(start)
+        end = index.find(num + 1, index.depth(start) + l.stop) if num + 1 < len(index) else -1
+        if end == -1:
+            if num + 1 >= len(index):
+                return
+            end = len(index) - 1
+        return Region(doc.findBlockByNumber(start), doc.findBlockByNumber(end))
+        
     def fold(self, block, depth=0):
         """Fold the region the block is in.
         